@@ -1,446 +1,723 @@
-import json
-import re
 import time
 import os # <-- Added for os.path.basename
-from typing import List, Dict, Any, Optional, Tuple
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple, Iterator, Callable
+from bisect import bisect_left
 from difflib import SequenceMatcher
+from itertools import zip_longest
+from font_index import resolve_font, get_page_statistics
+from page_stream import PAGE_WINDOW, write_record, iter_records, count_records
+from text_normalize import extract_table_cell_content, clean_text, md_line_normalization
 
-# ... (all your helper functions like load_json_data, clean_text, etc. are unchanged) ...
-def load_json_data(json_file: str) -> Tuple[List[Dict], Dict[int, List[int]]]:
-    """Load spans and create page index for faster lookup"""
-    with open(json_file, 'r', encoding='utf-8') as f:
-        spans = json.load(f)
-    
-    # Sort by page_num, then by column, then by bbox[1] (y-coordinate)
-    spans.sort(key=lambda x: (x['page_num'], x['column'], x['bbox'][1] if len(x['bbox']) >= 2 else 0))
-    
-    # Create page index: page_num -> list of span indices
+# Character n-gram length of the per-page span candidate index
+CANDIDATE_NGRAM = 3
+# Aligned matching: spans scored around the expected position of a markdown line,
+# and the score from which the best of them is taken without a full page search
+ALIGN_LOOKAHEAD = 6
+ALIGN_LOOKBEHIND = 2
+ALIGN_MIN_SCORE = 0.9
+# Documents from this many pages on are aggregated in worker processes by default;
+# below it, starting the spawned workers costs more than they save
+AGGREGATION_PARALLEL_MIN_PAGES = 200
+# Pages queued per aggregation worker
+AGGREGATION_PAGES_IN_FLIGHT = 4
+# difflib treats popular characters as junk from this second-sequence length on,
+# so only shorter identical texts are guaranteed a ratio of 1.0
+AUTOJUNK_MIN_LENGTH = 200
+
+def iter_span_pages(spans_jsonl_file: str) -> Iterator[Tuple[str, Dict]]:
+    """
+    Read the span extractor's JSON Lines output one record at a time.
+    Yields ('fonts', record), then ('page', record) per page.
+    """
+    for record in iter_records(spans_jsonl_file):
+        if 'fonts' in record:
+            yield 'fonts', record
+        elif 'spans' in record:
+            yield 'page', record
+
+def sort_page_spans(spans: List[Dict]) -> Tuple[List[Dict], Dict[int, List[int]]]:
+    """Sort one page's spans by column, then by bbox[1] (y-coordinate), and index them for lookup"""
+    spans = sorted(spans, key=lambda x: (x['column'], x['bbox'][1] if len(x['bbox']) >= 2 else 0))
     page_index = {}
     for i, span in enumerate(spans):
         page_num = span.get('page_num', 1)
         if page_num not in page_index:
             page_index[page_num] = []
         page_index[page_num].append(i)
-    
     return spans, page_index
 
-def load_md_json_file(md_json_file: str) -> Tuple[Dict, List[Dict]]:
-    """Load markdown JSON file and return metadata and lines"""
-    with open(md_json_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    metadata = data.get('metadata', {})
-    lines = data.get('lines', [])
-    
-    return metadata, lines
-
-def is_hashed_header(md_text: str) -> bool:
+def cascade_ratio(matcher: SequenceMatcher, text: str, worth_scoring: Callable[[float], bool] = None,
+                  tier_counts: Dict[str, int] = None) -> Optional[float]:
     """
-    Check if the markdown text is a header (starts with #)
+    SequenceMatcher ratio of text (as first sequence) against the matcher's second sequence,
+    computed in tiers of increasing cost, each an upper bound of the next:
+      'identical': equal texts shorter than difflib's autojunk limit score exactly 1.0
+      'length':    2 * shorter length / total length (real_quick_ratio, from the lengths alone)
+      'chars':     quick_ratio(), the shared character counts
+      'ratio':     the full ratio()
+    worth_scoring(bound) tells whether a ratio of up to bound could still matter; as soon as
+    a bound fails it, None is returned without running the costlier tiers.
+    tier_counts, when given, counts the tier at which each call ended.
     """
-    text = md_text.strip()
-    return text.startswith('#')
+    span_text = matcher.b
+    if text == span_text and len(text) < AUTOJUNK_MIN_LENGTH:
+        tier = 'identical'
+        result = 1.0
+    else:
+        total = len(text) + len(span_text)
+        length_bound = 2.0 * min(len(text), len(span_text)) / total if total else 1.0
+        if worth_scoring is not None and not worth_scoring(length_bound):
+            tier, result = 'length', None
+        else:
+            matcher.set_seq1(text)
+            if worth_scoring is not None and not worth_scoring(matcher.quick_ratio()):
+                tier, result = 'chars', None
+            else:
+                tier, result = 'ratio', matcher.ratio()
+    if tier_counts is not None:
+        tier_counts[tier] = tier_counts.get(tier, 0) + 1
+    return result
 
-def is_table_content(md_text: str) -> bool:
+def cleaned_similarity(cleaned1: str, cleaned2: str, ratio_cache: Dict[Tuple[str, str], float] = None) -> float:
     """
-    Determine if the markdown text is part of a table.
-    Tables in markdown are identified by the presence of | characters.
+    Similarity of two texts already passed through clean_text.
+    ratio_cache holds ratios already computed for (cleaned1, cleaned2) pairs,
+    such as the per-page 'ratios' of build_span_candidate_index.
     """
-    # Remove leading/trailing whitespace
-    text = md_text.strip()
-    
-    # Check if the line starts and ends with | (typical table row)
-    if text.startswith('|') and text.endswith('|'):
-        return True
-    
-    # Check if the line contains multiple | characters (likely a table row)
-    if text.count('|') >= 2:
-        return True
-    
-    return False
+    if ratio_cache is not None and (cleaned1, cleaned2) in ratio_cache:
+        return ratio_cache[(cleaned1, cleaned2)]
+    return cascade_ratio(SequenceMatcher(None, '', cleaned2), cleaned1)
 
-def clean_table_text(text: str) -> str:
-    """
-    Clean table text for better matching by removing table-specific characters
-    and handling multi-line content.
-    """
-    if not text:
-        return ""
-    
-    # Remove | characters used for table formatting
-    cleaned = text.replace('|', '')
-    
-    # Handle <br> tags in table cells by replacing with spaces
-    cleaned = re.sub(r'<br\s*/?>', ' ', cleaned)
-    
-    # Remove extra whitespace
-    cleaned = ' '.join(cleaned.split())
-    
-    return cleaned.strip()
+def text_ngrams(text: str, n: int = CANDIDATE_NGRAM) -> set:
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
 
-def extract_table_cell_content(md_text: str) -> List[str]:
+def build_span_candidate_index(spans: List[Dict], page_index: Dict[int, List[int]]) -> Dict[int, Dict]:
     """
-    Extract individual cell contents from a table row.
+    Per-page lookup structures for find_best_matching_span_by_page, built once per page.
+    Span texts are cleaned once (plain and with table cleaning); 'exact' maps a cleaned text
+    to its span indices and 'ngrams' is an inverted character n-gram index, so a markdown
+    line is only scored against spans that share an n-gram with it. 'table_rows' holds the
+    find_tables rows (spans with a "table_cell") as (cell texts, spans) in column order,
+    keyed by the first word of the row.
+    'ratios' keeps every full ratio computed on the page for reuse as the match confidence.
+    Spans too short to ever match are left out. Index lists are in span order.
     """
-    if not is_table_content(md_text):
-        return []
-    
-    # Remove leading and trailing |
-    content = md_text.strip()
-    if content.startswith('|'):
-        content = content[1:]
-    if content.endswith('|'):
-        content = content[:-1]
-    
-    # Split by | to get individual cells
-    cells = [cell.strip() for cell in content.split('|')]
-    
-    # Clean each cell
-    cleaned_cells = []
-    for cell in cells:
-        # Remove markdown formatting like **text**
-        cell_cleaned = re.sub(r'\*\*(.*?)\*\*', r'\1', cell)
-        # Handle <br> tags
-        cell_cleaned = re.sub(r'<br\s*/?>', ' ', cell_cleaned)
-        # Clean up whitespace
-        cell_cleaned = ' '.join(cell_cleaned.split())
-        if cell_cleaned:  # Only add non-empty cells
-            cleaned_cells.append(cell_cleaned)
-    
-    return cleaned_cells
-
-def clean_text(text: str, is_table: bool = False) -> str:
-    """Clean text for comparison by removing extra whitespace and special characters"""
-    # Remove extra whitespace, newlines, and normalize
-    text = re.sub(r'\s+', ' ', text.strip())
-    
-    # For table content, remove | characters and handle <br> tags
-    if is_table:
-        text = clean_table_text(text)
-    
-    # Remove markdown formatting for comparison
-    text = re.sub(r'[*_#`\[\]()]+', '', text)
-    return text.lower()
-
-def clean_md_line(md_line: str) -> str:
-    """Clean markdown line by removing markdown formatting"""
-    # Remove leading/trailing whitespace
-    cleaned = md_line.strip()
-    
-    # Handle table content first
-    if is_table_content(cleaned):
-        cleaned = clean_table_text(cleaned)
-    
-    # Remove markdown headers (# ## ###)
-    cleaned = re.sub(r'^#{1,6}\s*', '', cleaned)
-    
-    # Remove bold/italic markers (**text** or *text*)
-    cleaned = re.sub(r'\*{1,2}([^*]+)\*{1,2}', r'\1', cleaned)
-    
-    cleaned = re.sub(r'^[-+=@]+\s*', '', cleaned)
-    
-    # Remove other markdown formatting
-    cleaned = re.sub(r'[_`\[\]()]+', '', cleaned)
-    
-    return cleaned.strip()
+    candidate_index = {}
+    for page_number, span_indices in page_index.items():
+        entry = {'spans': [], 'clean': {}, 'clean_table': {}, 'exact': {}, 'exact_table': {},
+                 'ngrams': {}, 'table_rows': {}, 'matchers': {}, 'ratios': {}}
+        row_cells = {}
+        for span_idx in span_indices:
+            span_text = spans[span_idx]['text'].strip()
+            table_cell = spans[span_idx].get('table_cell')
+            if table_cell:
+                row_cells.setdefault((table_cell[0], table_cell[1]), []).append((table_cell[2], span_idx))
+            plain = clean_text(span_text)
+            # Table cleaning only changes texts with cell separators or line breaks
+            table = clean_text(span_text, True) if '|' in span_text or '<' in span_text else plain
+            entry['clean'][span_idx] = plain
+            entry['clean_table'][span_idx] = table
+            if len(plain) >= 3:
+                entry['exact'].setdefault(plain, []).append(span_idx)
+            if len(table) >= 3:
+                entry['exact_table'].setdefault(table, []).append(span_idx)
+            if len(plain) < 3 and len(table) < 3:
+                continue
+            entry['spans'].append(span_idx)
+            grams = text_ngrams(plain) if table is plain else text_ngrams(plain) | text_ngrams(table)
+            for gram in grams:
+                entry['ngrams'].setdefault(gram, []).append(span_idx)
+        for cells in row_cells.values():
+            row_spans = [span_idx for _, span_idx in sorted(cells)]
+            cell_texts = [entry['clean_table'][span_idx] for span_idx in row_spans if entry['clean_table'][span_idx]]
+            if cell_texts:
+                entry['table_rows'].setdefault(cell_texts[0].split()[0], []).append((cell_texts, row_spans))
+        candidate_index[page_number] = entry
+    return candidate_index
 
-def similarity_score(text1: str, text2: str) -> float:
-    """Calculate similarity between two text strings"""
-    return SequenceMatcher(None, clean_text(text1), clean_text(text2)).ratio()
+def span_matcher(entry: Dict, span_idx: int) -> SequenceMatcher:
+    """SequenceMatcher with the span's cleaned text as its (cached) second sequence"""
+    matcher = entry['matchers'].get(span_idx)
+    if matcher is None:
+        matcher = SequenceMatcher(None, '', entry['clean'][span_idx])
+        entry['matchers'][span_idx] = matcher
+    return matcher
 
-def find_best_matching_span_by_page(md_line_data: Dict, spans: List[Dict], page_index: Dict[int, List[int]], 
-                                   used_spans: set, min_similarity: float = 0.6) -> Optional[Dict]:
-    """Find best matching span within the same page as the markdown line"""
+def md_line_searches(md_line_data: Dict, page_index: Dict[int, List[int]]) -> Optional[Tuple[bool, List[Tuple[str, str, str]]]]:
+    """
+    Prepare a markdown line for matching. Returns (is_table, searches) with searches as
+    (original text, text for the similarity ratio, text for containment/exact checks),
+    or None when the line is empty, too short or on a page without spans.
+    """
     md_text = md_line_data.get('text', '')
     page_number = md_line_data.get('page_number', 1)
     
     if not md_text.strip():
         return None
     
-    # Check if this is table content
-    is_table = is_table_content(md_text)
+    # Table flag and cleaned variants are computed once per line and cached on it
+    normalized = md_line_normalization(md_line_data)
+    is_table = normalized['is_table']
+    cleaned_md_line = normalized['display']
     
-    # Clean the markdown line
-    cleaned_md_line = clean_md_line(md_text)
-    
-    if len(clean_text(cleaned_md_line, is_table)) < 3:  # Skip very short lines
+    if len(normalized['table_key']) < 3:  # Skip very short lines
         return None
     
     # Only search spans from the same page
     if page_number not in page_index:
         return None
     
-    span_indices = page_index[page_number]
-    
-    best_span = None
-    best_score = 0
-    best_index = -1
-    
     # Prepare search texts
-    search_texts = []
+    searches = []
     if is_table:
         # For table content, extract individual cells
-        table_cells = extract_table_cell_content(md_text)
-        search_texts.extend(table_cells)
-        # Also include the full cleaned line
-        search_texts.append(cleaned_md_line)
-    else:
-        search_texts = [cleaned_md_line]
-    
-    # Search only spans from the same page
-    for span_idx in span_indices:
-        if span_idx in used_spans:
+        searches = [(cell, clean_text(cell), clean_text(cell, True))
+                    for cell in extract_table_cell_content(md_text)]
+    # Also include the full cleaned line, whose keys are already normalized
+    searches.append((cleaned_md_line, normalized['match_key'], normalized['table_key']))
+    return is_table, searches
+
+def span_match_score(entry: Dict, span_idx: int, searches: List[Tuple[str, str, str]], is_table: bool,
+                     worth_scoring: Callable[[float], bool]) -> float:
+    """
+    Best score of a span over the search texts of a markdown line, or 0 when no search
+    text scores a value that worth_scoring(score) accepts.
+    """
+    cleaned_span = entry['clean_table' if is_table else 'clean'][span_idx]
+    if len(cleaned_span) < 3:
+        return 0
+    matcher = span_matcher(entry, span_idx)
+    
+    # Try matching against all search texts
+    span_score = 0
+    for search_text, ratio_text, cleaned_search in searches:
+        if cleaned_search == cleaned_span:
+            # Boost score for exact matches after cleaning
+            span_score = max(span_score, 1.0)
             continue
-        
-        span = spans[span_idx]
-        span_text = span['text'].strip()
-        
-        if len(clean_text(span_text, is_table)) < 3:
+        # Boost score if search text contains span text or vice versa;
+        # for table cells, boost score if span text is contained in the cell
+        bonus = 0.2 if cleaned_search in cleaned_span or cleaned_span in cleaned_search else 0
+        floor = 0.8 if is_table and len(search_text) > 20 and cleaned_span in cleaned_search else 0
+        ratio = cascade_ratio(matcher, ratio_text, lambda bound: worth_scoring(max(bound + bonus, floor)))
+        if ratio is None:
             continue
-        
-        # Try matching against all search texts
-        for search_text in search_texts:
-            if not search_text:
+        entry['ratios'][(ratio_text, matcher.b)] = ratio
+        span_score = max(span_score, ratio + bonus, floor)
+    return span_score
+
+def table_row_spans(entry: Dict, table_key: str, used_spans: set) -> List[int]:
+    """
+    Unused spans of the first find_tables row of a page (candidate index entry) whose
+    cell texts all appear in the line's table key, in column order; [] when there is none.
+    """
+    words = table_key.split(None, 1)
+    if not words:
+        return []
+    for cell_texts, row_spans in entry['table_rows'].get(words[0], ()):
+        position = 0
+        for cell_text in cell_texts:
+            position = table_key.find(cell_text, position)
+            if position == -1:
+                break
+            position += len(cell_text)
+        else:
+            unused = [span_idx for span_idx in row_spans if span_idx not in used_spans]
+            if unused:
+                return unused
+    return []
+
+def best_span_index(entry: Dict, is_table: bool, searches: List[Tuple[str, str, str]], used_spans: set,
+                    min_similarity: float = 0.6) -> int:
+    """
+    Index of the best unused span of a page (candidate index entry) for a prepared
+    markdown line, or -1. A line that reads as a find_tables row of the page is first
+    matched among that row's cell spans only, and against the whole page when none of
+    them reaches min_similarity.
+    """
+    row_spans = table_row_spans(entry, searches[-1][2], used_spans)
+    if row_spans:
+        best_index = scored_span_index(entry, is_table, searches, used_spans, min_similarity, set(row_spans))
+        if best_index != -1:
+            return best_index
+    return scored_span_index(entry, is_table, searches, used_spans, min_similarity)
+
+def scored_span_index(entry: Dict, is_table: bool, searches: List[Tuple[str, str, str]], used_spans: set,
+                      min_similarity: float, within: set = None) -> int:
+    """
+    Index of the best unused span of the page (or of the spans within), or -1. In page
+    order, the first span scoring 0.9 or more wins, else the first one with the best
+    score; the index only decides which spans need scoring.
+    """
+    best_score = 0
+    best_index = -1
+    
+    # Exact hit: an unused span equal to a search text scores 1.0, so it is the answer
+    # unless an earlier span also scores 0.9 or more
+    exact = entry['exact_table' if is_table else 'exact']
+    for _, _, cleaned_search in searches:
+        for span_idx in exact.get(cleaned_search, ()):
+            if span_idx not in used_spans and (within is None or span_idx in within):
+                if best_index == -1 or span_idx < best_index:
+                    best_score, best_index = 1.0, span_idx
+                break
+    
+    # Candidates: spans sharing a character n-gram with a search text, most shared first
+    # so a strong match is found early and bounds the rest. Texts shorter than an n-gram
+    # cannot be looked up and fall back to every span of the page.
+    shared = None
+    if within is not None:
+        candidates = sorted(within)
+    elif best_index != -1:
+        # With an exact hit only the spans before it are left to check
+        candidates = entry['spans'][:bisect_left(entry['spans'], best_index)]
+    elif any(len(ratio_text) < CANDIDATE_NGRAM or len(cleaned_search) < CANDIDATE_NGRAM
+             for _, ratio_text, cleaned_search in searches):
+        candidates = entry['spans']
+    else:
+        shared = {}
+        for _, ratio_text, cleaned_search in searches:
+            for gram in text_ngrams(ratio_text) | text_ngrams(cleaned_search):
+                for span_idx in entry['ngrams'].get(gram, ()):
+                    shared[span_idx] = shared.get(span_idx, 0) + 1
+        candidates = sorted(shared, key=lambda span_idx: (-shared[span_idx], span_idx))
+    
+    # Among the scored spans, the first one in page order scoring 0.9 or more wins, otherwise
+    # the first one with the best score; cascade_ratio only runs the full comparison when an
+    # upper bound could still change that outcome. Spans sharing no n-gram with the line can
+    # still score above min_similarity (e.g. "ab-cd-ef-gh" for "ab cd ef gh"), so when no
+    # candidate matches, the rest of the page is scored as well. A span without a shared
+    # n-gram that would beat a matching candidate is not found; this is the prefilter's cost.
+    def can_win(bound, span_idx):
+        if bound < min_similarity:
+            return False
+        if best_score >= 0.9:
+            return bound >= 0.9 and span_idx < best_index
+        return bound >= 0.9 or bound > best_score or (bound == best_score and span_idx < best_index)
+    
+    def score_spans(span_indices):
+        nonlocal best_score, best_index
+        for span_idx in span_indices:
+            if span_idx in used_spans:
+                continue
+            if best_score >= 0.9 and span_idx > best_index:
                 continue
             
-            # Calculate similarity score
-            score = similarity_score(search_text, span_text)
-            
-            # Clean versions for containment check
-            cleaned_search = clean_text(search_text, is_table)
-            cleaned_span = clean_text(span_text, is_table)
-            
-            # Boost score if search text contains span text or vice versa
-            if cleaned_search in cleaned_span or cleaned_span in cleaned_search:
-                score += 0.2
-            
-            # Boost score for exact matches after cleaning
-            if cleaned_search == cleaned_span:
-                score = 1.0
-            
-            # For table cells, boost score if span text is contained in the cell
-            if is_table and len(search_text) > 20:  # Longer table cell content
-                if cleaned_span in cleaned_search:
-                    score = max(score, 0.8)
-            
-            if score > best_score and score >= min_similarity:
-                best_score = score
-                best_span = span
+            span_score = span_match_score(entry, span_idx, searches, is_table,
+                                          lambda bound: can_win(bound, span_idx))
+            if span_score >= min_similarity and can_win(span_score, span_idx):
+                best_score = span_score
                 best_index = span_idx
-        
-        # Early termination for high-confidence matches
-        if best_score >= 0.9:
-            break
     
-    if best_span and best_index != -1:
+    score_spans(candidates)
+    if best_index == -1 and shared is not None:
+        score_spans(span_idx for span_idx in entry['spans'] if span_idx not in shared)
+    return best_index
+
+def find_best_matching_span_by_page(md_line_data: Dict, spans: List[Dict], page_index: Dict[int, List[int]], 
+                                   used_spans: set, min_similarity: float = 0.6,
+                                   candidate_index: Dict[int, Dict] = None) -> Optional[Dict]:
+    """
+    Find best matching span within the same page as the markdown line.
+    candidate_index (from build_span_candidate_index) is built on the fly when not given.
+    """
+    prepared = md_line_searches(md_line_data, page_index)
+    if prepared is None:
+        return None
+    is_table, searches = prepared
+    page_number = md_line_data.get('page_number', 1)
+    if candidate_index is None:
+        candidate_index = build_span_candidate_index(spans, {page_number: page_index[page_number]})
+    
+    best_index = best_span_index(candidate_index[page_number], is_table, searches, used_spans, min_similarity)
+    if best_index != -1:
         used_spans.add(best_index)
-        return best_span
+        return spans[best_index]
     
     return None
 
-def decode_font_flags(flags, font_name):
+def align_md_page(md_lines: List[Dict], spans: List[Dict], page_index: Dict[int, List[int]],
+                  candidate_index: Dict[int, Dict], used_spans: set, align_stats: Dict[str, int] = None,
+                  min_similarity: float = 0.6) -> List[Optional[Dict]]:
     """
-    Decode PyMuPDF font flags and return both styles list and individual boolean flags.
-    This version includes a more robust check for bold style.
+    Match one page of markdown lines by walking them and the spans in reading order together.
+    Each line is scored against a small window of spans around the position after the last
+    match; the best window span is taken when it scores ALIGN_MIN_SCORE or more (ties go to
+    the span nearest that position). Other lines are outliers and fall back to the full page
+    search of best_span_index. A single outlier leaves the walk where it is; a second one in
+    a row means the reading order moved, and the walk continues from where it matched.
+    align_stats, when given, counts 'window' and 'fallback' matches.
+    Returns the matched span (or None) per line.
     """
-    styles = []
-    
-    # Robust check for bold: checks flags AND font name
-    is_bold = bool(flags & 16) or any(s in font_name.lower() for s in ['bold', 'black', 'heavy'])
-    
-    # Standard checks for other styles
-    is_italic = bool(flags & 2)      # FONTFLAG_ITALIC = 2  
-    is_monospace = bool(flags & 8)   # FONTFLAG_MONOSPACE = 8
-    is_serifed = bool(flags & 4)     # FONTFLAG_SERIFED = 4
-    is_superscript = bool(flags & 1) # FONTFLAG_SUPERSCRIPT = 1
-    
-    if is_superscript: styles.append("superscript")
-    if is_italic:      styles.append("italic") 
-    if is_serifed:     styles.append("serifed")
-    if is_monospace:   styles.append("monospace")
-    if is_bold:        styles.append("bold")
-    
-    # Return "normal" if no other styles are detected
-    final_styles = styles if styles else ["normal"]
-    
-    return final_styles, is_bold, is_italic, is_monospace
+    cursors = {}
+    previous_fallback = False
+    matches = []
+    for md_line_data in md_lines:
+        prepared = md_line_searches(md_line_data, page_index)
+        if prepared is None:
+            matches.append(None)
+            continue
+        is_table, searches = prepared
+        page_number = md_line_data.get('page_number', 1)
+        entry = candidate_index[page_number]
+        
+        # Window: ALIGN_LOOKBEHIND spans before the expected position to ALIGN_LOOKAHEAD after,
+        # nearest first, ahead before behind
+        position = bisect_left(entry['spans'], cursors.get(page_number, 0))
+        ahead = entry['spans'][position:position + ALIGN_LOOKAHEAD]
+        behind = entry['spans'][max(0, position - ALIGN_LOOKBEHIND):position][::-1]
+        window = [span_idx for pair in zip_longest(ahead, behind) for span_idx in pair if span_idx is not None]
+        
+        best_score = 0
+        best_index = -1
+        for span_idx in window:
+            if span_idx in used_spans:
+                continue
+            span_score = span_match_score(entry, span_idx, searches, is_table,
+                                          lambda bound: bound > best_score and bound >= ALIGN_MIN_SCORE)
+            if span_score > best_score and span_score >= ALIGN_MIN_SCORE:
+                best_score = span_score
+                best_index = span_idx
+        
+        stat = 'window'
+        if best_index == -1:
+            best_index = best_span_index(entry, is_table, searches, used_spans, min_similarity)
+            stat = 'fallback'
+        if best_index == -1:
+            matches.append(None)
+            continue
+        
+        used_spans.add(best_index)
+        if stat == 'window' or previous_fallback:
+            cursors[page_number] = best_index + 1
+        previous_fallback = stat == 'fallback'
 
-# CHANGED: The function NAME is the same, but it now accepts full paths
-def aggregate_md_to_spans(md_json_file: str, spans_json_file: str, output_file: str):
+        if align_stats is not None:
+            align_stats[stat] = align_stats.get(stat, 0) + 1
+        matches.append(spans[best_index])
+    return matches
+
+def aggregate_md_line(md_line_data: Dict, matching_span: Optional[Dict], font_table: List[Dict],
+                      ratio_cache: Dict[Tuple[str, str], float] = None) -> Dict:
     """
-    Main function to aggregate MD JSON lines with corresponding spans.
-    Accepts full input and output paths as arguments.
+    Build the aggregated entry of one markdown line, with span features when it was matched.
+    ratio_cache (the page's candidate index 'ratios') spares recomputing the match confidence.
     """
-    # This is used for your print statements
-    pdf_name = os.path.basename(spans_json_file).replace('spans_', '').replace('.json', '.pdf')
-    start_time = time.time()
+    line_num = md_line_data.get('line_number', 0)
+    page_num = md_line_data.get('page_number', 1)
+    md_text = md_line_data.get('text', '')
+    normalized = md_line_normalization(md_line_data)
+    is_table = normalized['is_table']
+    is_hashed = normalized['is_hashed']
+    
+    if not matching_span:
+        return {
+            "line_number": line_num,
+            "page_number": page_num,
+            "is_in_table": is_table,
+            "is_hashed": is_hashed,
+            "md_text_original": md_text,
+            "md_text_cleaned": normalized['display'],
+            "span_text": None,
+            "span_match": False,
+            "features": None,
+            "match_confidence": None
+        }
     
-    print(f"Loading spans data from {os.path.basename(spans_json_file)}...")
-    load_start = time.time()
-    spans, page_index = load_json_data(spans_json_file)
-    load_end = time.time()
-    print(f"  Spans loaded in {load_end - load_start:.2f} seconds")
-    print(f"  Loaded {len(spans)} spans across {len(page_index)} pages")
-    
-    print(f"Loading markdown JSON from {os.path.basename(md_json_file)}...")
-    md_start = time.time()
-    metadata, md_lines = load_md_json_file(md_json_file)
-    md_end = time.time()
-    print(f"  Markdown JSON loaded in {md_end - md_start:.2f} seconds")
-    print(f"  Document metadata: {metadata.get('title', 'No title')}")
+    # Features come from the line's first font, already decoded in the font table
+    fonts = matching_span.get("fonts", [])
+    first_font = resolve_font(fonts[0] if fonts else None, font_table)
+    
+    features = {
+        "page_num": matching_span.get("page_num"),
+        "column": matching_span.get("column"),
+        "bbox": matching_span.get("bbox"),
+        "font_id": first_font.get("font_id"),
+        "font_name": first_font.get("font_name", ""),
+        "font_size": first_font.get("font_size", 0),
+        "font_styles": first_font.get("font_styles", ["normal"]),
+        "is_bold": first_font.get("is_bold", False),
+        "is_italic": first_font.get("is_italic", False),
+        "is_monospace": first_font.get("is_monospace", False),
+        "color": first_font.get("color", 0)
+    }
     
-    print(f"Processing {len(md_lines)} lines from markdown JSON...")
-    process_start = time.time()
+    confidence = cleaned_similarity(normalized['match_key'], clean_text(matching_span["text"]), ratio_cache)
+    
+    return {
+        "line_number": line_num,
+        "page_number": page_num,
+        "is_in_table": matching_span.get("is_in_table",False),
+        "is_hashed": is_hashed,
+        "md_text_original": md_text,
+        "md_text_cleaned": normalized['display'],
+        "span_text": matching_span["text"],
+        "span_match": True,
+        "features": features,
+        "match_confidence": round(confidence, 3)
+    }
+
+def aggregate_page(md_page: Dict, span_page: Optional[Dict], font_table: List[Dict], aligned: bool = False) -> Dict:
+    """
+    Aggregate one markdown page with the span page of the same number (None when it has no spans).
+    Matching never leaves the page, so pages are independent; this is the unit of work of
+    the aggregation workers.
+    Returns {'record': output page record, 'counts': {...}, 'unmatched_samples': [...],
+             'align_stats': {...}} (at most 5 unmatched samples).
+    """
+    page_num = md_page['page_number']
+    if span_page is not None:
+        spans, page_index = sort_page_spans(span_page['spans'])
+        candidate_index = build_span_candidate_index(spans, page_index)
+    else:
+        spans, page_index, candidate_index = [], {}, {}
     
-    aggregated_data = []
+    counts = {'total': 0, 'matched': 0, 'table': 0, 'table_matched': 0, 'hashed': 0, 'hashed_matched': 0}
+    unmatched_samples = []
+    align_stats = {}
     used_spans = set()
-    unmatched_lines = []
-    table_lines_processed = 0
-    table_lines_matched = 0
-    hashed_lines_processed = 0
-    hashed_lines_matched = 0
-    page_matches = {}
-    
-    for md_line_data in md_lines:
+    aggregated_lines = []
+    if aligned:
+        aligned_matches = align_md_page(md_page['lines'], spans, page_index, candidate_index,
+                                        used_spans, align_stats)
+    for line_position, md_line_data in enumerate(md_page['lines']):
         line_num = md_line_data.get('line_number', 0)
-        page_num = md_line_data.get('page_number', 1)
         md_text = md_line_data.get('text', '')
+        counts['total'] += 1
         
-        if line_num % 100 == 0:
-            elapsed = time.time() - process_start
-            rate = line_num / elapsed if elapsed > 0 else 0
-            print(f"  Processed {line_num}/{len(md_lines)} lines ({rate:.1f} lines/sec)")
-        
-        is_table = is_table_content(md_text)
+        normalized = md_line_normalization(md_line_data)
+        is_table = normalized['is_table']
         if is_table:
-            table_lines_processed += 1
+            counts['table'] += 1
         
-        is_hashed = is_hashed_header(md_text)
+        is_hashed = normalized['is_hashed']
         if is_hashed:
-            hashed_lines_processed += 1
+            counts['hashed'] += 1
         
-        if page_num not in page_matches:
-            page_matches[page_num] = {'total': 0, 'matched': 0}
-        page_matches[page_num]['total'] += 1
-        
-        matching_span = find_best_matching_span_by_page(
-            md_line_data, spans, page_index, used_spans
-        )
+        if aligned:
+            matching_span = aligned_matches[line_position]
+        else:
+            matching_span = find_best_matching_span_by_page(
+                md_line_data, spans, page_index, used_spans, candidate_index=candidate_index
+            )
         
         if matching_span:
+            counts['matched'] += 1
             if is_table:
-                table_lines_matched += 1
+                counts['table_matched'] += 1
             if is_hashed:
-                hashed_lines_matched += 1
-            
-            page_matches[page_num]['matched'] += 1
-                
-        
-            # Extract features from the matching span, handling fonts array
-            fonts = matching_span.get("fonts", [])
-            first_font = fonts[0] if fonts else {}
-            
-            font_flags = first_font.get("font_flags", 0)
-            font_name = first_font.get("font_name", "")  # ✅ Added this line
-            font_styles, is_bold, is_italic, is_monospace = decode_font_flags(font_flags, font_name)  # ✅ Fixed function call
-            
-            features = {
-                "page_num": matching_span.get("page_num"),
-                "column": matching_span.get("column"),
-                "bbox": matching_span.get("bbox"),
-                "font_name": font_name,  # Using the variable we already extracted
-                "font_size": first_font.get("font_size", 0),
-                "font_styles": font_styles,
-                "is_bold": is_bold,
-                "is_italic": is_italic,
-                "is_monospace": is_monospace,
-                "color": first_font.get("color", 0)
-            }
-            
-            confidence = similarity_score(clean_md_line(md_text), matching_span["text"])
-            
-            aggregated_data.append({
-                "line_number": line_num,
-                "page_number": page_num,
-                "is_in_table": matching_span.get("is_in_table",False),
-                "is_hashed": is_hashed,
-                "md_text_original": md_text,
-                "md_text_cleaned": clean_md_line(md_text),
-                "span_text": matching_span["text"],
-                "span_match": True,
-                "features": features,
-                "match_confidence": round(confidence, 3)
-            })
-        else:
-            unmatched_lines.append({
+                counts['hashed_matched'] += 1
+        elif len(unmatched_samples) < 5:
+            unmatched_samples.append({
                 "line_number": line_num,
                 "page_number": page_num,
                 "is_in_table": is_table,
                 "is_hashed": is_hashed,
                 "text_original": md_text,
-                "text_cleaned": clean_md_line(md_text)
-            })
-            
-            aggregated_data.append({
-                "line_number": line_num,
-                "page_number": page_num,
-                "is_in_table": is_table,
-                "is_hashed": is_hashed,
-                "md_text_original": md_text,
-                "md_text_cleaned": clean_md_line(md_text),
-                "span_text": None,
-                "span_match": False,
-                "features": None,
-                "match_confidence": None
+                "text_cleaned": normalized['display']
             })
+        
+        aggregated_lines.append(aggregate_md_line(md_line_data, matching_span, font_table,
+                                                  candidate_index.get(page_num, {}).get('ratios')))
+    
+    counts['spans_used'] = len(used_spans)
+    # Page statistics over the matched lines, as the pair features use them
+    page_stats = get_page_statistics([line for line in aggregated_lines if line['span_match']])
+    return {
+        'record': {"page_number": page_num, "page_stats": page_stats, "lines": aggregated_lines},
+        'counts': counts,
+        'unmatched_samples': unmatched_samples,
+        'align_stats': align_stats,
+    }
+
+def resolve_aggregation_workers(page_count: int, requested_workers=None) -> int:
+    """
+    Number of aggregation worker processes. An explicit request wins (1 = sequential);
+    otherwise long documents use every core and short ones stay in-process.
+    """
+    if requested_workers is not None:
+        return max(1, min(int(requested_workers), page_count or 1))
+    if page_count < AGGREGATION_PARALLEL_MIN_PAGES:
+        return 1
+    return max(1, min(os.cpu_count() or 1, page_count // PAGE_WINDOW))
+
+def aggregate_pages_parallel(page_pairs: Iterator[Tuple[Dict, Optional[Dict]]], font_table: List[Dict],
+                             aligned: bool, workers: int) -> Iterator[Dict]:
+    """
+    Run aggregate_page over a stream of (markdown page, span page) pairs in worker processes.
+    At most AGGREGATION_PAGES_IN_FLIGHT pages per worker are queued, so memory stays bounded
+    like the sequential stream; results are yielded in page order.
+    """
+    # spawn: the aggregator may run next to other threads of the pipeline, which is not fork-safe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        pending = deque()
+        for md_page, span_page in page_pairs:
+            pending.append(executor.submit(aggregate_page, md_page, span_page, font_table, aligned))
+            if len(pending) >= workers * AGGREGATION_PAGES_IN_FLIGHT:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+# CHANGED: The function NAME is the same, but it now accepts full paths
+def aggregate_md_to_spans(md_json_file: str, spans_json_file: str, output_file: str, aligned: bool = False,
+                          workers: int = None):
+    """
+    Main function to aggregate MD JSON lines with corresponding spans.
+    Accepts full input and output paths as arguments.
+    aligned matches lines with align_md_page (reading-order walk) instead of one
+    page search per line. workers sets the number of aggregation processes that
+    pages are spread over (None = automatic, 1 = sequential).
+
+    Both inputs are JSON Lines files ordered by page, so they are merge-joined
+    page by page and only one page of spans and lines is held in memory.
+    Output records:
+      {"page_number", "page_stats", "lines": [...]}  one record per markdown page
+      {"summary"}                                    trailer (last record)
+    """
+    # This is used for your print statements
+    pdf_name = os.path.basename(spans_json_file).replace('spans_', '').replace('.jsonl', '.pdf')
+    start_time = time.time()
     
-    process_end = time.time()
-    processing_time = process_end - process_start
+    print(f"Streaming spans from {os.path.basename(spans_json_file)} and markdown from {os.path.basename(md_json_file)}...")
+    md_records = iter_records(md_json_file)
+    md_header = next(md_records, {})
+    metadata = md_header.get('metadata', {})
+    print(f"  Document metadata: {metadata.get('title', 'No title')}")
     
-    total_lines = len(md_lines)
-    matched_lines = sum(1 for item in aggregated_data if item["span_match"])
-    total_spans_available = len(spans)
+    span_records = iter_span_pages(spans_json_file)
+    font_table = []
+    
+    def next_span_page():
+        # Advance the span stream to its next page record, picking up the font table on the way
+        nonlocal font_table
+        for kind, record in span_records:
+            if kind == 'fonts':
+                font_table = record['fonts']
+            else:
+                return record
+        return None
     
-    page_stats = {}
-    for page_num, stats in page_matches.items():
-        match_rate = (stats['matched'] / stats['total']) * 100 if stats['total'] > 0 else 0
-        page_stats[page_num] = {
-            "total_lines": stats['total'],
-            "matched_lines": stats['matched'],
-            "match_percentage": round(match_rate, 2)
-        }
+    process_start = time.time()
     
-    summary = {
-        "document_metadata": metadata,
-        "total_md_lines": total_lines,
-        "matched_lines": matched_lines,
-        "unmatched_lines": len(unmatched_lines),
-        "table_lines_processed": table_lines_processed,
-        "table_lines_matched": table_lines_matched,
-        "table_match_percentage": round((table_lines_matched / table_lines_processed) * 100, 2) if table_lines_processed > 0 else 0,
-        "hashed_lines_processed": hashed_lines_processed,
-        "hashed_lines_matched": hashed_lines_matched,
-        "hashed_match_percentage": round((hashed_lines_matched / hashed_lines_processed) * 100, 2) if hashed_lines_processed > 0 else 0,
-        "overall_match_percentage": round((matched_lines / total_lines) * 100, 2) if total_lines > 0 else 0,
-        "total_spans_available": total_spans_available,
-        "spans_used": len(used_spans),
-        "processing_time_seconds": round(processing_time, 2),
-        "lines_per_second": round(total_lines / processing_time, 2) if processing_time > 0 else 0,
-        "pages_processed": len(page_index),
-        "page_wise_stats": page_stats
-    }
+    total_lines = 0
+    matched_lines = 0
+    unmatched_count = 0
+    unmatched_samples = []
+    table_lines_processed = 0
+    table_lines_matched = 0
+    hashed_lines_processed = 0
+    hashed_lines_matched = 0
+    total_spans_available = 0
+    spans_used = 0
+    span_pages = 0
+    page_matches = {}
+    align_stats = {}
     
-    final_output = {
-        "summary": summary,
-        "aggregated_data": aggregated_data,
-        "unmatched_lines": unmatched_lines
-    }
+    # The font table is the first record, so it is known before any page is aggregated
+    pending_span_page = next_span_page()
+    
+    def iter_page_pairs():
+        # Merge-join each markdown page with the span page of the same number (None when it has no spans)
+        nonlocal pending_span_page, total_spans_available, span_pages
+        for md_page in md_records:
+            page_num = md_page['page_number']
+            
+            # Span pages without markdown lines are counted and skipped
+            while pending_span_page is not None and pending_span_page['page_num'] < page_num:
+                total_spans_available += len(pending_span_page['spans'])
+                span_pages += 1
+                pending_span_page = next_span_page()
+            
+            span_page = None
+            if pending_span_page is not None and pending_span_page['page_num'] == page_num:
+                span_page = pending_span_page
+                total_spans_available += len(span_page['spans'])
+                span_pages += 1
+                pending_span_page = next_span_page()
+            yield md_page, span_page
+        
+        # Drain the remaining span pages for the counts
+        while pending_span_page is not None:
+            total_spans_available += len(pending_span_page['spans'])
+            span_pages += 1
+            pending_span_page = next_span_page()
+    
+    workers = resolve_aggregation_workers(count_records(md_json_file) - 1, workers)
+    if workers > 1:
+        print(f"  Aggregating pages on {workers} worker processes...")
+        page_results = aggregate_pages_parallel(iter_page_pairs(), font_table, aligned, workers)
+    else:
+        page_results = (aggregate_page(md_page, span_page, font_table, aligned)
+                        for md_page, span_page in iter_page_pairs())
     
     # CHANGED: Use the provided output_file argument
-    save_start = time.time()
     with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(final_output, f, ensure_ascii=False, indent=2)
-    save_end = time.time()
+        for page_result in page_results:
+            record = page_result['record']
+            page_num = record['page_number']
+            for line in record['lines']:
+                line_num = line['line_number']
+                if line_num % 100 == 0:
+                    elapsed = time.time() - process_start
+                    rate = line_num / elapsed if elapsed > 0 else 0
+                    print(f"  Processed {line_num} lines ({rate:.1f} lines/sec)")
+            
+            counts = page_result['counts']
+            total_lines += counts['total']
+            matched_lines += counts['matched']
+            unmatched_count += counts['total'] - counts['matched']
+            table_lines_processed += counts['table']
+            table_lines_matched += counts['table_matched']
+            hashed_lines_processed += counts['hashed']
+            hashed_lines_matched += counts['hashed_matched']
+            spans_used += counts['spans_used']
+            if counts['total']:
+                if page_num not in page_matches:
+                    page_matches[page_num] = {'total': 0, 'matched': 0}
+                page_matches[page_num]['total'] += counts['total']
+                page_matches[page_num]['matched'] += counts['matched']
+            unmatched_samples.extend(page_result['unmatched_samples'][:5 - len(unmatched_samples)])
+            for stat, count in page_result['align_stats'].items():
+                align_stats[stat] = align_stats.get(stat, 0) + count
+            
+            write_record(f, record)
+        
+        process_end = time.time()
+        processing_time = process_end - process_start
+        
+        page_stats = {}
+        for page_num, stats in page_matches.items():
+            match_rate = (stats['matched'] / stats['total']) * 100 if stats['total'] > 0 else 0
+            page_stats[page_num] = {
+                "total_lines": stats['total'],
+                "matched_lines": stats['matched'],
+                "match_percentage": round(match_rate, 2)
+            }
+        
+        summary = {
+            "document_metadata": metadata,
+            "total_md_lines": total_lines,
+            "matched_lines": matched_lines,
+            "unmatched_lines": unmatched_count,
+            "table_lines_processed": table_lines_processed,
+            "table_lines_matched": table_lines_matched,
+            "table_match_percentage": round((table_lines_matched / table_lines_processed) * 100, 2) if table_lines_processed > 0 else 0,
+            "hashed_lines_processed": hashed_lines_processed,
+            "hashed_lines_matched": hashed_lines_matched,
+            "hashed_match_percentage": round((hashed_lines_matched / hashed_lines_processed) * 100, 2) if hashed_lines_processed > 0 else 0,
+            "overall_match_percentage": round((matched_lines / total_lines) * 100, 2) if total_lines > 0 else 0,
+            "total_spans_available": total_spans_available,
+            "spans_used": spans_used,
+            "processing_time_seconds": round(processing_time, 2),
+            "lines_per_second": round(total_lines / processing_time, 2) if processing_time > 0 else 0,
+            "pages_processed": span_pages,
+            "page_wise_stats": page_stats,
+            "unmatched_samples": unmatched_samples
+        }
+        write_record(f, {"summary": summary})
     
     total_time = time.time() - start_time
     
@@ -449,6 +726,9 @@ def aggregate_md_to_spans(md_json_file: str, spans_json_file: str, output_file:
     print(f"  Processing time: {processing_time:.2f} seconds")
     print(f"  Processing rate: {summary['lines_per_second']:.1f} lines/second")
     print(f"  Page-based matching (exact page matching)")
+    if aligned:
+        print(f"  Aligned matching: {align_stats.get('window', 0)} lines in the reading-order window, "
+              f"{align_stats.get('fallback', 0)} by full page search")
     print(f"\nResults:")
     print(f"  Document: {metadata.get('title', 'No title')}")
     print(f"  Total MD lines: {summary['total_md_lines']}")
@@ -467,9 +747,9 @@ def aggregate_md_to_spans(md_json_file: str, spans_json_file: str, output_file:
         print(f"  Page {page_num}: {stats['matched_lines']}/{stats['total_lines']} ({stats['match_percentage']}%)")
     print(f"\nOutput saved to: {output_file}")
     
-    if unmatched_lines:
+    if unmatched_samples:
         print(f"\nFirst 5 unmatched lines:")
-        for i, line in enumerate(unmatched_lines[:5]):
+        for i, line in enumerate(unmatched_samples):
             table_indicator = " (TABLE)" if line.get("is_in_table") else ""
             header_indicator = " (HEADER)" if line.get("is_hashed") else ""
             print(f"  Line {line['line_number']} (Page {line['page_number']}){table_indicator}{header_indicator}: {line['text_cleaned'][:100]}...")
@@ -480,10 +760,10 @@ def aggregate_md_to_spans(md_json_file: str, spans_json_file: str, output_file:
 if __name__ == "__main__":
     import sys
     if len(sys.argv) < 4:
-        print("Usage: python aggregator.py <path_to_md.json> <path_to_spans.json> <path_to_output.json>")
+        print("Usage: python aggregator.py <path_to_md.jsonl> <path_to_spans.jsonl> <path_to_output.jsonl> [--aligned]")
         sys.exit(1)
     
     md_file_path = sys.argv[1]
     spans_file_path = sys.argv[2]
     output_file_path = sys.argv[3]
-    aggregate_md_to_spans(md_file_path, spans_file_path, output_file_path)
\ No newline at end of file
+    aggregate_md_to_spans(md_file_path, spans_file_path, output_file_path, aligned='--aligned' in sys.argv[4:])
\ No newline at end of file
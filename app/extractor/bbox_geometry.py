@@ -0,0 +1,110 @@
+import numpy as np
+from typing import List, Sequence
+
+# Approximate A4 width in points, used when the real page width is unknown
+DEFAULT_PAGE_WIDTH = 595
+
+def as_boxes(bboxes: Sequence) -> np.ndarray:
+    """Stack (x0, y0, x1, y1) boxes (lists, tuples or PyMuPDF rects) into an (N, 4) float array"""
+    if len(bboxes) == 0:
+        return np.zeros((0, 4), dtype=np.float64)
+    return np.array([tuple(bbox)[:4] for bbox in bboxes], dtype=np.float64).reshape(-1, 4)
+
+def box_areas(boxes: np.ndarray) -> np.ndarray:
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+def empty_boxes(boxes: np.ndarray) -> np.ndarray:
+    """True for boxes with no area, with the same rule as pymupdf.Rect.is_empty"""
+    return (boxes[:, 0] >= boxes[:, 2]) | (boxes[:, 1] >= boxes[:, 3])
+
+def intersection_extents(a: np.ndarray, b: np.ndarray):
+    """Pairwise intersection rectangles of a (N, 4) and b (M, 4), as four (N, M) arrays"""
+    x0 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y0 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x1 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y1 = np.minimum(a[:, None, 3], b[None, :, 3])
+    return x0, y0, x1, y1
+
+def intersects_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """(N, M) True where a[i] & b[j] is a non-empty rectangle (pymupdf semantics: empty boxes never intersect)"""
+    x0, y0, x1, y1 = intersection_extents(a, b)
+    overlapping = (x0 < x1) & (y0 < y1)
+    return overlapping & ~empty_boxes(a)[:, None] & ~empty_boxes(b)[None, :]
+
+def overlap_ratios(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """(N, M) intersection area of a[i] and b[j] as a fraction of a[i]'s area (0 where a[i] has no area)"""
+    x0, y0, x1, y1 = intersection_extents(a, b)
+    overlapping = (x0 < x1) & (y0 < y1)
+    areas = box_areas(a)
+    ratios = np.zeros(overlapping.shape, dtype=np.float64)
+    valid = overlapping & (areas > 0)[:, None]
+    intersect_areas = (x1 - x0) * (y1 - y0)
+    np.divide(intersect_areas, areas[:, None], out=ratios, where=valid)
+    return ratios
+
+def contains_matrix(inner: np.ndarray, outer: np.ndarray) -> np.ndarray:
+    """(N, M) True where outer[j] contains inner[i] (pymupdf `inner in outer` semantics)"""
+    return ((outer[None, :, 0] <= inner[:, None, 0]) & (inner[:, None, 0] <= inner[:, None, 2]) &
+            (inner[:, None, 2] <= outer[None, :, 2]) &
+            (outer[None, :, 1] <= inner[:, None, 1]) & (inner[:, None, 1] <= inner[:, None, 3]) &
+            (inner[:, None, 3] <= outer[None, :, 3]))
+
+def first_container(inner: np.ndarray, outer: np.ndarray) -> np.ndarray:
+    """For each inner box, the 1-based index of the first outer box containing it, else 0"""
+    if len(inner) == 0 or len(outer) == 0:
+        return np.zeros(len(inner), dtype=np.int64)
+    contained = contains_matrix(inner, outer)
+    return np.where(contained.any(axis=1), contained.argmax(axis=1) + 1, 0)
+
+def center_boxes(boxes: np.ndarray) -> np.ndarray:
+    """Zero-size boxes at the centers of boxes, for point-in-box tests with first_container"""
+    centers_x = (boxes[:, 0] + boxes[:, 2]) / 2
+    centers_y = (boxes[:, 1] + boxes[:, 3]) / 2
+    return np.column_stack([centers_x, centers_y, centers_x, centers_y])
+
+def union_boxes(boxes: np.ndarray, group_starts: Sequence[int] = None) -> np.ndarray:
+    """
+    Union (enclosing box) of consecutive groups of boxes. group_starts are the row
+    offsets where each group begins; without them all boxes form one group.
+    """
+    if len(boxes) == 0:
+        return np.zeros((0, 4), dtype=np.float64)
+    starts = np.asarray(group_starts if group_starts is not None else [0], dtype=np.int64)
+    return np.column_stack([
+        np.minimum.reduceat(boxes[:, 0], starts),
+        np.minimum.reduceat(boxes[:, 1], starts),
+        np.maximum.reduceat(boxes[:, 2], starts),
+        np.maximum.reduceat(boxes[:, 3], starts),
+    ])
+
+def vertical_gaps(boxes: np.ndarray) -> np.ndarray:
+    """Gap between each box and the next one (next top minus current bottom), length N-1"""
+    return boxes[1:, 1] - boxes[:-1, 3]
+
+def horizontal_shifts(boxes: np.ndarray) -> np.ndarray:
+    """Change of left edge from each box to the next one, length N-1"""
+    return boxes[1:, 0] - boxes[:-1, 0]
+
+def centered_mask(boxes: np.ndarray, page_width: float = DEFAULT_PAGE_WIDTH, tolerance: float = 50) -> np.ndarray:
+    """True for boxes whose horizontal center is within tolerance of the page center"""
+    centers = (boxes[:, 0] + boxes[:, 2]) / 2
+    return np.abs(centers - page_width / 2) < tolerance
+
+def boxes_in_regions(boxes: np.ndarray, regions: np.ndarray, overlap_threshold: float = 0.5) -> np.ndarray:
+    """True for boxes whose overlap with any region covers at least overlap_threshold of the box"""
+    if len(boxes) == 0 or len(regions) == 0:
+        return np.zeros(len(boxes), dtype=bool)
+    ratios = overlap_ratios(boxes, regions)
+    return ((ratios >= overlap_threshold) & (ratios > 0)).any(axis=1)
+
+def has_side_by_side(boxes: np.ndarray) -> bool:
+    """True if two boxes overlap vertically while being disjoint horizontally (several columns)"""
+    if len(boxes) < 2:
+        return False
+    vertical_overlap = (boxes[:, None, 1] < boxes[None, :, 3]) & (boxes[None, :, 1] < boxes[:, None, 3])
+    horizontal_apart = (boxes[:, None, 2] <= boxes[None, :, 0]) | (boxes[None, :, 2] <= boxes[:, None, 0])
+    return bool((vertical_overlap & horizontal_apart).any())
+
+def box_lists(boxes: np.ndarray) -> List[List[float]]:
+    """Back to plain Python lists of floats for JSON/CSV output"""
+    return boxes.tolist()
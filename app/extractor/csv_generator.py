@@ -1,152 +1,166 @@
-import json
 import os
 import csv
-from collections import defaultdict
+from typing import List, Dict, Tuple
 import numpy as np
-import re
+from page_stream import iter_records, write_record
+from text_normalize import clean_span_text
+from document_model import Document, LINE_TABLE_FIELDS
+from bbox_geometry import vertical_gaps, horizontal_shifts, centered_mask, DEFAULT_PAGE_WIDTH
+from font_index import get_page_statistics
 
-# ... (all your helper functions like clean_span_text, get_page_statistics, etc. are unchanged) ...
-def clean_span_text(span_text: str) -> str:
-    """Clean span text by removing bullet points and formatting characters"""
-    if not span_text:
-        return ""
-    
-    # Remove leading/trailing whitespace
-    cleaned = span_text.strip()
-    
-    # Remove bullet points and list markers at the beginning
-    cleaned = re.sub(r'^[-+=@•·▪▫◦‣⁃]+\s*', '', cleaned)
+# Matched lines gathered from consecutive pages before their pair features are computed
+FEATURE_BATCH_LINES = 4096
 
-    return cleaned.strip()
+def rounded_column(values: np.ndarray) -> list:
+    """
+    round(value, 2) of every value, with Python's rounding as the CSV has always used.
+    Each distinct value (by bit pattern, so -0.0 stays apart from 0.0) is rounded once.
+    """
+    bits, inverse = np.unique(np.ascontiguousarray(values, dtype=np.float64).view(np.int64), return_inverse=True)
+    rounded = np.array([round(value, 2) for value in bits.view(np.float64).tolist()], dtype=np.float64)
+    return rounded[inverse.reshape(-1)].tolist()
 
-def get_page_statistics(textlines_on_page: list) -> dict:
-    """Calculate page-level statistics like median gap"""
-    stats = {}
-    gaps = []
-    
-    for i in range(len(textlines_on_page) - 1):
-        current_line = textlines_on_page[i]
-        next_line = textlines_on_page[i + 1]
-        
-        # Calculate vertical gap using bbox coordinates
-        if 'features' in current_line and 'features' in next_line:
-            current_bbox = current_line['features']['bbox']
-            next_bbox = next_line['features']['bbox']
-            
-            if current_bbox and next_bbox and len(current_bbox) >= 4 and len(next_bbox) >= 4:
-                gap = next_bbox[1] - current_bbox[3]  # next_top - current_bottom
-                if gap > 0:
-                    gaps.append(gap)
-    
-    stats['median_gap'] = np.median(gaps) if gaps else 12.0
-    return stats
+def flag_column(mask: np.ndarray) -> list:
+    return mask.astype(np.int64).tolist()
 
-def calculate_features_for_merging(line_a: dict, line_b: dict, page_stats: dict) -> dict:
-    """Calculate features for merging two consecutive lines"""
-    features = {}
-    median_gap = page_stats.get('median_gap', 12.0)
-    
-    # Get bbox and features safely
-    bbox_a = line_a.get('features', {}).get('bbox', [0, 0, 0, 0]) if line_a.get('features') else [0, 0, 0, 0]
-    bbox_b = line_b.get('features', {}).get('bbox', [0, 0, 0, 0]) if line_b.get('features') else [0, 0, 0, 0]
-    
-    features_a = line_a.get('features', {})
-    features_b = line_b.get('features', {})
-    
-    # Normalized vertical gap
-    if len(bbox_a) >= 4 and len(bbox_b) >= 4:
-        vertical_gap = bbox_b[1] - bbox_a[3]  # next_top - current_bottom
-        features['normalized_vertical_gap'] = round(vertical_gap / median_gap, 2) if median_gap > 0 else 0
-    else:
-        features['normalized_vertical_gap'] = 0
-    
-    # Indentation change
-    if len(bbox_a) >= 2 and len(bbox_b) >= 2:
-        features['indentation_change'] = round(bbox_b[0] - bbox_a[0], 2)
-    else:
-        features['indentation_change'] = 0
+def line_table_path_for(output_csv_path: str) -> str:
+    """Line table written next to a textline pair CSV"""
+    return os.path.splitext(output_csv_path)[0] + '.lines.jsonl'
 
-    page_num_a = line_a.get('page_number', 1)
-    page_num_b = line_b.get('page_number', 1)
-    features['page_number_a'] = page_num_a
-    features['page_number_b'] = page_num_b
-    # Font sizes
-    font_size_a = features_a.get('font_size', 12.0)
-    font_size_b = features_b.get('font_size', 12.0)
-    features['font_size_a'] = round(font_size_a, 2)
-    features['font_size_b'] = round(font_size_b, 2)
-    features['font_size_diff'] = round(font_size_b - font_size_a, 2)
-    
-    # Same font
-    font_name_a = features_a.get('font_name', '')
-    font_name_b = features_b.get('font_name', '')
-    features['same_font'] = 1 if font_name_a == font_name_b else 0
-    
-    # Font formatting features
-    features['is_bold_A'] = 1 if features_a.get('is_bold', False) else 0
-    features['is_bold_B'] = 1 if features_b.get('is_bold', False) else 0
-    features['is_italic_A'] = 1 if features_a.get('is_italic', False) else 0
-    features['is_italic_B'] = 1 if features_b.get('is_italic', False) else 0
-    features['is_monospace_A'] = 1 if features_a.get('is_monospace', False) else 0
-    features['is_monospace_B'] = 1 if features_b.get('is_monospace', False) else 0
-    
-    # Same formatting features
-    features['same_bold'] = 1 if features_a.get('is_bold', False) == features_b.get('is_bold', False) else 0
-    features['same_italic'] = 1 if features_a.get('is_italic', False) == features_b.get('is_italic', False) else 0
-    features['same_monospace'] = 1 if features_a.get('is_monospace', False) == features_b.get('is_monospace', False) else 0
-    
-    # Line ending with punctuation
-    text_a = line_a.get('md_text_cleaned', '').strip()
-    features['line_a_ends_punctuation'] = 1 if text_a and text_a[-1] in '.!?:' else 0
-    
-    # Line B starts with lowercase
-    text_b = line_b.get('md_text_cleaned', '').strip()
-    features['line_b_starts_lowercase'] = 1 if text_b and text_b[0].islower() else 0
-    
-    # Same alignment (using bbox left coordinate)
-    if len(bbox_a) >= 1 and len(bbox_b) >= 1:
-        features['same_alignment'] = 1 if abs(bbox_a[0] - bbox_b[0]) < 5 else 0
-    else:
-        features['same_alignment'] = 0
-    
-    # Is centered (rough estimation based on bbox position)
-    page_width = 595  # Approximate A4 width in points
-    if len(bbox_a) >= 3:
-        center_a = (bbox_a[0] + bbox_a[2]) / 2
-        features['is_centered_A'] = 1 if abs(center_a - page_width/2) < 50 else 0
-    else:
-        features['is_centered_A'] = 0
+def pair_feature_columns(document: Document) -> Tuple[dict, np.ndarray]:
+    """
+    Merge features of the consecutive line pairs of a batch of a document's pages. The A
+    and B sides of the pairs are the line table columns without their last and first
+    element, so every feature is one array operation over the batch. Columns are keyed by
+    CSV field name (all but 'label') with one entry per adjacent line pair; line_a/line_b
+    are line table indices, numbered from the batch's first page. The returned indices are
+    the pairs that are written: both lines on the same page and both texts non-empty.
+    """
+    lines = document.lines
+    line_count = len(lines)
+    first_line = document.pages[0].first_line if document.pages else 0
+    boxes = lines.bbox
+    median_gaps = document.line_page_stat('median_gap', 12.0)[:-1]
+    font_sizes = lines.font_size
+    font_names = lines.font_name
+    bold, italic, monospace = lines.is_bold, lines.is_italic, lines.is_monospace
+    in_table, hashed = lines.is_in_table, lines.is_hashed
+    has_text = np.array([bool(text) for text in lines.text])
+    ends_punctuation = np.array([bool(text) and text[-1] in '.!?:' for text in lines.text])
+    starts_lowercase = np.array([bool(text) and text[0].islower() for text in lines.text])
+    page_numbers = lines.page_number.tolist()
+    
+    # Normalized vertical gap (next_top - current_bottom), indentation change and
+    # centering (rough estimation based on bbox position on an A4-width page)
+    shifts = horizontal_shifts(boxes)
+    centered = centered_mask(boxes, DEFAULT_PAGE_WIDTH)
+    normalized_gaps = rounded_column(np.divide(vertical_gaps(boxes), median_gaps, out=np.zeros(len(median_gaps)),
+                                               where=median_gaps > 0))
+    for i in np.flatnonzero(median_gaps <= 0).tolist():
+        normalized_gaps[i] = 0
+    
+    line_indices = list(range(first_line, first_line + line_count))
+    columns = {
+        'text_a': lines.text[:-1],
+        'span_text_a': lines.span_text[:-1],
+        'text_b': lines.text[1:],
+        'span_text_b': lines.span_text[1:],
+        'normalized_vertical_gap': normalized_gaps,
+        'indentation_change': rounded_column(shifts),
+        'same_alignment': flag_column(np.abs(shifts) < 5),
+        'is_centered_A': flag_column(centered[:-1]),
+        'is_centered_B': flag_column(centered[1:]),
+        'font_size_a': rounded_column(font_sizes[:-1]),
+        'font_size_b': rounded_column(font_sizes[1:]),
+        'font_size_diff': rounded_column(font_sizes[1:] - font_sizes[:-1]),
+        'same_font': flag_column(font_names[:-1] == font_names[1:]),
+        'is_bold_A': flag_column(bold[:-1]),
+        'is_bold_B': flag_column(bold[1:]),
+        'is_italic_A': flag_column(italic[:-1]),
+        'is_italic_B': flag_column(italic[1:]),
+        'is_monospace_A': flag_column(monospace[:-1]),
+        'is_monospace_B': flag_column(monospace[1:]),
+        'same_bold': flag_column(bold[:-1] == bold[1:]),
+        'same_italic': flag_column(italic[:-1] == italic[1:]),
+        'same_monospace': flag_column(monospace[:-1] == monospace[1:]),
+        'line_a_ends_punctuation': flag_column(ends_punctuation[:-1]),
+        'line_b_starts_lowercase': flag_column(starts_lowercase[1:]),
+        'is_linea_in_rectangle': flag_column(in_table[:-1]),
+        'is_lineb_in_rectangle': flag_column(in_table[1:]),
+        'both_in_table': flag_column(in_table[:-1] & in_table[1:]),
+        'neither_in_table': flag_column(~in_table[:-1] & ~in_table[1:]),
+        'is_linea_hashed': flag_column(hashed[:-1]),
+        'is_lineb_hashed': flag_column(hashed[1:]),
+        'both_hashed': flag_column(hashed[:-1] & hashed[1:]),
+        'neither_hashed': flag_column(~hashed[:-1] & ~hashed[1:]),
+        'page_number_a': page_numbers[:-1],
+        'page_number_b': page_numbers[1:],
+        'line_a': line_indices[:-1],
+        'line_b': line_indices[1:],
+    }
+    page_index = document.line_page_index()
+    same_page = page_index[:-1] == page_index[1:]
+    return columns, np.flatnonzero(same_page & has_text[:-1] & has_text[1:])
+
+def write_pair_rows(writer, lines_file, fieldnames: List[str], document: Document) -> Dict[str, int]:
+    """
+    Write a batch of a document's pages: its lines to the line table, then its pair feature rows.
+    Returns the line, row and hashed-pair counts.
+    """
+    document.lines.write_rows(lines_file, rounded_column)
+    columns, kept_pairs = pair_feature_columns(document)
+    kept_pairs = kept_pairs.tolist()
+    # Rows are written column-wise in field order; label is left for annotation
+    field_columns = [columns[name] for name in fieldnames[:-1]]
+    writer.writerows([column[i] for column in field_columns] + [''] for i in kept_pairs)
+    return {
+        'lines': len(document.lines),
+        'rows': len(kept_pairs),
+        'both_hashed_pairs': sum(columns['both_hashed'][i] for i in kept_pairs),
+        'neither_hashed_pairs': sum(columns['neither_hashed'][i] for i in kept_pairs),
+    }
+
+def iter_document_batches(input_json_path: str, name: str, line_counts: Dict[str, int]):
+    """
+    Documents of consecutive pages of an aggregated JSON Lines file, each holding at least
+    FEATURE_BATCH_LINES matched lines (but the last), with line indices continuing across
+    batches. Aggregated data is streamed one page record at a time; pages with fewer than
+    two matched lines have no pairs and are left out. line_counts['matched'] and
+    line_counts['hashed'] count the matched lines of all pages.
+    """
+    batch = []
+    batch_lines = 0
+    first_line = 0
+    for record in iter_records(input_json_path):
+        if 'lines' not in record:
+            continue  # summary trailer
         
-    if len(bbox_b) >= 3:
-        center_b = (bbox_b[0] + bbox_b[2]) / 2
-        features['is_centered_B'] = 1 if abs(center_b - page_width/2) < 50 else 0
-    else:
-        features['is_centered_B'] = 0
-    
-    # Table-related features
-    is_linea_in_table = line_a.get('is_in_table', False)
-    is_lineb_in_table = line_b.get('is_in_table', False)
-    
-    features['is_linea_in_rectangle'] = 1 if is_linea_in_table else 0
-    features['is_lineb_in_rectangle'] = 1 if is_lineb_in_table else 0
-    features['both_in_table'] = 1 if (is_linea_in_table and is_lineb_in_table) else 0
-    features['neither_in_table'] = 1 if (not is_linea_in_table and not is_lineb_in_table) else 0
-    
-    # Header/hash-related features (NEW)
-    is_linea_hashed = line_a.get('is_hashed', False)
-    is_lineb_hashed = line_b.get('is_hashed', False)
-    
-    features['is_linea_hashed'] = 1 if is_linea_hashed else 0
-    features['is_lineb_hashed'] = 1 if is_lineb_hashed else 0
-    features['both_hashed'] = 1 if (is_linea_hashed and is_lineb_hashed) else 0
-    features['neither_hashed'] = 1 if (not is_linea_hashed and not is_lineb_hashed) else 0
-    
-    return features
+        matched_lines = [
+            line for line in record['lines']
+            if line.get('span_match', False)
+        ]
+        line_counts['matched'] += len(matched_lines)
+        line_counts['hashed'] += sum(1 for line in matched_lines if line.get('is_hashed', False))
+        if len(matched_lines) < 2:
+            continue
+        
+        # The aggregator stores each page's statistics over its matched lines;
+        # they are only recomputed for aggregated files written without them
+        page_stats = record.get('page_stats') or get_page_statistics(matched_lines)
+        batch.append((matched_lines, page_stats))
+        batch_lines += len(matched_lines)
+        if batch_lines >= FEATURE_BATCH_LINES:
+            yield Document.from_aggregated_pages(name, batch, clean_span_text, first_line)
+            first_line += batch_lines
+            batch = []
+            batch_lines = 0
+    if batch:
+        yield Document.from_aggregated_pages(name, batch, clean_span_text, first_line)
 
 # CHANGED: The function NAME is the same, but it now accepts full paths
 def generate_csv_from_aggregated(input_json_path: str, output_csv_path: str):
     """
-    Generate CSV with textline features from an aggregated JSON file.
+    Generate CSV with textline features from an aggregated JSON Lines file.
     Accepts full input and output paths as arguments.
     """
     pdf_name = os.path.basename(output_csv_path).replace('textlines_ground_truth_', '').replace('.csv', '.pdf')
@@ -158,84 +172,49 @@ def generate_csv_from_aggregated(input_json_path: str, output_csv_path: str):
         print(f"Error: Input file not found: '{input_json_path}'")
         return
     
-    # Load aggregated data
-    with open(input_json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    matched_lines = [
-        line for line in data['aggregated_data'] 
-        if line.get('span_match', False)
+    fieldnames = [
+        'text_a', 'span_text_a', 'text_b', 'span_text_b', 'normalized_vertical_gap', 
+        'indentation_change', 'same_alignment', 'is_centered_A', 'is_centered_B',
+        'font_size_a', 'font_size_b', 'font_size_diff', 'same_font', 'is_bold_A', 
+        'is_bold_B', 'is_italic_A', 'is_italic_B', 'is_monospace_A', 'is_monospace_B',
+        'same_bold', 'same_italic', 'same_monospace', 'line_a_ends_punctuation', 
+        'line_b_starts_lowercase', 'is_linea_in_rectangle', 'is_lineb_in_rectangle', 
+        'both_in_table', 'neither_in_table', 'is_linea_hashed', 'is_lineb_hashed', 
+        'both_hashed', 'neither_hashed', 'page_number_a','page_number_b',
+        'line_a', 'line_b', 'label'
     ]
     
-    if len(matched_lines) < 2:
+    # Every line is stored once in the line table; pair rows refer to it by line_a/line_b
+    line_counts = {'matched': 0, 'hashed': 0}
+    pair_counts = {'lines': 0, 'rows': 0, 'both_hashed_pairs': 0, 'neither_hashed_pairs': 0}
+    line_table_path = line_table_path_for(output_csv_path)
+    with open(output_csv_path, 'w', newline='', encoding='utf-8-sig') as csvfile, \
+            open(line_table_path, 'w', encoding='utf-8') as lines_file:
+        writer = csv.writer(csvfile)
+        writer.writerow(fieldnames)
+        write_record(lines_file, {'fields': LINE_TABLE_FIELDS})
+        
+        for document in iter_document_batches(input_json_path, pdf_name, line_counts):
+            for key, count in write_pair_rows(writer, lines_file, fieldnames, document).items():
+                pair_counts[key] += count
+    row_count = pair_counts['rows']
+    
+    if line_counts['matched'] < 2:
+        os.remove(output_csv_path)
+        os.remove(line_table_path)
         print(f"Warning: Not enough matched lines in {pdf_name} to generate pairs")
         return
     
-    lines_by_page = defaultdict(list)
-    for line in matched_lines:
-        page_num = line.get('page_number', 1)
-        lines_by_page[page_num].append(line)
-    
-    page_statistics = {}
-    for page_num, lines in lines_by_page.items():
-        page_statistics[page_num] = get_page_statistics(lines)
-    
-    with open(output_csv_path, 'w', newline='', encoding='utf-8-sig') as csvfile:
-        fieldnames = [
-            'text_a', 'span_text_a', 'text_b', 'span_text_b', 'normalized_vertical_gap', 
-            'indentation_change', 'same_alignment', 'is_centered_A', 'is_centered_B',
-            'font_size_a', 'font_size_b', 'font_size_diff', 'same_font', 'is_bold_A', 
-            'is_bold_B', 'is_italic_A', 'is_italic_B', 'is_monospace_A', 'is_monospace_B',
-            'same_bold', 'same_italic', 'same_monospace', 'line_a_ends_punctuation', 
-            'line_b_starts_lowercase', 'is_linea_in_rectangle', 'is_lineb_in_rectangle', 
-            'both_in_table', 'neither_in_table', 'is_linea_hashed', 'is_lineb_hashed', 
-            'both_hashed', 'neither_hashed', 'page_number_a','page_number_b', 'label'
-        ]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        
-        row_count = 0
-        for i in range(len(matched_lines) - 1):
-            line_a = matched_lines[i]
-            line_b = matched_lines[i + 1]
-            
-            if line_a.get('page_number') != line_b.get('page_number'):
-                continue
-            
-            page_num = line_a.get('page_number', 1)
-            page_stats = page_statistics.get(page_num, {'median_gap': 12.0})
-            
-            features = calculate_features_for_merging(line_a, line_b, page_stats)
-            
-            features['text_a'] = line_a.get('md_text_cleaned', '').strip()
-            features['text_b'] = line_b.get('md_text_cleaned', '').strip()
-            features['span_text_a'] = clean_span_text(line_a.get('span_text', ''))
-            features['span_text_b'] = clean_span_text(line_b.get('span_text', ''))
-            features['label'] = ''
-            
-            if not features['text_a'] or not features['text_b']:
-                continue
-            
-            writer.writerow(features)
-            row_count += 1
-    
     print(f"Successfully created '{os.path.basename(output_csv_path)}' with {row_count} feature rows for {pdf_name}")
+    print(f"  Line table: {pair_counts['lines']} lines in '{os.path.basename(line_table_path)}'")
     
     hash_stats = {
         'total_pairs': row_count,
-        'hashed_a': sum(1 for line in matched_lines if line.get('is_hashed', False)),
-        'both_hashed_pairs': 0,
-        'neither_hashed_pairs': 0
+        'hashed_a': line_counts['hashed'],
+        'both_hashed_pairs': pair_counts['both_hashed_pairs'],
+        'neither_hashed_pairs': pair_counts['neither_hashed_pairs']
     }
     
-    with open(output_csv_path, 'r', encoding='utf-8-sig') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            if row.get('both_hashed') == '1':
-                hash_stats['both_hashed_pairs'] += 1
-            elif row.get('neither_hashed') == '1':
-                hash_stats['neither_hashed_pairs'] += 1
-    
     print(f"Hash feature statistics:")
     print(f"  Total hashed lines: {hash_stats['hashed_a']}")
     print(f"  Pairs where both are hashed: {hash_stats['both_hashed_pairs']}")
@@ -247,7 +226,7 @@ def generate_csv_from_aggregated(input_json_path: str, output_csv_path: str):
 if __name__ == "__main__":
     import sys
     if len(sys.argv) < 3:
-        print("Usage: python csv_generator.py <path_to_agg.json> <path_to_output.csv>")
+        print("Usage: python csv_generator.py <path_to_agg.jsonl> <path_to_output.csv>")
         sys.exit(1)
     
     input_path = sys.argv[1]
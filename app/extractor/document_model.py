@@ -0,0 +1,178 @@
+import numpy as np
+from typing import List, Dict, Tuple, Optional
+from page_stream import iter_records, write_record
+from bbox_geometry import as_boxes, box_lists
+
+# Line table file layout: a {"fields": LINE_TABLE_FIELDS} header record, then one value list per line
+LINE_TABLE_FIELDS = ['text', 'span_text', 'page_number', 'bbox', 'font_id', 'font_name', 'font_size', 'is_bold',
+                     'is_italic', 'is_monospace', 'is_in_table', 'is_hashed']
+FLAG_FIELDS = ('is_bold', 'is_italic', 'is_monospace', 'is_in_table', 'is_hashed')
+
+def line_bbox(line: Dict) -> list:
+    bbox = line.get('features', {}).get('bbox', [0, 0, 0, 0]) if line.get('features') else [0, 0, 0, 0]
+    return bbox if bbox and len(bbox) >= 4 else [0, 0, 0, 0]
+
+class LineTable:
+    """
+    Text lines of a document as columns: texts in lists, everything else in NumPy arrays
+    (bbox (N, 4), flags as bool, font_id -1 when unknown).
+    A line is its row index.
+    """
+    __slots__ = ('text', 'span_text', 'page_number', 'bbox', 'font_id', 'font_name', 'font_size',
+                 'is_bold', 'is_italic', 'is_monospace', 'is_in_table', 'is_hashed')
+
+    def __init__(self, text: List[str], span_text: List[str], page_number, bbox, font_id, font_name,
+                 font_size, is_bold, is_italic, is_monospace, is_in_table, is_hashed):
+        self.text = text
+        self.span_text = span_text
+        self.page_number = np.asarray(page_number, dtype=np.int64)
+        self.bbox = as_boxes(bbox) if not isinstance(bbox, np.ndarray) else bbox
+        self.font_id = np.asarray(font_id, dtype=np.int64)
+        self.font_name = np.asarray(font_name, dtype=object)
+        self.font_size = np.asarray(font_size, dtype=np.float64)
+        self.is_bold = np.asarray(is_bold, dtype=bool)
+        self.is_italic = np.asarray(is_italic, dtype=bool)
+        self.is_monospace = np.asarray(is_monospace, dtype=bool)
+        self.is_in_table = np.asarray(is_in_table, dtype=bool)
+        self.is_hashed = np.asarray(is_hashed, dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+    @classmethod
+    def from_aggregated_lines(cls, lines: List[Dict], clean_span_text) -> 'LineTable':
+        """
+        Line table of aggregated (matched) lines: md_text_cleaned as text, span_text cleaned
+        with clean_span_text, font values from the nested 'features', with their fallbacks.
+        """
+        line_features = [line.get('features', {}) for line in lines]
+        font_ids = [features.get('font_id') for features in line_features]
+        return cls(
+            text=[line.get('md_text_cleaned', '').strip() for line in lines],
+            span_text=[clean_span_text(line.get('span_text', '')) for line in lines],
+            page_number=[line.get('page_number', 1) for line in lines],
+            bbox=[line_bbox(line) for line in lines],
+            font_id=[-1 if font_id is None else font_id for font_id in font_ids],
+            font_name=[features.get('font_name', '') for features in line_features],
+            font_size=[features.get('font_size', 12.0) for features in line_features],
+            is_bold=[bool(features.get('is_bold', False)) for features in line_features],
+            is_italic=[bool(features.get('is_italic', False)) for features in line_features],
+            is_monospace=[bool(features.get('is_monospace', False)) for features in line_features],
+            is_in_table=[bool(line.get('is_in_table', False)) for line in lines],
+            is_hashed=[bool(line.get('is_hashed', False)) for line in lines],
+        )
+
+    @classmethod
+    def read(cls, line_table_path: str) -> 'LineTable':
+        """Line table file written by write_rows"""
+        records = iter_records(line_table_path)
+        fields = next(records)['fields']
+        columns = {field: [] for field in fields}
+        column_lists = [columns[field] for field in fields]
+        for values in records:
+            for column, value in zip(column_lists, values):
+                column.append(value)
+        columns['font_id'] = [-1 if font_id is None else font_id for font_id in columns['font_id']]
+        return cls(**columns)
+
+    def write_rows(self, file_handle, rounded_column):
+        """Append the lines as line table rows; font sizes are rounded with rounded_column like the pair CSV"""
+        font_ids = [None if font_id < 0 else font_id for font_id in self.font_id.tolist()]
+        flags = [getattr(self, name).astype(np.int64).tolist() for name in FLAG_FIELDS]
+        for row in zip(self.text, self.span_text, self.page_number.tolist(), box_lists(self.bbox), font_ids,
+                       self.font_name.tolist(), rounded_column(self.font_size), *flags):
+            write_record(file_handle, list(row))
+
+class Page:
+    """One page of a Document: its number, statistics and range of lines in the line table"""
+    __slots__ = ('number', 'stats', 'first_line', 'line_count')
+
+    def __init__(self, number: int, stats: Dict, first_line: int, line_count: int):
+        self.number = number
+        self.stats = stats
+        self.first_line = first_line
+        self.line_count = line_count
+
+class BlockTable:
+    """
+    Blocks of a document as runs of a placement array: block i is placed lines
+    starts[i]:starts[i + 1] of (line, in_table).
+    """
+    __slots__ = ('line', 'in_table', 'starts')
+
+    def __init__(self, line, in_table, starts):
+        self.line = np.asarray(line, dtype=np.int64)
+        self.in_table = np.asarray(in_table, dtype=np.int64)
+        self.starts = np.asarray(starts, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @classmethod
+    def from_blocks(cls, blocks: List[List[Tuple[int, int]]]) -> 'BlockTable':
+        """Block table of non-empty blocks given as lists of (line, in_table)"""
+        blocks = [block for block in blocks if block]
+        sizes = [len(block) for block in blocks]
+        return cls(line=[line for block in blocks for line, _ in block],
+                   in_table=[in_table for block in blocks for _, in_table in block],
+                   starts=np.concatenate([[0], np.cumsum(sizes)[:-1]]) if sizes else [])
+
+    @classmethod
+    def from_pair_links(cls, kept, merge, pair_in_table) -> 'BlockTable':
+        """
+        Block table of lines in document order from their N - 1 adjacent pairs: kept marks the
+        pairs that exist, merge the kept pairs whose lines share a block. Lines of no kept pair
+        belong to no block; the others form runs of merged pairs. A line takes the pair_in_table
+        flag of the pair before it when that pair is kept, else of the pair after it.
+        """
+        kept = np.asarray(kept, dtype=bool)
+        no_pair = np.zeros(1, dtype=bool)
+        placed = np.concatenate([kept, no_pair]) | np.concatenate([no_pair, kept])
+        block_start = placed & ~np.concatenate([no_pair, np.asarray(merge, dtype=bool)])
+        lines = np.flatnonzero(placed)
+        in_table = np.where(np.concatenate([no_pair, kept]), np.concatenate([[0], pair_in_table]),
+                            np.concatenate([pair_in_table, [0]]))
+        return cls(line=lines, in_table=in_table[lines], starts=np.flatnonzero(block_start[lines]))
+
+    def sizes(self) -> np.ndarray:
+        return np.diff(np.append(self.starts, len(self.line)))
+
+    def block(self, i: int) -> List[Tuple[int, int]]:
+        """(line, in_table) of the lines of block i"""
+        end = self.starts[i + 1] if i + 1 < len(self.starts) else len(self.line)
+        return list(zip(self.line[self.starts[i]:end].tolist(), self.in_table[self.starts[i]:end].tolist()))
+
+class Document:
+    """A document as pages over one line table, with its blocks once lines are merged"""
+    __slots__ = ('name', 'pages', 'lines', 'blocks')
+
+    def __init__(self, name: str, pages: List[Page], lines: LineTable, blocks: Optional[BlockTable] = None):
+        self.name = name
+        self.pages = pages
+        self.lines = lines
+        self.blocks = blocks
+
+    @classmethod
+    def from_aggregated_pages(cls, name: str, pages: List[Tuple[List[Dict], Dict]], clean_span_text,
+                              first_line: int = 0) -> 'Document':
+        """
+        Document of aggregated pages given as (matched lines, page stats); its lines are
+        numbered from first_line when the pages continue an earlier part of the document.
+        """
+        page_list = []
+        offset = first_line
+        for page_lines, page_stats in pages:
+            number = page_lines[0].get('page_number', 1) if page_lines else 0
+            page_list.append(Page(number, page_stats, offset, len(page_lines)))
+            offset += len(page_lines)
+        lines = [line for page_lines, _ in pages for line in page_lines]
+        return cls(name, page_list, LineTable.from_aggregated_lines(lines, clean_span_text))
+
+    def line_page_index(self) -> np.ndarray:
+        """Position in self.pages of every line's page"""
+        return np.repeat(np.arange(len(self.pages)), [page.line_count for page in self.pages])
+
+    def line_page_stat(self, name: str, default: float) -> np.ndarray:
+        """A numeric page statistic broadcast to every line of the page"""
+        return np.repeat(np.array([page.stats.get(name, default) for page in self.pages], dtype=np.float64),
+                         [page.line_count for page in self.pages])
@@ -10,12 +10,15 @@ from markdowntext import pdf_to_markdown
 from span_extractor import extract_columns_and_split
 from aggregator import aggregate_md_to_spans
 from csv_generator import generate_csv_from_aggregated
+from preflight import preflight_pdf, describe_rejection
+from ocr_stage import ocr_pages, tesseract_available
 
-def process_markdown(input_pdf_path, output_md_path):
+def process_markdown(input_pdf_path, output_md_path, text_pages=None, route='markdown', workers=None, selective=False,
+                     ocr_results=None):
     """Wrapper function to time and call the markdown converter."""
     start_time = time.time()
     try:
-        pdf_to_markdown(input_pdf_path, output_md_path)
+        pdf_to_markdown(input_pdf_path, output_md_path, text_pages, route, workers, selective, ocr_results)
         elapsed = time.time() - start_time
         print(f"[MD] ✓ Completed in {elapsed:.2f}s")
         return True, "Success", elapsed
@@ -24,11 +27,11 @@ def process_markdown(input_pdf_path, output_md_path):
         print(f"[MD] ✗ Error: {e} (after {elapsed:.2f}s)")
         return False, str(e), elapsed
 
-def process_spans(input_pdf_path, output_spans_path):
+def process_spans(input_pdf_path, output_spans_path, text_pages=None, ocr_results=None):
     """Wrapper function to time and call the span extractor."""
     start_time = time.time()
     try:
-        extract_columns_and_split(input_pdf_path, output_spans_path)
+        extract_columns_and_split(input_pdf_path, output_spans_path, text_pages, ocr_results)
         elapsed = time.time() - start_time
         print(f"[SPAN] ✓ Completed in {elapsed:.2f}s")
         return True, "Success", elapsed
@@ -37,8 +40,52 @@ def process_spans(input_pdf_path, output_spans_path):
         print(f"[SPAN] ✗ Error: {e} (after {elapsed:.2f}s)")
         return False, str(e), elapsed
 
-def process_single_pdf(pdf_name, input_dir, temp_dir, output_dir):
-    """Process a single PDF through the entire pipeline with detailed logging."""
+def run_preflight(pdf_name, input_dir, preview_pages=None, accept_no_text=False):
+    """Validate one PDF and inspect its text layer, timing the check.
+    preview_pages limits everything downstream to the first N pages with text.
+    accept_no_text keeps image-only PDFs for the OCR stage."""
+    preflight_start = time.time()
+    preflight = preflight_pdf(os.path.join(input_dir, pdf_name), max_pages=preview_pages,
+                              accept_no_text=accept_no_text)
+    preflight['preflight_time'] = time.time() - preflight_start
+    if preflight['accepted']:
+        print(f"[PREFLIGHT] ✓ {pdf_name}: route={preflight['route']}, "
+              f"{len(preflight['text_pages'])}/{preflight['page_count']} pages with text "
+              f"({preflight['total_chars']} chars), estimated cost {preflight['estimated_cost']} "
+              f"in {preflight['preflight_time']:.3f}s")
+        if preflight['truncated']:
+            print(f"[PREFLIGHT] Preview: only pages 1-{preflight['scanned_pages']} of "
+                  f"{preflight['page_count']} will be processed")
+    else:
+        print(f"[PREFLIGHT] ✗ {pdf_name}: rejected ({describe_rejection(preflight)}) "
+              f"in {preflight['preflight_time']:.3f}s")
+    return preflight
+
+def run_ocr(pdf_name, input_dir, temp_dir, empty_pages, ocr_dpi):
+    """OCR the pages without a text layer, timing the stage. Returns ({page_num: lines}, seconds)."""
+    ocr_start = time.time()
+    try:
+        ocr_results = ocr_pages(os.path.join(input_dir, pdf_name), empty_pages, ocr_dpi,
+                                cache_dir=os.path.join(temp_dir, 'ocr_cache'))
+    except Exception as e:
+        print(f"[OCR] ✗ Error: {e}, continuing without OCR")
+        ocr_results = {}
+    return ocr_results, time.time() - ocr_start
+
+def process_single_pdf(pdf_name, input_dir, temp_dir, output_dir, markdown_workers=None, preflight=None,
+                       selective_markdown=False, preview_pages=None, ocr_dpi=None, aligned_matching=False,
+                       aggregation_workers=None, pair_csv=True):
+    """Process a single PDF through the entire pipeline with detailed logging.
+    markdown_workers is the number of pymupdf4llm processes (None = automatic).
+    selective_markdown runs pymupdf4llm only on the pages the page router flags.
+    preflight is the report from run_preflight; it is computed here when not given.
+    preview_pages restricts processing to the first N pages with text (results['truncated'] tells
+    whether the document was longer).
+    ocr_dpi enables OCR of the pages without a text layer, rendered at that resolution.
+    aligned_matching aggregates with the reading-order alignment instead of a page search per line.
+    aggregation_workers is the number of aggregation processes (None = automatic).
+    pair_csv writes the textline pair CSV and its line table; without it processing ends with
+    the aggregated file, which the fused line-to-block engine reads directly."""
     print(f"\n{'='*60}")
     print(f"PROCESSING: {pdf_name}")
     print(f"{'='*60}")
@@ -51,18 +98,41 @@ def process_single_pdf(pdf_name, input_dir, temp_dir, output_dir):
     base_name = pdf_name.replace('.pdf', '')
     paths = {
         "full_pdf_path": os.path.join(input_dir, pdf_name),
-        "md_json_path": os.path.join(temp_dir, 'md_files', f"{base_name}.json"),
-        "spans_json_path": os.path.join(temp_dir, 'spans_output', f"spans_{pdf_name}.json"),
-        "agg_json_path": os.path.join(temp_dir, 'aggregator_output', f"aggregated_{pdf_name}.json"),
+        "md_json_path": os.path.join(temp_dir, 'md_files', f"{base_name}.jsonl"),
+        "spans_json_path": os.path.join(temp_dir, 'spans_output', f"spans_{pdf_name}.jsonl"),
+        "agg_json_path": os.path.join(temp_dir, 'aggregator_output', f"aggregated_{pdf_name}.jsonl"),
         "final_csv_path": os.path.join(output_dir, f"textlines_ground_truth_{pdf_name}.csv")
     }
 
+    # Step 0: Preflight - reject broken documents and route by text layer before any heavy work
+    ocr_enabled = bool(ocr_dpi) and tesseract_available()
+    if preflight is None:
+        preflight = run_preflight(pdf_name, input_dir, preview_pages, ocr_enabled)
+    timing_data['preflight_time'] = preflight['preflight_time']
+    if not preflight['accepted']:
+        results['preflight'] = (False, preflight['reason'])
+        print(f"\n[SKIP] {pdf_name} rejected by preflight. Skipping remaining steps.")
+        return False, results, timing_data
+    results['preflight'] = (True, preflight['route'])
+    results['truncated'] = preflight['truncated']
+    if preflight['repaired']:
+        print(f"[PREFLIGHT] {pdf_name} was damaged and repaired on open")
+    ocr_results = None
+    if preflight['empty_pages'] and ocr_enabled:
+        print(f"\n[OCR] Running OCR on pages without text: {preflight['empty_pages']}")
+        ocr_results, timing_data['ocr_time'] = run_ocr(pdf_name, input_dir, temp_dir, preflight['empty_pages'], ocr_dpi)
+    elif preflight['empty_pages']:
+        print(f"[PREFLIGHT] Skipping pages without text: {preflight['empty_pages']}")
+
     # Step 1: Parallel processing of Markdown and Spans
     print(f"\n[STEP 1] Starting parallel processing (Markdown + Spans) for {pdf_name}")
     step1_start = time.time()
     with ThreadPoolExecutor(max_workers=2) as executor:
-        md_future = executor.submit(process_markdown, paths["full_pdf_path"], paths["md_json_path"])
-        span_future = executor.submit(process_spans, paths["full_pdf_path"], paths["spans_json_path"])
+        md_future = executor.submit(process_markdown, paths["full_pdf_path"], paths["md_json_path"],
+                                    preflight['text_pages'], preflight['route'], markdown_workers,
+                                    selective_markdown, ocr_results)
+        span_future = executor.submit(process_spans, paths["full_pdf_path"], paths["spans_json_path"],
+                                      preflight['text_pages'], ocr_results)
         
         md_success, md_result, md_time = md_future.result()
         span_success, span_result, span_time = span_future.result()
@@ -84,7 +154,8 @@ def process_single_pdf(pdf_name, input_dir, temp_dir, output_dir):
     print(f"\n[STEP 2] Starting aggregation for {pdf_name}")
     start_agg_time = time.time()
     try:
-        aggregate_md_to_spans(paths["md_json_path"], paths["spans_json_path"], paths["agg_json_path"])
+        aggregate_md_to_spans(paths["md_json_path"], paths["spans_json_path"], paths["agg_json_path"],
+                              aligned=aligned_matching, workers=aggregation_workers)
         agg_success = True
     except Exception as e:
         print(f"[AGG] ✗ Error: {e}")
@@ -95,6 +166,11 @@ def process_single_pdf(pdf_name, input_dir, temp_dir, output_dir):
         print(f"\n[ERROR] Step 2 (aggregation) failed for {pdf_name}. Skipping CSV generation.")
         return False, results, timing_data
 
+    if not pair_csv:
+        timing_data['total_time'] = time.time() - total_start_time
+        print(f"\n✓ COMPLETED: {pdf_name} - Total time: {timing_data['total_time']:.2f}s")
+        return True, results, timing_data
+
     # Step 3: CSV Generation
     print(f"\n[STEP 3] Starting CSV generation for {pdf_name}")
     start_csv_time = time.time()
@@ -116,8 +192,16 @@ def process_single_pdf(pdf_name, input_dir, temp_dir, output_dir):
         print(f"\n✗ FAILED: {pdf_name} - Total time: {total_time:.2f}s")
         return False, results, timing_data
 
-def extract_all_pdfs(input_dir, output_dir, temp_dir):
-    """Main orchestration function, now with your detailed summary logging."""
+def extract_all_pdfs(input_dir, output_dir, temp_dir, skip_pdfs=None, markdown_workers=None, selective_markdown=False,
+                     preview_pages=None, ocr_dpi=None, aligned_matching=False, aggregation_workers=None,
+                     pair_csv=True):
+    """Main orchestration function, now with your detailed summary logging.
+    PDFs listed in skip_pdfs (e.g. already handled by the outline fast path) are not extracted.
+    preview_pages limits extraction of every PDF to its first N pages with text.
+    ocr_dpi enables OCR of pages without a text layer (needs the tesseract binary).
+    aligned_matching switches aggregation to the reading-order alignment of md lines and spans.
+    aggregation_workers spreads the pages of each document over that many processes (None = automatic).
+    pair_csv=False stops every PDF after aggregation, without its textline pair CSV."""
     overall_start_time = time.time()
     
     os.makedirs(os.path.join(temp_dir, 'md_files'), exist_ok=True)
@@ -125,19 +209,40 @@ def extract_all_pdfs(input_dir, output_dir, temp_dir):
     os.makedirs(os.path.join(temp_dir, 'aggregator_output'), exist_ok=True)
     os.makedirs(output_dir, exist_ok=True)
 
-    pdf_files = [f for f in os.listdir(input_dir) if f.lower().endswith('.pdf')]
+    skip_pdfs = set(skip_pdfs or [])
+    pdf_files = [f for f in os.listdir(input_dir) if f.lower().endswith('.pdf') and f not in skip_pdfs]
     if not pdf_files:
         print("Warning: No PDF files found in input directory.")
         return [], [], {}, {}
 
     successful_pdfs = []
     failed_pdfs = []
+    rejected_pdfs = {}
     all_results = {}
     all_timing_data = {}
 
-    for i, pdf_name in enumerate(pdf_files, 1):
-        print(f"\n\nPROCESSING PDF {i}/{len(pdf_files)}: {pdf_name}")
-        success, results, timing_data = process_single_pdf(pdf_name, input_dir, temp_dir, output_dir)
+    ocr_enabled = bool(ocr_dpi) and tesseract_available()
+    if ocr_dpi and not ocr_enabled:
+        print("[OCR] tesseract is not installed, pages without text will be skipped")
+
+    # Preflight every PDF first so broken documents never reach the extraction workers
+    print(f"\n[PREFLIGHT] Checking {len(pdf_files)} PDFs")
+    preflights = {}
+    for pdf_name in pdf_files:
+        preflight = run_preflight(pdf_name, input_dir, preview_pages, ocr_enabled)
+        if preflight['accepted']:
+            preflights[pdf_name] = preflight
+        else:
+            rejected_pdfs[pdf_name] = preflight['reason']
+            all_results[pdf_name] = (False, {'preflight': (False, preflight['reason'])})
+            all_timing_data[pdf_name] = {'preflight_time': preflight['preflight_time']}
+            failed_pdfs.append(pdf_name)
+
+    for i, pdf_name in enumerate(preflights, 1):
+        print(f"\n\nPROCESSING PDF {i}/{len(preflights)}: {pdf_name}")
+        success, results, timing_data = process_single_pdf(pdf_name, input_dir, temp_dir, output_dir, markdown_workers,
+                                                           preflights[pdf_name], selective_markdown, preview_pages,
+                                                           ocr_dpi, aligned_matching, aggregation_workers, pair_csv)
         all_results[pdf_name] = (success, results)
         all_timing_data[pdf_name] = timing_data
         
@@ -164,7 +269,10 @@ def extract_all_pdfs(input_dir, output_dir, temp_dir):
     if failed_pdfs:
         print(f"\n✗ Failed to process:")
         for pdf in failed_pdfs:
-            print(f"  - {pdf}")
+            if pdf in rejected_pdfs:
+                print(f"  - {pdf} (preflight: {rejected_pdfs[pdf]['code']}: {rejected_pdfs[pdf]['message']})")
+            else:
+                print(f"  - {pdf}")
             
     return successful_pdfs, failed_pdfs, all_results, all_timing_data
 
@@ -0,0 +1,97 @@
+from typing import List, Dict
+import numpy as np
+
+DEFAULT_MEDIAN_GAP = 12.0
+
+def decode_font_flags(flags, font_name):
+    """
+    Decode PyMuPDF font flags and return both styles list and individual boolean flags.
+    This version includes a more robust check for bold style.
+    """
+    styles = []
+    
+    # Robust check for bold: checks flags AND font name
+    is_bold = bool(flags & 16) or any(s in font_name.lower() for s in ['bold', 'black', 'heavy'])
+    
+    # Standard checks for other styles
+    is_italic = bool(flags & 2)      # FONTFLAG_ITALIC = 2  
+    is_monospace = bool(flags & 8)   # FONTFLAG_MONOSPACE = 8
+    is_serifed = bool(flags & 4)     # FONTFLAG_SERIFED = 4
+    is_superscript = bool(flags & 1) # FONTFLAG_SUPERSCRIPT = 1
+    
+    if is_superscript: styles.append("superscript")
+    if is_italic:      styles.append("italic") 
+    if is_serifed:     styles.append("serifed")
+    if is_monospace:   styles.append("monospace")
+    if is_bold:        styles.append("bold")
+    
+    # Return "normal" if no other styles are detected
+    final_styles = styles if styles else ["normal"]
+    
+    return final_styles, is_bold, is_italic, is_monospace
+
+def intern_font(font_table: List[Dict], font_ids: Dict[tuple, int], span: Dict) -> int:
+    """
+    Return the id of the span's font in the per-document font table, adding it on first use.
+    Styles are decoded here, once per distinct (name, size, flags), instead of once per line.
+    """
+    font_name = span.get("font", "")
+    font_size = span.get("size", 0)
+    font_flags = span.get("flags", 0)
+    key = (font_name, font_size, font_flags)
+
+    font_id = font_ids.get(key)
+    if font_id is None:
+        font_styles, is_bold, is_italic, is_monospace = decode_font_flags(font_flags, font_name)
+        font_id = len(font_table)
+        font_ids[key] = font_id
+        font_table.append({
+            "font_id": font_id,
+            "font_name": font_name,
+            "font_size": font_size,
+            "font_flags": font_flags,
+            "font_styles": font_styles,
+            "is_bold": is_bold,
+            "is_italic": is_italic,
+            "is_monospace": is_monospace
+        })
+    return font_id
+
+def resolve_font(font_ref, font_table: List[Dict]) -> Dict:
+    """
+    Turn a line's font reference into a decoded font record.
+    Older span files store the font dict inline instead of a font id.
+    """
+    if isinstance(font_ref, dict):
+        font_name = font_ref.get("font_name", "")
+        font_styles, is_bold, is_italic, is_monospace = decode_font_flags(font_ref.get("font_flags", 0), font_name)
+        return {**font_ref, "font_styles": font_styles, "is_bold": is_bold,
+                "is_italic": is_italic, "is_monospace": is_monospace}
+    if font_ref is None or font_ref >= len(font_table):
+        return {}
+    return font_table[font_ref]
+
+def get_page_statistics(textlines_on_page: list) -> dict:
+    """
+    Page statistics the textline model was trained on: the median positive gap between
+    consecutive matched lines of the page (in their markdown order).
+    """
+    stats = {}
+    gaps = []
+    
+    for i in range(len(textlines_on_page) - 1):
+        current_line = textlines_on_page[i]
+        next_line = textlines_on_page[i + 1]
+        
+        # Calculate vertical gap using bbox coordinates
+        if 'features' in current_line and 'features' in next_line:
+            current_bbox = current_line['features']['bbox']
+            next_bbox = next_line['features']['bbox']
+            
+            if current_bbox and next_bbox and len(current_bbox) >= 4 and len(next_bbox) >= 4:
+                gap = next_bbox[1] - current_bbox[3]  # next_top - current_bottom
+                if gap > 0:
+                    gaps.append(gap)
+    
+    stats['median_gap'] = float(np.median(gaps)) if gaps else DEFAULT_MEDIAN_GAP
+    return stats
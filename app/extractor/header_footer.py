@@ -0,0 +1,83 @@
+import re
+import numpy as np
+from typing import List, Dict, Set, Tuple
+
+# Digits are folded so that "Page 3 of 12" and "Page 4 of 12" share one key
+DIGIT_PATTERN = re.compile(r'\d+')
+
+def margin_text_key(text: str) -> str:
+    """Normalize a line's text for running header/footer comparison"""
+    return ' '.join(DIGIT_PATTERN.sub('#', text).split()).lower()
+
+def relative_positions(lines: List[Dict], page_height: float) -> np.ndarray:
+    """Vertical center of each line as a fraction of the page height"""
+    bboxes = np.array([line['bbox'][:4] for line in lines], dtype=np.float64).reshape(-1, 4)
+    return ((bboxes[:, 1] + bboxes[:, 3]) / 2.0) / (page_height if page_height > 0 else 1.0)
+
+def margin_line_groups(lines: List[Dict], page_height: float, margin_ratio: float = 0.12,
+                       band_ratio: float = 0.02) -> List[Tuple[int, Tuple[str, int]]]:
+    """
+    Return (line index, (text key, vertical band)) for the lines of one page that
+    sit in the top or bottom margin.
+    """
+    if not lines:
+        return []
+    relative_y = relative_positions(lines, page_height)
+    in_margin = (relative_y <= margin_ratio) | (relative_y >= 1.0 - margin_ratio)
+    n_bands = int(np.ceil(1.0 / band_ratio)) + 1
+    bands = np.clip(np.round(relative_y / band_ratio).astype(np.int64), 0, n_bands - 1)
+
+    groups = []
+    for i in np.flatnonzero(in_margin):
+        key = margin_text_key(lines[i]['text'])
+        if key:
+            groups.append((int(i), (key, int(bands[i]))))
+    return groups
+
+def margin_candidates(lines: List[Dict], page_height: float, margin_ratio: float = 0.12,
+                      band_ratio: float = 0.02) -> List[Tuple[str, int]]:
+    """Margin groups of one page; only these are kept between the two extraction passes"""
+    return [group for _, group in margin_line_groups(lines, page_height, margin_ratio, band_ratio)]
+
+def find_repeated_margin_groups(page_candidates: Dict[int, List[Tuple[str, int]]], content_page_count: int,
+                                min_frequency: float = 0.9) -> Set[Tuple[str, int]]:
+    """
+    Find the (text key, band) groups that repeat on at least `min_frequency` of
+    the pages carrying text. Counting is done once per document on NumPy arrays.
+    """
+    if content_page_count <= 2 or not page_candidates:
+        return set()
+
+    key_table = {}
+    group_ids = []
+    page_ids = []
+    for page_num, candidates in page_candidates.items():
+        for group in candidates:
+            group_ids.append(key_table.setdefault(group, len(key_table)))
+            page_ids.append(page_num)
+    if not group_ids:
+        return set()
+
+    group_ids = np.array(group_ids, dtype=np.int64)
+    page_ids = np.array(page_ids, dtype=np.int64)
+    _, page_pos = np.unique(page_ids, return_inverse=True)
+    n_pages = int(page_pos.max()) + 1
+
+    # Distinct (group, page) pairs, then the number of pages per group
+    group_page_pairs = np.unique(group_ids * n_pages + page_pos)
+    groups, page_counts = np.unique(group_page_pairs // n_pages, return_counts=True)
+
+    min_occurrences = max(2, int(content_page_count * min_frequency))
+    repeated_ids = set(groups[page_counts >= min_occurrences].tolist())
+    return {group for group, group_id in key_table.items() if group_id in repeated_ids}
+
+def flag_margin_lines(lines: List[Dict], page_height: float, repeated_groups: Set[Tuple[str, int]],
+                      margin_ratio: float = 0.12, band_ratio: float = 0.02) -> np.ndarray:
+    """Boolean mask over one page's lines: True for running headers/footers"""
+    mask = np.zeros(len(lines), dtype=bool)
+    if not lines or not repeated_groups:
+        return mask
+    for i, group in margin_line_groups(lines, page_height, margin_ratio, band_ratio):
+        if group in repeated_groups:
+            mask[i] = True
+    return mask
@@ -1,15 +1,29 @@
 import pymupdf4llm
 import pymupdf
 import pathlib
-import json
 import sys
-import re
 import os # <-- Added for os.path.basename
+import math
+import time
+import heapq
+import multiprocessing
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Dict, Set, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import List, Dict, Set, Tuple, Iterator
+from page_stream import PAGE_WINDOW, page_windows, release_page_cache, write_record, iter_records, spill_path_for, remove_spill
+from page_router import route_pages, summarize_routes
+from ocr_stage import ocr_page_chunk
+from text_normalize import normalize_for_pattern_detection
 
-# ... (all your helper functions like make_serializable, extract_text_fallback, etc. are unchanged) ...
+# Documents with at least this many text pages are converted in parallel chunks
+PARALLEL_MIN_PAGES = 100
+
+# Header/footer patterns of longer documents are found on this many evenly spread pages.
+# 100 pages estimate an 80% page frequency to within about +/-8% at 95% confidence.
+HEADER_FOOTER_SAMPLE_PAGES = 100
+
+# ... (all your helper functions like make_serializable, iter_fallback_pages, etc. are unchanged) ...
 def make_serializable(obj):
     if hasattr(obj, '__dict__'):
         return obj.__dict__
@@ -18,14 +32,19 @@ def make_serializable(obj):
     else:
         return str(obj)
 
-def extract_text_fallback(pdf_path):
-    print("  Using fallback text extraction...")
+def iter_fallback_pages(pdf_path, text_pages=None, routed=False) -> Iterator[Dict]:
+    """Plain PyMuPDF text extraction, yielding one page chunk at a time (routed: pages the page router sent here)"""
+    if routed:
+        print(f"  Using plain text extraction for {len(text_pages)} routed pages...")
+    else:
+        print("  Using fallback text extraction...")
     doc = pymupdf.open(pdf_path)
-    pages_data = []
-    for page_num, page in enumerate(doc, 1):
+    page_numbers = text_pages if text_pages is not None else range(1, doc.page_count + 1)
+    for count, page_num in enumerate(page_numbers, 1):
+        page = doc[page_num - 1]
         text = page.get_text()
         if text.strip():
-            pages_data.append({'text': text, 'metadata': {'page': page_num}})
+            yield {'text': text, 'metadata': {'page': page_num}}
         else:
             text_dict = page.get_text("dict")
             lines = []
@@ -38,22 +57,14 @@ def extract_text_fallback(pdf_path):
                         if line_text.strip():
                             lines.append(line_text.strip())
             if lines:
-                pages_data.append({'text': '\n'.join(lines), 'metadata': {'page': page_num}})
+                yield {'text': '\n'.join(lines), 'metadata': {'page': page_num}}
             else:
                 print(f"    Warning: No text found on page {page_num}")
-                pages_data.append({'text': '', 'metadata': {'page': page_num}})
+                yield {'text': '', 'metadata': {'page': page_num}}
+        del page
+        if count % PAGE_WINDOW == 0:
+            release_page_cache()
     doc.close()
-    return pages_data
-
-def normalize_for_pattern_detection(line: str) -> str:
-    normalized = line.strip()
-    if len(normalized) < 2: return ""
-    normalized = re.sub(r'\bpage\s+\d+\s+of\s+\d+\b', 'page X of Y', normalized, flags=re.IGNORECASE)
-    normalized = re.sub(r'\b\d+\s+of\s+\d+\b', 'X of Y', normalized)
-    normalized = re.sub(r'\bpage\s+\d+\b', 'page X', normalized, flags=re.IGNORECASE)
-    normalized = re.sub(r'^\s*\d+\s*$', 'X', normalized)
-    normalized = ' '.join(normalized.split()).lower()
-    return normalized
 
 def extract_page_lines(page_data: Dict, page_index: int, max_lines: int = 5) -> Dict:
     page_text = page_data.get('text', '')
@@ -65,7 +76,54 @@ def extract_page_lines(page_data: Dict, page_index: int, max_lines: int = 5) ->
     bottom_lines = all_lines[-min(max_lines, len(all_lines)):] if len(all_lines) > max_lines else []
     return {'page_num': page_num, 'all_lines': all_lines, 'top_lines': top_lines, 'bottom_lines': bottom_lines, 'line_count': len(all_lines)}
 
-def identify_header_footer_patterns(page_analyses: List[Dict], min_frequency: float = 0.8) -> Tuple[Set[str], Set[str]]:
+def select_pattern_lines(all_lines: List[str]) -> List[Tuple[int, str]]:
+    """The (index, line) pairs of a page that can hold a header/footer: all lines of short pages, else the first 6 and last 5"""
+    if len(all_lines) < 10:
+        return [(i, line) for i, line in enumerate(all_lines)]
+    lines_to_check = []
+    for i in range(min(6, len(all_lines))): lines_to_check.append((i, all_lines[i]))
+    for i in range(max(6, len(all_lines) - 5), len(all_lines)): lines_to_check.append((i, all_lines[i]))
+    return lines_to_check
+
+def sample_pages(pages: List[Dict], sample_size: int) -> List[Dict]:
+    """Pick sample_size pages spread evenly from the first to the last page"""
+    if sample_size is None or len(pages) <= sample_size:
+        return pages
+    if sample_size <= 1:
+        return pages[:1]
+    last = len(pages) - 1
+    return [pages[round(k * last / (sample_size - 1))] for k in range(sample_size)]
+
+def collect_pattern_stats(page_analyses: List[Dict]) -> Dict:
+    """Pages, relative positions and examples of every candidate key"""
+    all_patterns = defaultdict(lambda: {'pages': set(), 'positions': [], 'examples': []})
+    for page_analysis in page_analyses:
+        page_num = page_analysis['page_num']
+        line_count = page_analysis['line_count']
+        # Streamed analyses carry only their candidate lines, not the whole page
+        if 'candidate_lines' in page_analysis:
+            lines_to_check = page_analysis['candidate_lines']
+        else:
+            lines_to_check = select_pattern_lines(page_analysis['all_lines'])
+        for candidate in lines_to_check:
+            i, line = candidate[0], candidate[1]
+            # Streamed candidates carry their key, normalized once in the first pass
+            normalized = candidate[2] if len(candidate) > 2 else normalize_for_pattern_detection(line)
+            all_patterns[normalized]['pages'].add(page_num)
+            relative_pos = i / (line_count - 1) if line_count > 1 else 0.5
+            all_patterns[normalized]['positions'].append(relative_pos)
+            if len(all_patterns[normalized]['examples']) < 3: all_patterns[normalized]['examples'].append(line)
+    return all_patterns
+
+def identify_header_footer_patterns(page_analyses: List[Dict], min_frequency: float = 0.8,
+                                    sample_size: int = None) -> Tuple[Set[str], Set[str]]:
+    """
+    Find normalized lines that repeat near the top (headers) or bottom (footers) of
+    at least min_frequency of the pages. With sample_size set, documents with more
+    pages are only examined on that many evenly spread pages, and the frequency is
+    estimated there: a heuristic, as a pattern close to min_frequency may be decided
+    either way.
+    """
     pages_with_content = [p for p in page_analyses if p['line_count'] > 0]
     total_pages = len(pages_with_content)
     if total_pages <= 2: return set(), set()
@@ -73,22 +131,11 @@ def identify_header_footer_patterns(page_analyses: List[Dict], min_frequency: fl
     print(f"  Analyzing {total_pages} pages for repeating patterns...")
     print(f"  Minimum occurrences required: {min_occurrences} pages ({min_frequency*100}%)")
     print(f"  Checking only first 5 and last 5 lines of each page")
-    all_patterns = defaultdict(lambda: {'pages': set(), 'positions': [], 'examples': []})
-    for page_analysis in pages_with_content:
-        page_num = page_analysis['page_num']
-        all_lines = page_analysis['all_lines']
-        if len(all_lines) < 10:
-            lines_to_check = [(i, line) for i, line in enumerate(all_lines)]
-        else:
-            lines_to_check = []
-            for i in range(min(6, len(all_lines))): lines_to_check.append((i, all_lines[i]))
-            for i in range(max(6, len(all_lines) - 5), len(all_lines)): lines_to_check.append((i, all_lines[i]))
-        for i, line in lines_to_check:
-            normalized = normalize_for_pattern_detection(line)
-            all_patterns[normalized]['pages'].add(page_num)
-            relative_pos = i / (len(all_lines) - 1) if len(all_lines) > 1 else 0.5
-            all_patterns[normalized]['positions'].append(relative_pos)
-            if len(all_patterns[normalized]['examples']) < 3: all_patterns[normalized]['examples'].append(line)
+    sampled_pages = sample_pages(pages_with_content, sample_size)
+    if len(sampled_pages) < total_pages:
+        min_occurrences = max(2, int(len(sampled_pages) * min_frequency))
+        print(f"  Estimating on {len(sampled_pages)} sampled pages: {min_occurrences} occurrences required")
+    all_patterns = collect_pattern_stats(sampled_pages)
     header_patterns = set()
     footer_patterns = set()
     for pattern, info in all_patterns.items():
@@ -107,115 +154,283 @@ def identify_header_footer_patterns(page_analyses: List[Dict], min_frequency: fl
 def filter_page_lines(page_analysis: Dict, header_patterns: Set[str], footer_patterns: Set[str]) -> List[str]:
     if page_analysis['line_count'] == 0: return []
     filtered_lines = []
-    for line in page_analysis['all_lines']:
-        normalized = normalize_for_pattern_detection(line)
+    keys = page_analysis.get('keys') or [normalize_for_pattern_detection(line) for line in page_analysis['all_lines']]
+    for line, normalized in zip(page_analysis['all_lines'], keys):
         if normalized in header_patterns or normalized in footer_patterns:
             continue
         filtered_lines.append(line)
     return filtered_lines
 
 
-# CHANGED: The function now accepts full paths as arguments
-def pdf_to_markdown(input_pdf_path, output_json_path):
+def iter_pymupdf4llm_pages(input_pdf_path, text_pages=None) -> Iterator[Dict]:
     """
-    Convert a PDF file to Markdown JSON with improved text extraction.
-    Accepts full input and output paths.
+    Run pymupdf4llm window by window on the given pages (1-based, None = all),
+    yielding page chunks. Header levels are identified once on the pages being
+    converted, exactly as a single to_markdown call would, and reused by every window.
     """
-    pdf_name = os.path.basename(input_pdf_path)
-    print(f"Processing {pdf_name}...")
+    doc = pymupdf.open(input_pdf_path)
+    try:
+        page_indices = [page_num - 1 for page_num in text_pages] if text_pages is not None else list(range(doc.page_count))
+        hdr_info = pymupdf4llm.IdentifyHeaders(doc, pages=page_indices)
+        for window in page_windows(page_indices):
+            yield from pymupdf4llm.to_markdown(
+                doc,
+                pages=window,
+                hdr_info=hdr_info,
+                page_chunks=True,
+                ignore_images=True,
+                ignore_graphics=True,
+                dpi=150,
+            )
+            release_page_cache()
+    finally:
+        doc.close()
+
+def resolve_markdown_workers(page_count: int, requested_workers=None) -> int:
+    """
+    Number of worker processes for pymupdf4llm. An explicit request wins (1 = sequential);
+    otherwise long documents use every core and short ones stay in-process.
+    """
+    if requested_workers is not None:
+        return max(1, min(int(requested_workers), page_count or 1))
+    if page_count < PARALLEL_MIN_PAGES:
+        return 1
+    return max(1, min(os.cpu_count() or 1, page_count // PAGE_WINDOW))
+
+def convert_page_chunk(input_pdf_path, page_indices, hdr_info) -> List[Dict]:
+    """Worker: convert one contiguous range of pages (0-based) with the document's header levels"""
+    doc = pymupdf.open(input_pdf_path)
+    try:
+        page_chunks = []
+        for window in page_windows(page_indices):
+            page_chunks.extend(pymupdf4llm.to_markdown(
+                doc,
+                pages=window,
+                hdr_info=hdr_info,
+                page_chunks=True,
+                ignore_images=True,
+                ignore_graphics=True,
+                dpi=150,
+            ))
+            release_page_cache()
+        return page_chunks
+    finally:
+        doc.close()
+
+def iter_pymupdf4llm_pages_parallel(input_pdf_path, text_pages, workers: int) -> Iterator[Dict]:
+    """
+    Split the pages into one contiguous range per worker and convert the ranges in
+    separate processes. Results come back in range order, so the merged chunks are
+    the same as a sequential run.
+    """
+    doc = pymupdf.open(input_pdf_path)
+    try:
+        page_indices = [page_num - 1 for page_num in text_pages] if text_pages is not None else list(range(doc.page_count))
+        hdr_info = pymupdf4llm.IdentifyHeaders(doc, pages=page_indices)
+    finally:
+        doc.close()
+    
+    chunk_size = max(PAGE_WINDOW, math.ceil(len(page_indices) / workers))
+    page_ranges = [page_indices[start:start + chunk_size] for start in range(0, len(page_indices), chunk_size)]
+    workers = max(1, min(workers, len(page_ranges)))
+    print(f"  Converting {len(page_indices)} pages in {len(page_ranges)} chunks on {workers} worker processes...")
     
+    # spawn: the caller runs alongside the span extractor thread, which is not fork-safe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        for page_chunks in executor.map(convert_page_chunk, repeat(input_pdf_path), page_ranges, repeat(hdr_info)):
+            yield from page_chunks
+
+def timed_chunks(page_chunks: Iterator[Dict], timing: Dict, key: str = 'markdown_seconds') -> Iterator[Dict]:
+    """Pass chunks through, adding the time spent producing them to timing[key]"""
+    while True:
+        start_time = time.time()
+        try:
+            page_chunk = next(page_chunks)
+        except StopIteration:
+            timing[key] += time.time() - start_time
+            return
+        timing[key] += time.time() - start_time
+        yield page_chunk
+
+def iter_routed_pages(input_pdf_path, routes: Dict, workers: int, timing: Dict) -> Iterator[Dict]:
+    """
+    Convert only the routed pages with pymupdf4llm and take plain text lines for the
+    others, merging both streams back into page order.
+    """
+    markdown_pages = routes['markdown_pages']
+    plain_pages = routes['text_pages']
+    markdown_chunks = iter(())
+    if markdown_pages:
+        if workers > 1:
+            markdown_chunks = iter_pymupdf4llm_pages_parallel(input_pdf_path, markdown_pages, workers)
+        else:
+            markdown_chunks = iter_pymupdf4llm_pages(input_pdf_path, markdown_pages)
+    plain_chunks = iter_fallback_pages(input_pdf_path, plain_pages, routed=True) if plain_pages else iter(())
+    yield from heapq.merge(timed_chunks(markdown_chunks, timing), timed_chunks(plain_chunks, timing, 'plain_seconds'),
+                           key=lambda page_chunk: page_chunk['metadata']['page'])
+
+def spill_markdown_pages(page_chunks: Iterator[Dict], spill_path: str,
+                         ocr_results: Dict[int, List[Dict]] = None) -> Tuple[List[Dict], Dict, int, int]:
+    """
+    Pass 1: write each page's lines to the spill file and keep only what header/footer
+    detection needs (line count and candidate lines) in memory.
+    ocr_results ({page_num: OCR lines}) are merged in as plain-text pages, in page order.
+    Returns (page_analyses, metadata, total_text, page_count).
+    """
+    if ocr_results:
+        ocr_chunks = (ocr_page_chunk(page_num, lines) for page_num, lines in sorted(ocr_results.items()))
+        page_chunks = heapq.merge(page_chunks, ocr_chunks, key=lambda page_chunk: page_chunk['metadata']['page'])
+    page_analyses = []
+    metadata = {}
+    total_text = 0
+    page_count = 0
+    with open(spill_path, 'w', encoding='utf-8') as spill:
+        for i, page_data in enumerate(page_chunks):
+            if page_count == 0:
+                metadata = page_data.get('metadata', {})
+            page_count += 1
+            total_text += len(page_data.get('text', '').strip())
+            page_analysis = extract_page_lines(page_data, i)
+            # Every line is normalized exactly once; mining and filtering reuse the keys
+            keys = [normalize_for_pattern_detection(line) for line in page_analysis['all_lines']]
+            write_record(spill, {'page_num': page_analysis['page_num'], 'all_lines': page_analysis['all_lines'], 'keys': keys})
+            page_analyses.append({
+                'page_num': page_analysis['page_num'],
+                'line_count': page_analysis['line_count'],
+                'candidate_lines': [(line_index, line, keys[line_index]) for line_index, line in select_pattern_lines(page_analysis['all_lines'])],
+            })
+    return page_analyses, metadata, total_text, page_count
+
+def convert_with_pymupdf4llm(input_pdf_path, spill_path, text_pages=None, workers=1, routes=None, timing=None,
+                             ocr_results=None):
+    """Stream pymupdf4llm output into the spill file, falling back to plain text extraction.
+    With routes (from page_router.route_pages) only the routed pages go through pymupdf4llm.
+    ocr_results are merged into the page stream (see spill_markdown_pages)."""
     print("  Attempting extraction with pymupdf4llm...")
     try:
-        md_data = pymupdf4llm.to_markdown(
-            input_pdf_path, 
-            page_chunks=True,
-            ignore_images=True,
-            ignore_graphics=True,
-            dpi=150,
-        )
-        total_text = sum(len(page.get('text', '').strip()) for page in md_data)
+        if routes is not None:
+            page_chunks = iter_routed_pages(input_pdf_path, routes, workers, timing)
+        elif workers > 1:
+            page_chunks = iter_pymupdf4llm_pages_parallel(input_pdf_path, text_pages, workers)
+        else:
+            page_chunks = iter_pymupdf4llm_pages(input_pdf_path, text_pages)
+        result = spill_markdown_pages(page_chunks, spill_path, ocr_results)
+        total_text = result[2]
         if total_text < 100:
             print(f"  pymupdf4llm extracted only {total_text} characters, trying fallback...")
-            md_data = extract_text_fallback(input_pdf_path)
+            result = spill_markdown_pages(iter_fallback_pages(input_pdf_path, text_pages), spill_path, ocr_results)
         else:
             print(f"  pymupdf4llm successfully extracted {total_text} characters")
     except Exception as e:
         print(f"  pymupdf4llm failed: {e}")
         print("  Using fallback extraction...")
-        md_data = extract_text_fallback(input_pdf_path)
+        result = spill_markdown_pages(iter_fallback_pages(input_pdf_path, text_pages), spill_path, ocr_results)
+    return result
+
+# CHANGED: The function now accepts full paths as arguments
+def report_routing(routes: Dict, timing: Dict, router_seconds: float):
+    """
+    Print the per-page routing decision and the estimated conversion time it saved:
+    pymupdf4llm's time for the routed plain pages, less routing and plain text extraction
+    """
+    markdown_pages = len(routes['markdown_pages'])
+    plain_pages = len(routes['text_pages'])
+    plain_seconds = timing['plain_seconds']
+    print(f"  [ROUTER] {summarize_routes(routes)}; plain text for {plain_pages} pages in {plain_seconds:.2f}s")
+    if markdown_pages:
+        seconds_per_page = timing['markdown_seconds'] / markdown_pages
+        saved = seconds_per_page * plain_pages - router_seconds - plain_seconds
+        print(f"  [ROUTER] pymupdf4llm {seconds_per_page:.3f}s/page, estimated {saved:.2f}s saved "
+              f"(routing took {router_seconds:.2f}s)")
+    else:
+        print(f"  [ROUTER] pymupdf4llm skipped entirely (routing took {router_seconds:.2f}s)")
+
+def pdf_to_markdown(input_pdf_path, output_json_path, text_pages=None, route='markdown', workers=None,
+                    selective=False, ocr_results=None):
+    """
+    Convert a PDF file to Markdown JSON Lines with improved text extraction.
+    Accepts full input and output paths.
+    text_pages (1-based) and route come from the preflight text-layer check:
+    pages without text are never converted, and route='fallback' skips pymupdf4llm.
+    workers sets the number of pymupdf4llm processes (None = automatic, 1 = sequential).
+    selective routes each page first and runs pymupdf4llm only on pages where headings,
+    tables or multiple columns can change the outcome; the rest use plain text lines.
+    ocr_results ({page_num: OCR lines}) supply the pages without a text layer.
+
+    Pages are streamed in two passes so memory stays bounded by a window of pages.
+    Output records:
+      {"metadata", "total_pages"}          first record
+      {"page_number", "lines": [...]}      one record per page with remaining lines
+    """
+    pdf_name = os.path.basename(input_pdf_path)
+    print(f"Processing {pdf_name}...")
     
-    metadata = {}
-    if md_data and len(md_data) > 0:
-        first_page = md_data[0]
-        if 'metadata' in first_page:
-            metadata = first_page['metadata']
+    spill_path = spill_path_for(output_json_path)
+    if route in ('fallback', 'no_text'):
+        print("  Preflight found too little text for pymupdf4llm, skipping it")
+        result = spill_markdown_pages(iter_fallback_pages(input_pdf_path, text_pages), spill_path, ocr_results)
+    else:
+        routes = None
+        timing = {'markdown_seconds': 0.0, 'plain_seconds': 0.0}
+        if selective:
+            router_start = time.time()
+            routes = route_pages(input_pdf_path, text_pages)
+            router_seconds = time.time() - router_start
+            page_count = len(routes['markdown_pages'])
+        elif text_pages is not None:
+            page_count = len(text_pages)
         else:
-            metadata = {
-                "file_path": input_pdf_path,
-                "page_count": len(md_data),
-                "extraction_method": "fallback" if 'fallback' in str(type(md_data)) else "pymupdf4llm"
-            }
+            with pymupdf.open(input_pdf_path) as doc:
+                page_count = doc.page_count
+        result = convert_with_pymupdf4llm(input_pdf_path, spill_path, text_pages,
+                                          resolve_markdown_workers(page_count, workers), routes, timing, ocr_results)
+        if routes is not None:
+            report_routing(routes, timing, router_seconds)
+    page_analyses, metadata, _, page_count = result
     
-    print(f"  Extracted {len(md_data)} page chunks")
+    print(f"  Extracted {page_count} page chunks")
     
     print("  Analyzing pages for header/footer detection...")
-    page_analyses = []
-    max_check_lines = min(6, max(3, len(md_data) // 8))
-    with ThreadPoolExecutor(max_workers=min(8, len(md_data))) as executor:
-        future_to_index = {
-            executor.submit(extract_page_lines, page_data, i, max_check_lines): i 
-            for i, page_data in enumerate(md_data)
-        }
-        for future in as_completed(future_to_index):
-            page_analysis = future.result()
-            page_analyses.append(page_analysis)
-    page_analyses.sort(key=lambda x: x['page_num'])
-    
-    header_patterns, footer_patterns = identify_header_footer_patterns(page_analyses, min_frequency=0.9)
+    header_patterns, footer_patterns = identify_header_footer_patterns(page_analyses, min_frequency=0.9,
+                                                                       sample_size=HEADER_FOOTER_SAMPLE_PAGES)
     
     if header_patterns or footer_patterns:
         print(f"  Filtering out {len(header_patterns)} header and {len(footer_patterns)} footer patterns...")
-        filtered_pages = []
-        with ThreadPoolExecutor(max_workers=min(8, len(page_analyses))) as executor:
-            future_to_page = {
-                executor.submit(filter_page_lines, page_analysis, header_patterns, footer_patterns): page_analysis
-                for page_analysis in page_analyses
-            }
-            for future in as_completed(future_to_page):
-                page_analysis = future_to_page[future]
-                filtered_lines = future.result()
-                filtered_pages.append({'page_num': page_analysis['page_num'], 'filtered_lines': filtered_lines})
-        filtered_pages.sort(key=lambda x: x['page_num'])
     else:
         print("  No repetitive headers/footers detected")
-        filtered_pages = [{'page_num': p['page_num'], 'filtered_lines': p['all_lines']} for p in page_analyses]
     
+    # Pass 2: filter each spilled page and number the remaining lines
     print("  Creating final JSON structure...")
-    lines_data = []
+    original_line_count = 0
     line_number = 1
-    for page_info in filtered_pages:
-        page_num = page_info['page_num']
-        for line in page_info['filtered_lines']:
-            lines_data.append({"line_number": line_number, "page_number": page_num, "text": line})
-            line_number += 1
-    
-    final_output = {
-        "metadata": metadata,
-        "total_lines": len(lines_data),
-        "total_pages": len(md_data),
-        "lines": lines_data
-    }
-    
     # CHANGED: Use the provided output_json_path argument
     with open(output_json_path, 'w', encoding='utf-8') as f:
-        json.dump(final_output, f, indent=2, ensure_ascii=False, default=make_serializable)
+        write_record(f, {"metadata": metadata, "total_pages": page_count}, default=make_serializable)
+        for page_record in iter_records(spill_path):
+            page_num = page_record['page_num']
+            all_lines = page_record['all_lines']
+            original_line_count += len(all_lines)
+            if header_patterns or footer_patterns:
+                filtered_lines = filter_page_lines({'line_count': len(all_lines), 'all_lines': all_lines,
+                                                    'keys': page_record.get('keys')},
+                                                   header_patterns, footer_patterns)
+            else:
+                filtered_lines = all_lines
+            if not filtered_lines:
+                continue
+            lines_data = []
+            for line in filtered_lines:
+                lines_data.append({"line_number": line_number, "page_number": page_num, "text": line})
+                line_number += 1
+            write_record(f, {"page_number": page_num, "lines": lines_data})
+    remove_spill(output_json_path)
     
-    original_line_count = sum(len(page['all_lines']) for page in page_analyses)
-    removed_lines = original_line_count - len(lines_data)
+    final_line_count = line_number - 1
+    removed_lines = original_line_count - final_line_count
     
     print(f"Converted {pdf_name} to {os.path.basename(output_json_path)}")
     print(f"  Original lines: {original_line_count}")
-    print(f"  Final lines: {len(lines_data)}")
+    print(f"  Final lines: {final_line_count}")
     if removed_lines > 0:
         print(f"  Lines removed: {removed_lines} ({removed_lines/original_line_count*100:.1f}%)")
     
@@ -224,7 +439,7 @@ def pdf_to_markdown(input_pdf_path, output_json_path):
 # This block allows you to test this script by itself
 if __name__ == "__main__":
     if len(sys.argv) < 3:
-        print("Usage: python markdowntext.py <path_to_input.pdf> <path_to_output.json>")
+        print("Usage: python markdowntext.py <path_to_input.pdf> <path_to_output.jsonl>")
         sys.exit(1)
     
     input_path = sys.argv[1]
@@ -52,11 +52,18 @@ Usage
 import os
 import sys
 import fitz
+import numpy as np
+from bbox_geometry import as_boxes, first_container, intersects_matrix
 
 
-def column_boxes(page, footer_margin=50, header_margin=50, no_image_text=True):
-    """Determine bboxes which wrap a column."""
-    paths = page.get_drawings()
+def column_boxes(page, footer_margin=50, header_margin=50, no_image_text=True, paths=None, blocks=None):
+    """Determine bboxes which wrap a column.
+
+    paths (the page's drawings) and blocks (its TEXTFLAGS_TEXT dict blocks inside the
+    header/footer margins) may be passed in when the caller already has them.
+    """
+    if paths is None:
+        paths = page.get_drawings()
     bboxes = []
 
     # path rectangles
@@ -83,28 +90,22 @@ def column_boxes(page, footer_margin=50, header_margin=50, no_image_text=True):
         Returns:
             True if 'temp' has no intersections with items of 'bboxlist'.
         """
-        for b in bboxlist:
-            if not intersects_bboxes(temp, vert_bboxes) and (
-                b == None or b == bb or (temp & b).is_empty
-            ):
-                continue
+        if not bboxlist:
+            return True
+        if intersects_bboxes(temp, vert_boxes):
             return False
+        others = [b for b in bboxlist if b is not None and b != bb]
+        return not intersects_bboxes(temp, as_boxes(others))
 
-        return True
+    def in_bbox(bb, boxes):
+        """Return 1-based number if a box of the (N, 4) array contains bb, else return 0."""
+        return int(first_container(as_boxes([bb]), boxes)[0])
 
-    def in_bbox(bb, bboxes):
-        """Return 1-based number if a bbox contains bb, else return 0."""
-        for i, bbox in enumerate(bboxes):
-            if bb in bbox:
-                return i + 1
-        return 0
-
-    def intersects_bboxes(bb, bboxes):
-        """Return True if a bbox intersects bb, else return False."""
-        for bbox in bboxes:
-            if not (bb & bbox).is_empty:
-                return True
-        return False
+    def intersects_bboxes(bb, boxes):
+        """Return True if a box of the (N, 4) array intersects bb, else return False."""
+        if len(boxes) == 0:
+            return False
+        return bool(intersects_matrix(as_boxes([bb]), boxes).any())
 
     def extend_right(bboxes, width, path_bboxes, vert_bboxes, img_bboxes):
         """Extend a bbox to the right page border.
@@ -115,19 +116,28 @@ def column_boxes(page, footer_margin=50, header_margin=50, no_image_text=True):
         Args:
             bboxes: (list[IRect]) bboxes to check
             width: (int) page width
-            path_bboxes: (list[IRect]) bboxes with a background color
-            vert_bboxes: (list[IRect]) bboxes with vertical text
-            img_bboxes: (list[IRect]) bboxes of images
+            path_bboxes: (N, 4) array of bboxes with a background color
+            vert_bboxes: (N, 4) array of bboxes with vertical text
+            img_bboxes: (N, 4) array of bboxes of images
         Returns:
             Potentially modified bboxes.
         """
+        # containment and blocking checks for all bboxes at once
+        boxes = as_boxes(bboxes)
+        in_path = first_container(boxes, path_bboxes)
+        in_image = first_container(boxes, img_bboxes)
+        extended = boxes.copy()
+        extended[:, 2] = width
+        blockers = np.concatenate([path_bboxes, vert_bboxes, img_bboxes])
+        blocked = intersects_matrix(extended, blockers).any(axis=1) if len(blockers) else np.zeros(len(boxes), dtype=bool)
+
         for i, bb in enumerate(bboxes):
             # do not extend text with background color
-            if in_bbox(bb, path_bboxes):
+            if in_path[i]:
                 continue
 
             # do not extend text in images
-            if in_bbox(bb, img_bboxes):
+            if in_image[i]:
                 continue
 
             # temp extends bb to the right page border
@@ -135,7 +145,7 @@ def column_boxes(page, footer_margin=50, header_margin=50, no_image_text=True):
             temp.x1 = width
 
             # do not cut through colored background or images
-            if intersects_bboxes(temp, path_bboxes + vert_bboxes + img_bboxes):
+            if blocked[i]:
                 continue
 
             # also, do not intersect other text bboxes
@@ -194,19 +204,24 @@ def column_boxes(page, footer_margin=50, header_margin=50, no_image_text=True):
     for item in page.get_images():
         img_bboxes.extend(page.get_image_rects(item[0]))
 
+    # (N, 4) arrays for the batch geometry checks
+    path_boxes = as_boxes(path_bboxes)
+    img_boxes = as_boxes(img_bboxes)
+
     # blocks of text on page
-    blocks = page.get_text(
-        "dict",
-        flags=fitz.TEXTFLAGS_TEXT,
-        clip=clip,
-    )["blocks"]
+    if blocks is None:
+        blocks = page.get_text(
+            "dict",
+            flags=fitz.TEXTFLAGS_TEXT,
+            clip=clip,
+        )["blocks"]
 
     # Make block rectangles, ignoring non-horizontal text
-    for b in blocks:
-        bbox = fitz.IRect(b["bbox"])  # bbox of the block
-
+    block_rects = [fitz.IRect(b["bbox"]) for b in blocks]
+    on_image = first_container(as_boxes(block_rects), img_boxes)
+    for b, bbox, image_index in zip(blocks, block_rects, on_image):
         # ignore text written upon images
-        if no_image_text and in_bbox(bbox, img_bboxes):
+        if no_image_text and image_index:
             continue
 
         # confirm first line to be horizontal
@@ -226,12 +241,16 @@ def column_boxes(page, footer_margin=50, header_margin=50, no_image_text=True):
         if not bbox.is_empty:
             bboxes.append(bbox)
 
+    vert_boxes = as_boxes(vert_bboxes)
+
     # Sort text bboxes by ascending background, top, then left coordinates
-    bboxes.sort(key=lambda k: (in_bbox(k, path_bboxes), k.y0, k.x0))
+    in_path = first_container(as_boxes(bboxes), path_boxes)
+    order = sorted(range(len(bboxes)), key=lambda i: (in_path[i], bboxes[i].y0, bboxes[i].x0))
+    bboxes = [bboxes[i] for i in order]
 
     # Extend bboxes to the right where possible
     bboxes = extend_right(
-        bboxes, int(page.rect.width), path_bboxes, vert_bboxes, img_bboxes
+        bboxes, int(page.rect.width), path_boxes, vert_boxes, img_boxes
     )
 
     # immediately return of no text found
@@ -257,7 +276,7 @@ def column_boxes(page, footer_margin=50, header_margin=50, no_image_text=True):
                 continue
 
             # never join across different background colors
-            if in_bbox(nbb, path_bboxes) != in_bbox(bb, path_bboxes):
+            if in_bbox(nbb, path_boxes) != in_bbox(bb, path_boxes):
                 continue
 
             temp = bb | nbb  # temporary extension of new block
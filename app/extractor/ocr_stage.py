@@ -0,0 +1,168 @@
+import csv
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import pymupdf
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import List, Dict, Tuple
+from font_index import intern_font
+
+# Render resolution for pages without a text layer
+OCR_DPI = 300
+OCR_LANGUAGE = 'eng'
+TESSERACT_CMD = 'tesseract'
+# Words below this tesseract confidence (0-100) are dropped as noise
+OCR_MIN_WORD_CONFIDENCE = 30
+# Font name recorded for OCR lines in the span font table
+OCR_FONT_NAME = 'OCR'
+
+def tesseract_available() -> bool:
+    return shutil.which(TESSERACT_CMD) is not None
+
+def render_page_png(doc, page_num: int, dpi: int) -> bytes:
+    """Render one page (1-based) to PNG bytes, in grayscale like tesseract uses it"""
+    pixmap = doc[page_num - 1].get_pixmap(dpi=dpi, colorspace=pymupdf.csGRAY)
+    return pixmap.tobytes("png")
+
+def page_image_key(png: bytes, dpi: int) -> str:
+    """Cache key: hash of the rendered page image plus the settings that change the OCR result"""
+    return f"{hashlib.sha256(png).hexdigest()}_{dpi}_{OCR_LANGUAGE}"
+
+def parse_tesseract_tsv(tsv_text: str, dpi: int) -> List[Dict]:
+    """
+    Group tesseract TSV words into lines. Pixel boxes are scaled to PDF points;
+    the estimated font size is the line height in points.
+    Returns [{'text', 'bbox': [x0, y0, x1, y1], 'size'}] in reading order.
+    """
+    scale = 72.0 / dpi
+    lines = defaultdict(list)
+    for row in csv.DictReader(io.StringIO(tsv_text), delimiter='\t', quoting=csv.QUOTE_NONE):
+        text = (row.get('text') or '').strip()
+        if row.get('level') != '5' or not text:
+            continue
+        if float(row.get('conf') or -1) < OCR_MIN_WORD_CONFIDENCE:
+            continue
+        left, top = int(row['left']), int(row['top'])
+        words = lines[(int(row['page_num']), int(row['block_num']), int(row['par_num']), int(row['line_num']))]
+        words.append((left, top, left + int(row['width']), top + int(row['height']), text))
+
+    ocr_lines = []
+    for key in sorted(lines):
+        words = lines[key]
+        x0 = min(word[0] for word in words) * scale
+        y0 = min(word[1] for word in words) * scale
+        x1 = max(word[2] for word in words) * scale
+        y1 = max(word[3] for word in words) * scale
+        ocr_lines.append({
+            'text': ' '.join(word[4] for word in words),
+            'bbox': [round(x0, 2), round(y0, 2), round(x1, 2), round(y1, 2)],
+            'size': round(y1 - y0, 1),
+        })
+    return ocr_lines
+
+def run_tesseract(png: bytes, dpi: int) -> str:
+    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as image_file:
+        image_file.write(png)
+        image_path = image_file.name
+    try:
+        completed = subprocess.run(
+            [TESSERACT_CMD, image_path, 'stdout', '-l', OCR_LANGUAGE, '--dpi', str(dpi), 'tsv'],
+            capture_output=True, text=True, check=True,
+        )
+        return completed.stdout
+    finally:
+        os.remove(image_path)
+
+def ocr_page(input_pdf_path: str, page_num: int, dpi: int, cache_dir: str = None) -> Tuple[int, List[Dict], bool]:
+    """Worker: render, look up the cache, OCR on a miss. Returns (page_num, lines, from_cache)."""
+    with pymupdf.open(input_pdf_path) as doc:
+        png = render_page_png(doc, page_num, dpi)
+
+    cache_path = os.path.join(cache_dir, f"{page_image_key(png, dpi)}.json") if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return page_num, json.load(f), True
+
+    lines = parse_tesseract_tsv(run_tesseract(png, dpi), dpi)
+    if cache_path:
+        # Write then rename so a concurrent reader never sees a partial file
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(lines, f)
+        os.replace(tmp_path, cache_path)
+    return page_num, lines, False
+
+def ocr_pages(input_pdf_path: str, page_numbers: List[int], dpi: int = OCR_DPI, cache_dir: str = None,
+              workers: int = None) -> Dict[int, List[Dict]]:
+    """
+    OCR the given pages (1-based) in a process pool bounded by the core count.
+    Results are cached by page-image hash in cache_dir, so re-runs and repeated
+    pages (e.g. identical scanned forms) skip tesseract.
+    Returns {page_num: [{'text', 'bbox', 'size'}]} for every requested page.
+    """
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(page_numbers)))
+
+    results = {}
+    cached = 0
+    if workers == 1:
+        page_results = (ocr_page(input_pdf_path, page_num, dpi, cache_dir) for page_num in page_numbers)
+        for page_num, lines, from_cache in page_results:
+            results[page_num] = lines
+            cached += from_cache
+    else:
+        # spawn: the caller may have other threads running, which is not fork-safe
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            for page_num, lines, from_cache in executor.map(ocr_page, repeat(input_pdf_path), page_numbers,
+                                                            repeat(dpi), repeat(cache_dir)):
+                results[page_num] = lines
+                cached += from_cache
+
+    line_count = sum(len(lines) for lines in results.values())
+    print(f"[OCR] {os.path.basename(input_pdf_path)}: {line_count} lines from {len(page_numbers)} pages "
+          f"at {dpi} dpi ({cached} from cache, {workers} workers)")
+    return results
+
+def ocr_page_chunk(page_num: int, lines: List[Dict]) -> Dict:
+    """OCR lines as a markdown-stage page chunk"""
+    return {'text': '\n'.join(line['text'] for line in lines), 'metadata': {'page': page_num}}
+
+def ocr_span_lines(page_num: int, lines: List[Dict], font_table: List[Dict], font_ids: Dict) -> List[Dict]:
+    """OCR lines in the span-file line structure, with the estimated size as the font size"""
+    span_lines = []
+    for line in lines:
+        font_id = intern_font(font_table, font_ids, {'font': OCR_FONT_NAME, 'size': line['size'], 'flags': 0})
+        span_lines.append({
+            "page_num": page_num,
+            "column": 0,
+            "bbox": list(line['bbox']),
+            "text": line['text'],
+            "fonts": [font_id],
+            "is_in_table": False
+        })
+    return span_lines
+
+# This block allows you to test this script by itself
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python ocr_stage.py <path_to_input.pdf> [dpi]")
+        sys.exit(1)
+    if not tesseract_available():
+        print(f"{TESSERACT_CMD} is not installed")
+        sys.exit(1)
+
+    with pymupdf.open(sys.argv[1]) as pdf_doc:
+        empty_pages = [page.number + 1 for page in pdf_doc if not page.get_text("text").strip()]
+    page_results = ocr_pages(sys.argv[1], empty_pages, int(sys.argv[2]) if len(sys.argv) > 2 else OCR_DPI)
+    for result_page, result_lines in page_results.items():
+        for result_line in result_lines:
+            print(f"  p{result_page} {result_line['size']:>5}pt {result_line['text']}")
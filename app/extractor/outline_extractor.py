@@ -0,0 +1,171 @@
+import csv
+import os
+import sys
+import time
+import pymupdf
+from typing import List, Dict, Optional, Tuple
+from toc_parser import parse_contents_outline, write_toc_seed_csv
+
+# Metadata titles that are produced by authoring tools rather than written by a person
+PLACEHOLDER_TITLE_MARKERS = ('untitled', 'microsoft word - ', '.doc', '.pdf', '.tex', '.indd')
+
+def clean_metadata_title(title: str) -> str:
+    """Return the metadata title if it looks like a real document title, else ''"""
+    title = ' '.join((title or '').split())
+    if len(title) < 3:
+        return ""
+    if any(marker in title.lower() for marker in PLACEHOLDER_TITLE_MARKERS):
+        return ""
+    return title
+
+def validate_outline(toc: List[list], page_count: int, min_entries: int = 3,
+                     min_coverage: float = 0.5) -> Tuple[bool, str]:
+    """
+    Sanity-check an embedded bookmark tree before trusting it as the outline.
+    Returns (is_trusted, reason).
+    """
+    if len(toc) < min_entries:
+        return False, f"only {len(toc)} bookmarks (need {min_entries})"
+
+    if toc[0][0] != 1:
+        return False, f"outline starts at level {toc[0][0]}"
+
+    previous_level = 0
+    previous_page = 1
+    for level, title, page in toc:
+        if not str(title).strip():
+            return False, "empty bookmark title"
+        if level < 1 or level > previous_level + 1:
+            return False, f"level jump from {previous_level} to {level} at '{title}'"
+        if page < 1 or page > page_count:
+            return False, f"bookmark '{title}' points to page {page} outside 1..{page_count}"
+        if page < previous_page:
+            return False, f"bookmark '{title}' goes back from page {previous_page} to {page}"
+        previous_level = level
+        previous_page = page
+
+    if page_count > 2:
+        covered_pages = toc[-1][2] - toc[0][2] + 1
+        coverage = covered_pages / page_count
+        if coverage < min_coverage:
+            return False, f"bookmarks cover only {coverage:.0%} of {page_count} pages"
+
+    return True, "trusted"
+
+def get_trusted_outline(input_pdf_path: str, max_level: int = 3) -> Tuple[Optional[List[Dict]], str]:
+    """
+    Build Title/H1-H3 rows straight from the PDF's own bookmarks and metadata.
+    Returns (rows, reason); rows is None when the embedded outline can't be trusted.
+    """
+    try:
+        doc = pymupdf.open(input_pdf_path)
+    except Exception as e:
+        return None, f"could not open: {e}"
+
+    try:
+        toc = doc.get_toc(simple=True)
+        page_count = doc.page_count
+        metadata_title = clean_metadata_title((doc.metadata or {}).get('title', ''))
+    finally:
+        doc.close()
+
+    is_trusted, reason = validate_outline(toc, page_count)
+    if not is_trusted:
+        return None, reason
+
+    entries = [(level, ' '.join(str(title).split()), page) for level, title, page in toc]
+
+    rows = []
+    if metadata_title:
+        rows.append({'text': metadata_title, 'hierarchy_level': 'Title', 'page_number': 1})
+    else:
+        # No usable metadata title: the first top-level bookmark plays the Title role
+        level, title, page = entries.pop(0)
+        rows.append({'text': title, 'hierarchy_level': 'Title', 'page_number': page})
+
+    for level, title, page in entries:
+        if level > max_level:
+            continue
+        if rows and level == 1 and title == rows[0]['text']:
+            continue  # bookmark repeating the document title
+        rows.append({'text': title, 'hierarchy_level': f"H{level}", 'page_number': page})
+
+    return rows, reason
+
+def get_contents_outline(input_pdf_path: str, max_level: int = 3) -> Tuple[Optional[List[Dict]], Optional[Dict], str]:
+    """
+    Build Title/H1-H3 rows from a printed contents page.
+    Returns (rows, outline, reason); rows is None when the contents page is missing or
+    incomplete, outline is the parsed contents (usable as a level seed) or None.
+    """
+    outline, reason = parse_contents_outline(input_pdf_path)
+    if not outline or not outline['complete']:
+        return None, outline, reason
+
+    title = clean_metadata_title(outline['metadata_title']) or outline['cover_title']
+    rows = [{'text': title, 'hierarchy_level': 'Title', 'page_number': 1}] if title else []
+    for entry in outline['entries']:
+        if entry['level'] <= max_level:
+            rows.append({'text': entry['text'], 'hierarchy_level': f"H{entry['level']}", 'page_number': entry['page']})
+    return rows, outline, reason
+
+def write_outline_csv(rows: List[Dict], output_csv_path: str, processing_path: str = 'embedded_outline'):
+    """Write outline rows in the same shape as the hierarchy stage output"""
+    os.makedirs(os.path.dirname(output_csv_path), exist_ok=True)
+    with open(output_csv_path, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=['text', 'hierarchy_level', 'page_number', 'processing_path'])
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({**row, 'processing_path': processing_path})
+
+def process_outline_fast_path(input_dir: str, output_dir: str, seed_dir: str = None) -> Dict[str, str]:
+    """
+    Try the embedded-outline fast path, then the printed contents page, on every PDF in input_dir.
+    Returns a map pdf_name -> path taken ('embedded_outline', 'printed_toc' or 'ml_pipeline').
+    A contents page that misses some headings can't replace the ML pipeline; when seed_dir
+    is given its entries are written there as toc_seed_{pdf_name}.csv to seed hierarchy levels.
+    """
+    paths_taken = {}
+    pdf_files = [f for f in os.listdir(input_dir) if f.lower().endswith('.pdf')]
+
+    for pdf_name in pdf_files:
+        start_time = time.time()
+        pdf_path = os.path.join(input_dir, pdf_name)
+        output_csv_path = os.path.join(output_dir, f"hierarchy_outline_ground_truth_{pdf_name}.csv")
+        rows, reason = get_trusted_outline(pdf_path)
+
+        if rows:
+            write_outline_csv(rows, output_csv_path)
+            paths_taken[pdf_name] = 'embedded_outline'
+            elapsed_ms = (time.time() - start_time) * 1000
+            print(f"[OUTLINE] ✓ {pdf_name}: {len(rows)} entries from embedded bookmarks in {elapsed_ms:.1f}ms")
+            continue
+
+        toc_rows, toc_outline, toc_reason = get_contents_outline(pdf_path)
+        elapsed_ms = (time.time() - start_time) * 1000
+        if toc_rows:
+            write_outline_csv(toc_rows, output_csv_path, processing_path='printed_toc')
+            paths_taken[pdf_name] = 'printed_toc'
+            print(f"[OUTLINE] ✓ {pdf_name}: {len(toc_rows)} entries from the printed contents page in {elapsed_ms:.1f}ms")
+            continue
+
+        paths_taken[pdf_name] = 'ml_pipeline'
+        if toc_outline and seed_dir:
+            write_toc_seed_csv(toc_outline, os.path.join(seed_dir, f"toc_seed_{pdf_name}.csv"))
+        print(f"[OUTLINE] - {pdf_name}: {reason}; contents page: {toc_reason}, using ML pipeline ({elapsed_ms:.1f}ms)")
+
+    return paths_taken
+
+# This block allows you to test this script by itself
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python outline_extractor.py <path_to_input.pdf>")
+        sys.exit(1)
+
+    outline_rows, outline_reason = get_trusted_outline(sys.argv[1])
+    print(f"Outline: {outline_reason}")
+    if not outline_rows:
+        outline_rows, _, contents_reason = get_contents_outline(sys.argv[1])
+        print(f"Contents page: {contents_reason}")
+    for outline_row in outline_rows or []:
+        print(f"  {outline_row['hierarchy_level']:<6} p{outline_row['page_number']}: {outline_row['text']}")
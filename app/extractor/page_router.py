@@ -0,0 +1,123 @@
+import sys
+import os
+import pymupdf
+from collections import Counter
+from typing import List, Dict
+from page_stream import PAGE_WINDOW, release_page_cache
+
+# A line is a heading candidate when its font is this much larger than the body font
+FONT_OUTLIER_RATIO = 1.15
+# Drawn lines/rectangles on a page from which it is treated as a table candidate
+TABLE_MIN_DRAWINGS = 6
+# Lines shorter than this are not considered when looking for font outliers
+MIN_OUTLIER_CHARS = 3
+
+def page_profile(page) -> Dict:
+    """
+    Cheap structural profile of one page from a single text-only dict extraction:
+    character-weighted font sizes, the largest line font, side-by-side blocks and drawings.
+    """
+    blocks = page.get_text("dict", flags=pymupdf.TEXTFLAGS_TEXT)["blocks"]
+    size_chars = Counter()
+    line_sizes = []
+    block_ranges = []
+    for block in blocks:
+        block_ranges.append(tuple(block["bbox"]))
+        for line in block.get("lines", []):
+            text = "".join(span["text"] for span in line["spans"]).strip()
+            if not text:
+                continue
+            line_size = 0
+            for span in line["spans"]:
+                size = round(span["size"], 1)
+                size_chars[size] += len(span["text"].strip())
+                line_size = max(line_size, size)
+            if len(text) >= MIN_OUTLIER_CHARS:
+                line_sizes.append(line_size)
+
+    # Two blocks side by side (overlapping vertically, disjoint horizontally) mean several columns
+    multi_column = any(
+        a[2] <= b[0] and a[1] < b[3] and b[1] < a[3]
+        for i, a in enumerate(block_ranges) for b in block_ranges[i + 1:]
+    ) or any(
+        b[2] <= a[0] and a[1] < b[3] and b[1] < a[3]
+        for i, a in enumerate(block_ranges) for b in block_ranges[i + 1:]
+    )
+    return {
+        'size_chars': size_chars,
+        'max_line_size': max(line_sizes) if line_sizes else 0,
+        'multi_column': multi_column,
+        'drawings': len(page.get_cdrawings()),
+    }
+
+def route_pages(input_pdf_path: str, text_pages: List[int] = None) -> Dict:
+    """
+    Decide per page whether pymupdf4llm is needed.
+
+    Pages go to the markdown converter when the cheap plain-text path could change
+    the outcome:
+      - 'font_outlier':  a line set larger than the body font (heading candidate)
+      - 'table':         enough drawn lines/rectangles to be a table candidate
+      - 'multi_column':  side-by-side blocks, where reading order is uncertain
+    All other pages use plain text lines.
+
+    Returns {'markdown_pages', 'text_pages', 'reasons': {page: [reasons]}, 'body_size'}.
+    """
+    doc = pymupdf.open(input_pdf_path)
+    try:
+        page_numbers = text_pages if text_pages is not None else list(range(1, doc.page_count + 1))
+        profiles = {}
+        for count, page_num in enumerate(page_numbers, 1):
+            profiles[page_num] = page_profile(doc[page_num - 1])
+            if count % PAGE_WINDOW == 0:
+                release_page_cache()
+    finally:
+        doc.close()
+
+    # Body font: the size carrying the most characters in the document
+    document_sizes = Counter()
+    for profile in profiles.values():
+        document_sizes.update(profile['size_chars'])
+    body_size = document_sizes.most_common(1)[0][0] if document_sizes else 0
+
+    markdown_pages = []
+    plain_pages = []
+    reasons = {}
+    for page_num in page_numbers:
+        profile = profiles[page_num]
+        page_reasons = []
+        if body_size and profile['max_line_size'] >= body_size * FONT_OUTLIER_RATIO:
+            page_reasons.append('font_outlier')
+        if profile['drawings'] >= TABLE_MIN_DRAWINGS:
+            page_reasons.append('table')
+        if profile['multi_column']:
+            page_reasons.append('multi_column')
+        if page_reasons:
+            markdown_pages.append(page_num)
+            reasons[page_num] = page_reasons
+        else:
+            plain_pages.append(page_num)
+
+    return {
+        'markdown_pages': markdown_pages,
+        'text_pages': plain_pages,
+        'reasons': reasons,
+        'body_size': body_size,
+    }
+
+def summarize_routes(routes: Dict) -> str:
+    reason_counts = Counter(reason for page_reasons in routes['reasons'].values() for reason in page_reasons)
+    total = len(routes['markdown_pages']) + len(routes['text_pages'])
+    details = ', '.join(f"{reason}={count}" for reason, count in sorted(reason_counts.items()))
+    return f"{len(routes['markdown_pages'])}/{total} pages need markdown" + (f" ({details})" if details else "")
+
+# This block allows you to test this script by itself
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python page_router.py <path_to_input.pdf>")
+        sys.exit(1)
+
+    page_routes = route_pages(sys.argv[1])
+    print(f"{os.path.basename(sys.argv[1])}: {summarize_routes(page_routes)}, body size {page_routes['body_size']}")
+    for routed_page, routed_reasons in page_routes['reasons'].items():
+        print(f"  Page {routed_page}: {', '.join(routed_reasons)}")
@@ -0,0 +1,46 @@
+import json
+import os
+from typing import Dict, Iterator, List
+import pymupdf
+
+# Number of pages converted/extracted between MuPDF store releases
+PAGE_WINDOW = 8
+
+def release_page_cache():
+    """
+    Empty MuPDF's resource store (fonts, images, display lists of released pages).
+    PyMuPDF has no setter for the store size limit, so pages are processed in
+    windows and the store is emptied after each one to keep RSS bounded.
+    """
+    pymupdf.TOOLS.store_shrink(100)
+
+def page_windows(page_numbers: List[int], window_size: int = PAGE_WINDOW) -> Iterator[List[int]]:
+    """Split a page list into consecutive windows"""
+    for start in range(0, len(page_numbers), window_size):
+        yield page_numbers[start:start + window_size]
+
+def write_record(file_handle, record: Dict, default=None):
+    """Append one JSON Lines record"""
+    file_handle.write(json.dumps(record, ensure_ascii=False, default=default))
+    file_handle.write('\n')
+
+def iter_records(jsonl_path: str) -> Iterator[Dict]:
+    """Read a JSON Lines file one record at a time"""
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def count_records(jsonl_path: str) -> int:
+    """Number of records in a JSON Lines file, without parsing them"""
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        return sum(1 for line in f if line.strip())
+
+def spill_path_for(output_path: str) -> str:
+    """Temporary file holding the first-pass page records next to the final output"""
+    return output_path + '.pass1'
+
+def remove_spill(output_path: str):
+    spill_path = spill_path_for(output_path)
+    if os.path.exists(spill_path):
+        os.remove(spill_path)
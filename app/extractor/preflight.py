@@ -0,0 +1,157 @@
+import os
+import sys
+import pymupdf
+from typing import Dict, Optional
+
+# Same threshold pdf_to_markdown uses to decide that pymupdf4llm produced too little text
+MIN_MARKDOWN_CHARS = 100
+
+# Rough size of one page of body text, used to turn character counts into page-equivalents
+CHARS_PER_PAGE = 3000
+
+# Header/footer detection needs at least this many pages, so previews are never shorter
+MIN_PREVIEW_PAGES = 3
+
+# Structured rejection codes
+REJECT_MISSING = 'missing_file'
+REJECT_EMPTY_FILE = 'empty_file'
+REJECT_OPEN_FAILED = 'open_failed'
+REJECT_NOT_PDF = 'not_pdf'
+REJECT_ENCRYPTED = 'encrypted'
+REJECT_ZERO_PAGES = 'zero_pages'
+REJECT_UNREPAIRABLE = 'unrepairable'
+REJECT_NO_TEXT = 'no_text_layer'
+
+def rejection(code: str, message: str) -> Dict:
+    return {'code': code, 'message': message}
+
+def scan_text_layer(doc, min_page_chars: int = 1, max_pages: int = None) -> Dict:
+    """
+    Count the text of every page of an open document and pick the extraction route.
+    max_pages stops the scan (and so every later step) once that many pages with text
+    have been found, so a preview covers the first max_pages pages that have text.
+    """
+    text_pages = []
+    empty_pages = []
+    total_chars = 0
+    scanned_pages = 0
+
+    for page_num in range(1, doc.page_count + 1):
+        if max_pages and len(text_pages) >= max_pages:
+            break
+        char_count = len(''.join(doc[page_num - 1].get_text("text").split()))
+        scanned_pages = page_num
+        total_chars += char_count
+        if char_count >= min_page_chars:
+            text_pages.append(page_num)
+        else:
+            empty_pages.append(page_num)
+
+    if total_chars == 0:
+        route = 'no_text'
+    elif total_chars < MIN_MARKDOWN_CHARS:
+        route = 'fallback'
+    else:
+        route = 'markdown'
+
+    return {
+        'page_count': doc.page_count,
+        'scanned_pages': scanned_pages,
+        'truncated': scanned_pages < doc.page_count,
+        'text_pages': text_pages,
+        'empty_pages': empty_pages,
+        'total_chars': total_chars,
+        'route': route,
+    }
+
+def check_document(doc) -> Optional[Dict]:
+    """Structural checks on an open document; returns a rejection or None"""
+    if not doc.is_pdf:
+        return rejection(REJECT_NOT_PDF, "file is not a PDF")
+    # Documents encrypted with an empty user password open normally
+    if doc.needs_pass and not doc.authenticate(''):
+        return rejection(REJECT_ENCRYPTED, "document is password protected")
+    if doc.page_count == 0:
+        return rejection(REJECT_ZERO_PAGES, "document has no pages")
+    # Truncated/damaged files are repaired by MuPDF on open; make sure the page tree survived
+    try:
+        for page_index in {0, doc.page_count - 1}:
+            doc.load_page(page_index).get_text("text")
+    except Exception as e:
+        return rejection(REJECT_UNREPAIRABLE, f"page tree could not be read: {e}")
+    return None
+
+def estimate_cost(text_report: Dict) -> float:
+    """Expected extraction work in page-equivalents: pages to convert plus text volume"""
+    return round(len(text_report['text_pages']) + text_report['total_chars'] / CHARS_PER_PAGE, 2)
+
+def preflight_pdf(input_pdf_path: str, min_page_chars: int = 1, max_pages: int = None,
+                  accept_no_text: bool = False) -> Dict:
+    """
+    Validate a PDF and inspect its text layer before any heavy work is scheduled.
+
+    Opens the file once and checks, in order: the file exists and is not empty,
+    it opens, it is a PDF, it is not password protected, it has pages, and its
+    page tree is readable after MuPDF's repair. Accepted documents also get the
+    text-layer report and an estimated cost. With max_pages only the first pages
+    with text are scanned, so a preview costs the same whatever the document length.
+    accept_no_text keeps image-only documents (route 'no_text') for the OCR stage.
+
+    Returns {'accepted', 'reason', 'repaired', 'file_size', 'estimated_cost'}
+    plus the scan_text_layer fields when the text layer could be scanned.
+    'reason' is None or {'code', 'message'} with one of the REJECT_* codes.
+    """
+    report = {'accepted': False, 'reason': None, 'repaired': False, 'file_size': 0, 'estimated_cost': 0.0}
+
+    if not os.path.isfile(input_pdf_path):
+        report['reason'] = rejection(REJECT_MISSING, "file does not exist")
+        return report
+    report['file_size'] = os.path.getsize(input_pdf_path)
+    if report['file_size'] == 0:
+        report['reason'] = rejection(REJECT_EMPTY_FILE, "file is empty")
+        return report
+
+    try:
+        doc = pymupdf.open(input_pdf_path)
+    except Exception as e:
+        report['reason'] = rejection(REJECT_OPEN_FAILED, str(e))
+        return report
+
+    try:
+        report['repaired'] = bool(doc.is_repaired)
+        report['reason'] = check_document(doc)
+        if report['reason']:
+            return report
+        report.update(scan_text_layer(doc, min_page_chars, max_pages))
+    finally:
+        doc.close()
+
+    report['estimated_cost'] = estimate_cost(report)
+    if report['route'] == 'no_text' and not accept_no_text:
+        report['reason'] = rejection(REJECT_NO_TEXT, "no text layer (image-only)")
+        return report
+
+    report['accepted'] = True
+    return report
+
+def describe_rejection(report: Dict) -> str:
+    reason = report.get('reason') or {}
+    return f"{reason.get('code', 'unknown')}: {reason.get('message', '')}"
+
+# This block allows you to test this script by itself
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python preflight.py <path_to_input.pdf>")
+        sys.exit(1)
+
+    report = preflight_pdf(sys.argv[1])
+    if not report['accepted']:
+        print(f"{os.path.basename(sys.argv[1])}: rejected ({describe_rejection(report)})")
+        sys.exit(1)
+    print(f"{os.path.basename(sys.argv[1])}: route={report['route']}, "
+          f"{len(report['text_pages'])}/{report['page_count']} pages with text, {report['total_chars']} chars, "
+          f"estimated cost {report['estimated_cost']} page-equivalents")
+    if report['repaired']:
+        print("  Document was damaged and repaired on open")
+    if report['empty_pages']:
+        print(f"  Pages without text: {report['empty_pages']}")
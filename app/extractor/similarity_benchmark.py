@@ -0,0 +1,101 @@
+import os
+import sys
+import glob
+import time
+from difflib import SequenceMatcher
+from typing import List, Dict, Tuple
+from page_stream import iter_records
+from aggregator import (iter_span_pages, sort_page_spans, build_span_candidate_index, cascade_ratio,
+                        find_best_matching_span_by_page)
+from text_normalize import is_table_content, clean_md_line, clean_text
+
+def load_workload(md_json_file: str, spans_json_file: str) -> List[Tuple[List[Dict], List[Dict]]]:
+    """(markdown lines, spans) per page of one document, as the aggregator sees them"""
+    span_pages = {record['page_num']: record['spans']
+                  for kind, record in iter_span_pages(spans_json_file) if kind == 'page'}
+    md_records = iter_records(md_json_file)
+    next(md_records, None)  # metadata header
+    return [(md_page['lines'], span_pages.get(md_page['page_number'], [])) for md_page in md_records]
+
+def find_workloads(data_dir: str) -> List[Tuple[str, str]]:
+    """(md file, spans file) pairs of an intermediate data folder (md_files/ and spans_output/)"""
+    pairs = []
+    for md_json_file in sorted(glob.glob(os.path.join(data_dir, 'md_files', '*.jsonl'))):
+        base_name = os.path.basename(md_json_file)[:-len('.jsonl')]
+        spans_json_file = os.path.join(data_dir, 'spans_output', f"spans_{base_name}.pdf.jsonl")
+        if os.path.exists(spans_json_file):
+            pairs.append((md_json_file, spans_json_file))
+    return pairs
+
+def benchmark_pages(pages: List[Tuple[List[Dict], List[Dict]]]) -> Dict:
+    """
+    Time the pair scoring of one document three ways:
+      'full':    clean both texts and run ratio() for every line/span pair (no cascade)
+      'cascade': cascade_ratio for every pair, keeping only ratios that beat the line's best so far
+      'matcher': find_best_matching_span_by_page with the candidate index, as the aggregator runs it
+    """
+    results = {'pairs': 0, 'tiers': {}}
+
+    start = time.time()
+    for lines, spans in pages:
+        for line in lines:
+            cleaned_line = clean_text(clean_md_line(line.get('text', '')))
+            for span in spans:
+                SequenceMatcher(None, cleaned_line, clean_text(span['text'])).ratio()
+                results['pairs'] += 1
+    results['full'] = time.time() - start
+
+    start = time.time()
+    for lines, spans in pages:
+        matchers = [SequenceMatcher(None, '', clean_text(span['text'])) for span in spans]
+        for line in lines:
+            cleaned_line = clean_text(clean_md_line(line.get('text', '')))
+            best = 0.0
+            for matcher in matchers:
+                ratio = cascade_ratio(matcher, cleaned_line, lambda bound: bound > best, results['tiers'])
+                if ratio is not None and ratio > best:
+                    best = ratio
+    results['cascade'] = time.time() - start
+
+    start = time.time()
+    matched = 0
+    for lines, spans in pages:
+        spans, page_index = sort_page_spans(spans)
+        candidate_index = build_span_candidate_index(spans, page_index)
+        used_spans = set()
+        for line in lines:
+            if find_best_matching_span_by_page(line, spans, page_index, used_spans, candidate_index=candidate_index):
+                matched += 1
+    results['matcher'] = time.time() - start
+    results['matched'] = matched
+    results['lines'] = sum(len(lines) for lines, _ in pages)
+    results['table_lines'] = sum(1 for lines, _ in pages for line in lines if is_table_content(line.get('text', '')))
+    return results
+
+def print_results(name: str, results: Dict):
+    tiers = results['tiers']
+    total = sum(tiers.values()) or 1
+    tier_summary = ', '.join(f"{tier}={tiers.get(tier, 0)} ({tiers.get(tier, 0) / total:.0%})"
+                             for tier in ('identical', 'length', 'chars', 'ratio'))
+    print(f"{name}: {results['lines']} lines ({results['table_lines']} table), {results['pairs']} line/span pairs")
+    print(f"  full ratio for every pair: {results['full']:.3f}s")
+    print(f"  cascade for every pair:    {results['cascade']:.3f}s  (ended at {tier_summary})")
+    print(f"  indexed matcher:           {results['matcher']:.3f}s  ({results['matched']} lines matched)")
+
+# This block allows you to run the benchmark by itself
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python similarity_benchmark.py <data_dir with md_files/ and spans_output/>")
+        print("       python similarity_benchmark.py <path_to_md.jsonl> <path_to_spans.jsonl>")
+        sys.exit(1)
+
+    workloads = [(sys.argv[1], sys.argv[2])] if len(sys.argv) > 2 else find_workloads(sys.argv[1])
+    totals = {'full': 0.0, 'cascade': 0.0, 'matcher': 0.0}
+    for md_path, spans_path in workloads:
+        document_results = benchmark_pages(load_workload(md_path, spans_path))
+        print_results(os.path.basename(md_path), document_results)
+        for key in totals:
+            totals[key] += document_results[key]
+    if len(workloads) > 1:
+        print(f"\nTotal over {len(workloads)} documents: full {totals['full']:.3f}s, "
+              f"cascade {totals['cascade']:.3f}s, indexed matcher {totals['matcher']:.3f}s")
@@ -1,102 +1,224 @@
 import pymupdf
-import json
 import os # <-- Added for os.path.basename
+from collections import Counter
 from multi_column import column_boxes
+from header_footer import margin_candidates, find_repeated_margin_groups, flag_margin_lines
+from font_index import intern_font
+from bbox_geometry import as_boxes, boxes_in_regions, center_boxes, first_container, has_side_by_side
+from ocr_stage import ocr_span_lines
+from page_stream import PAGE_WINDOW, release_page_cache, write_record, iter_records, spill_path_for, remove_spill
+
+def simple_layout_blocks(page):
+    """
+    Cheap layout check: a page without drawings or images whose horizontal text
+    blocks never sit side by side is a plain single-column page. Without vector
+    graphics find_tables has no ruling lines to build tables from, and column_boxes
+    reduces to joining these text blocks.
+    Returns the page's text blocks (as column_boxes would read them) or None.
+    """
+    if page.get_cdrawings() or page.get_images():
+        return None
+    blocks = page.get_text("dict", flags=pymupdf.TEXTFLAGS_TEXT, clip=+page.rect)["blocks"]
+    if any(block["lines"][0]["dir"] != (1, 0) for block in blocks):
+        return None
+    if has_side_by_side(as_boxes([block["bbox"] for block in blocks])):
+        return None
+    return blocks
+
+def collect_dict_lines(text_dict, page_num, col_idx, font_table, font_ids, page_lines):
+    """Append the non-empty lines of a get_text("dict") result as span-file lines"""
+    for block in text_dict["blocks"]:
+        if "lines" in block:
+            for line in block["lines"]:
+                line_text = ""
+                line_fonts = []
+                line_bbox = None
+                
+                for span in line["spans"]:
+                    line_text += span["text"]
+                    line_fonts.append(intern_font(font_table, font_ids, span))
+                    
+                    if line_bbox is None:
+                        line_bbox = span["bbox"]
+                
+                if line_text.strip() and line_bbox:
+                    page_lines.append({
+                        "page_num": page_num,
+                        "column": col_idx,
+                        "bbox": list(line_bbox),
+                        "text": line_text.strip(),
+                        "fonts": line_fonts,
+                        "is_in_table": False
+                    })
+
+def extract_simple_page_lines(page, page_num, blocks, font_table, font_ids):
+    """
+    Single-column fast path: same column boxes and lines as extract_page_lines,
+    from one clipped text extraction instead of one per column box, and no table search.
+    Returns None when a line can't be placed in a column box (use the full path).
+    """
+    page_lines = []
+    bboxes = column_boxes(page, footer_margin=0, header_margin=0, no_image_text=False, paths=[], blocks=blocks)
+    print(f"Page {page_num}: Found 0 tables")
+    if not bboxes:
+        return page_lines
+
+    clip = pymupdf.Rect(bboxes[0])
+    for rect in bboxes[1:]:
+        clip |= rect
+    collect_dict_lines(page.get_text("dict", clip=clip), page_num, 0, font_table, font_ids, page_lines)
+
+    # Each line belongs to the first column box holding it, in column order
+    line_boxes = as_boxes([line["bbox"] for line in page_lines])
+    column_index = first_container(line_boxes, as_boxes(bboxes)) - 1
+    if (column_index < 0).any():
+        return None
+    for line, col_idx in zip(page_lines, column_index.tolist()):
+        line["column"] = col_idx
+    return sorted(page_lines, key=lambda line: line["column"])
+
+def extract_page_lines(page, page_num, font_table, font_ids):
+    """
+    Extract the text lines of one page, column by column, with table membership.
+    Lines inside a table cell also get "table_cell": [table, row, column] from the
+    find_tables cell grid, which the aggregator uses to match table rows.
+    """
+    page_lines = []
+    bboxes = column_boxes(page, footer_margin=0, header_margin=0, no_image_text=False)
+    
+    # Detect tables on this page
+    tables = page.find_tables()
+    table_bboxes = []
+    cell_bboxes = []
+    cell_keys = []
+    
+    # Extract table bounding boxes and cell grids
+    for table_num, table in enumerate(tables):
+        table_bbox = table.bbox  # (x0, y0, x1, y1)
+        table_bboxes.append(table_bbox)
+        for row_num, row in enumerate(table.rows):
+            for col_num, cell in enumerate(row.cells):
+                if cell is not None:
+                    cell_bboxes.append(cell)
+                    cell_keys.append([table_num, row_num, col_num])
+    
+    print(f"Page {page_num}: Found {len(table_bboxes)} tables")
+
+    for col_idx, rect in enumerate(bboxes):
+        text_dict = page.get_text("dict", clip=rect)
+        collect_dict_lines(text_dict, page_num, col_idx, font_table, font_ids, page_lines)
+    
+    # Table membership for all lines of the page in one array operation
+    line_boxes = as_boxes([line["bbox"] for line in page_lines])
+    in_tables = boxes_in_regions(line_boxes, as_boxes(table_bboxes))
+    for line, is_in_table in zip(page_lines, in_tables.tolist()):
+        line["is_in_table"] = is_in_table
+    
+    # Cell of each table line: the first cell containing the line's center
+    if cell_keys:
+        containers = first_container(center_boxes(line_boxes), as_boxes(cell_bboxes))
+        for line, is_in_table, container in zip(page_lines, in_tables.tolist(), containers.tolist()):
+            if is_in_table and container:
+                line["table_cell"] = cell_keys[container - 1]
+    return page_lines
+
+def iter_pages_lines(doc, page_numbers, font_table, font_ids, layout_counts=None, ocr_results=None):
+    """
+    Yield (page_num, page_height, lines) one page at a time.
+    Simple single-column pages take the fast path and pages in ocr_results use their
+    OCR lines; layout_counts, when given, counts pages per path ('single_column' / 'full' / 'ocr').
+    Each page object is dropped as soon as its lines are extracted and the MuPDF
+    store is emptied after every window of pages.
+    """
+    for count, page_num in enumerate(page_numbers, 1):
+        page = doc[page_num - 1]
+        page_height = page.rect.height
+        page_lines = None
+        if ocr_results and page_num in ocr_results:
+            page_lines = ocr_span_lines(page_num, ocr_results[page_num], font_table, font_ids)
+            layout = 'ocr'
+        else:
+            blocks = simple_layout_blocks(page)
+            if blocks is not None:
+                page_lines = extract_simple_page_lines(page, page_num, blocks, font_table, font_ids)
+            layout = 'single_column' if page_lines is not None else 'full'
+        if page_lines is None:
+            page_lines = extract_page_lines(page, page_num, font_table, font_ids)
+        if layout_counts is not None:
+            layout_counts[layout] += 1
+        del page
+        if count % PAGE_WINDOW == 0:
+            release_page_cache()
+        yield page_num, page_height, page_lines
 
 # CHANGED: The function now accepts full paths as arguments
-def extract_columns_and_split(input_pdf_path, output_json_path):
+def extract_columns_and_split(input_pdf_path, output_json_path, text_pages=None, ocr_results=None):
     """
-    Extract columns and split lines from a PDF, saving a JSON file.
+    Extract columns and split lines from a PDF, saving a JSON Lines file.
     Accepts full input and output paths.
+    text_pages (1-based) limits extraction to pages the preflight found text on;
+    ocr_results ({page_num: OCR lines}) adds the pages without a text layer.
+
+    Memory is bounded by one page of lines: pass 1 spills each page to disk and
+    keeps only the margin candidates that header/footer detection needs; pass 2
+    drops running headers/footers and writes one record per page:
+      {"fonts": [...]}                                  font table (first record)
+      {"page_num", "page_height", "spans"}              one record per page with text
     """
     # CHANGED: Use the provided input_pdf_path argument
     doc = pymupdf.open(input_pdf_path)
-    all_output = []
+    # Per-document font table; lines reference fonts by id
+    font_table = []
+    font_ids = {}
     
     # This is used for your print statements
     pdf_name = os.path.basename(input_pdf_path)
 
-    for page_num, page in enumerate(doc, 1):
-        bboxes = column_boxes(page, footer_margin=0, header_margin=0, no_image_text=False)
-        
-        # Detect tables on this page
-        tables = page.find_tables()
-        table_bboxes = []
-        
-        # Extract table bounding boxes
-        for table in tables:
-            table_bbox = table.bbox  # (x0, y0, x1, y1)
-            table_bboxes.append(table_bbox)
-        
-        print(f"Page {page_num}: Found {len(table_bboxes)} tables")
-
-        for col_idx, rect in enumerate(bboxes):
-            text_dict = page.get_text("dict", clip=rect)
-            
-            for block in text_dict["blocks"]:
-                if "lines" in block:
-                    for line in block["lines"]:
-                        line_text = ""
-                        line_fonts = []
-                        line_bbox = None
-                        
-                        for span in line["spans"]:
-                            line_text += span["text"]
-                            line_fonts.append({
-                                "font_name": span.get("font", ""),
-                                "font_size": span.get("size", 0),
-                                "font_flags": span.get("flags", 0)
-                            })
-                            
-                            if line_bbox is None:
-                                line_bbox = span["bbox"]
-                        
-                        if line_text.strip() and line_bbox:
-                            is_in_table = is_bbox_in_tables(line_bbox, table_bboxes)
-                            
-                            all_output.append({
-                                "page_num": page_num,
-                                "column": col_idx,
-                                "bbox": list(line_bbox),
-                                "text": line_text.strip(),
-                                "fonts": line_fonts,
-                                "is_in_table": is_in_table
-                            })
+    # Pass 1: extract page by page, spilling lines to disk
+    page_candidates = {}
+    layout_counts = Counter()
+    spill_path = spill_path_for(output_json_path)
+    page_numbers = text_pages if text_pages is not None else range(1, doc.page_count + 1)
+    if ocr_results:
+        page_numbers = sorted(set(page_numbers) | set(ocr_results))
+    with open(spill_path, "w", encoding="utf-8") as spill:
+        for page_num, page_height, page_lines in iter_pages_lines(doc, page_numbers, font_table, font_ids,
+                                                                  layout_counts, ocr_results):
+            if not page_lines:
+                continue
+            page_candidates[page_num] = margin_candidates(page_lines, page_height)
+            write_record(spill, {"page_num": page_num, "page_height": page_height, "spans": page_lines})
     
     doc.close()
+    release_page_cache()
+    print(f"[LAYOUT] {pdf_name}: {layout_counts['single_column']}/{sum(layout_counts.values())} pages "
+          f"took the single-column fast path, {layout_counts['full']} the full column/table analysis"
+          + (f", {layout_counts['ocr']} came from OCR" if layout_counts['ocr'] else ""))
     
+    # Running headers/footers are decided once for the whole document, before matching
+    repeated_groups = find_repeated_margin_groups(page_candidates, len(page_candidates))
+    
+    # Pass 2: filter each page
+    removed_lines = 0
     # CHANGED: Use the provided output_json_path argument
     with open(output_json_path, "w", encoding="utf-8") as f:
-        json.dump(all_output, f, ensure_ascii=False, indent=2)
-    
-    return True # Indicate success
-
-def is_bbox_in_tables(line_bbox, table_bboxes, overlap_threshold=0.5):
-    # ... (this function is unchanged) ...
-    if not table_bboxes:
-        return False
+        write_record(f, {"fonts": font_table})
+        for record in iter_records(spill_path):
+            page_lines = record["spans"]
+            header_footer_mask = flag_margin_lines(page_lines, record["page_height"], repeated_groups)
+            if header_footer_mask.any():
+                removed_lines += int(header_footer_mask.sum())
+                page_lines = [line for line, is_margin in zip(page_lines, header_footer_mask) if not is_margin]
+            if not page_lines:
+                continue
+            record["spans"] = page_lines
+            write_record(f, record)
+    remove_spill(output_json_path)
     
-    line_x0, line_y0, line_x1, line_y1 = line_bbox
-    line_area = (line_x1 - line_x0) * (line_y1 - line_y0)
+    if removed_lines:
+        print(f"{pdf_name}: Removed {removed_lines} running header/footer lines")
     
-    if line_area <= 0:
-        return False
-    
-    for table_bbox in table_bboxes:
-        table_x0, table_y0, table_x1, table_y1 = table_bbox
-        intersect_x0 = max(line_x0, table_x0)
-        intersect_y0 = max(line_y0, table_y0)
-        intersect_x1 = min(line_x1, table_x1)
-        intersect_y1 = min(line_y1, table_y1)
-        
-        if intersect_x0 < intersect_x1 and intersect_y0 < intersect_y1:
-            intersect_area = (intersect_x1 - intersect_x0) * (intersect_y1 - intersect_y0)
-            overlap_ratio = intersect_area / line_area
-            
-            if overlap_ratio >= overlap_threshold:
-                return True
-    
-    return False
+    return True # Indicate success
 
 # This block allows you to test this script by itself
 if __name__ == "__main__":
@@ -0,0 +1,180 @@
+import re
+from typing import Dict, List
+
+# Patterns of the markdown/span text cleaning, compiled once for every stage
+WHITESPACE_PATTERN = re.compile(r'\s+')
+BR_TAG_PATTERN = re.compile(r'<br\s*/?>')
+BOLD_CELL_PATTERN = re.compile(r'\*\*(.*?)\*\*')
+MARKDOWN_FORMATTING_PATTERN = re.compile(r'[*_#`\[\]()]+')
+HEADER_MARKER_PATTERN = re.compile(r'^#{1,6}\s*')
+EMPHASIS_PATTERN = re.compile(r'\*{1,2}([^*]+)\*{1,2}')
+LEADING_MARKER_PATTERN = re.compile(r'^[-+=@]+\s*')
+INLINE_FORMATTING_PATTERN = re.compile(r'[_`\[\]()]+')
+SPAN_BULLET_PATTERN = re.compile(r'^[-+=@•·▪▫◦‣⁃]+\s*')
+PAGE_X_OF_Y_PATTERN = re.compile(r'\bpage\s+\d+\s+of\s+\d+\b', flags=re.IGNORECASE)
+X_OF_Y_PATTERN = re.compile(r'\b\d+\s+of\s+\d+\b')
+PAGE_X_PATTERN = re.compile(r'\bpage\s+\d+\b', flags=re.IGNORECASE)
+BARE_NUMBER_PATTERN = re.compile(r'^\s*\d+\s*$')
+
+def is_hashed_header(md_text: str) -> bool:
+    """
+    Check if the markdown text is a header (starts with #)
+    """
+    text = md_text.strip()
+    return text.startswith('#')
+
+def is_table_content(md_text: str) -> bool:
+    """
+    Determine if the markdown text is part of a table.
+    Tables in markdown are identified by the presence of | characters.
+    """
+    # Remove leading/trailing whitespace
+    text = md_text.strip()
+
+    # Check if the line starts and ends with | (typical table row)
+    if text.startswith('|') and text.endswith('|'):
+        return True
+
+    # Check if the line contains multiple | characters (likely a table row)
+    if text.count('|') >= 2:
+        return True
+
+    return False
+
+def clean_table_text(text: str) -> str:
+    """
+    Clean table text for better matching by removing table-specific characters
+    and handling multi-line content.
+    """
+    if not text:
+        return ""
+
+    # Remove | characters used for table formatting
+    cleaned = text.replace('|', '')
+
+    # Handle <br> tags in table cells by replacing with spaces
+    cleaned = BR_TAG_PATTERN.sub(' ', cleaned)
+
+    # Remove extra whitespace
+    cleaned = ' '.join(cleaned.split())
+
+    return cleaned.strip()
+
+def extract_table_cell_content(md_text: str) -> List[str]:
+    """
+    Extract individual cell contents from a table row.
+    """
+    if not is_table_content(md_text):
+        return []
+
+    # Remove leading and trailing |
+    content = md_text.strip()
+    if content.startswith('|'):
+        content = content[1:]
+    if content.endswith('|'):
+        content = content[:-1]
+
+    # Split by | to get individual cells
+    cells = [cell.strip() for cell in content.split('|')]
+
+    # Clean each cell
+    cleaned_cells = []
+    for cell in cells:
+        # Remove markdown formatting like **text**
+        cell_cleaned = BOLD_CELL_PATTERN.sub(r'\1', cell)
+        # Handle <br> tags
+        cell_cleaned = BR_TAG_PATTERN.sub(' ', cell_cleaned)
+        # Clean up whitespace
+        cell_cleaned = ' '.join(cell_cleaned.split())
+        if cell_cleaned:  # Only add non-empty cells
+            cleaned_cells.append(cell_cleaned)
+
+    return cleaned_cells
+
+def clean_text(text: str, is_table: bool = False) -> str:
+    """Clean text for comparison by removing extra whitespace and special characters"""
+    # Remove extra whitespace, newlines, and normalize
+    text = WHITESPACE_PATTERN.sub(' ', text.strip())
+
+    # For table content, remove | characters and handle <br> tags
+    if is_table:
+        text = clean_table_text(text)
+
+    # Remove markdown formatting for comparison
+    text = MARKDOWN_FORMATTING_PATTERN.sub('', text)
+    return text.lower()
+
+def clean_md_line(md_line: str, is_table: bool = None) -> str:
+    """Clean markdown line by removing markdown formatting (is_table: already known is_table_content)"""
+    # Remove leading/trailing whitespace
+    cleaned = md_line.strip()
+
+    # Handle table content first
+    if is_table is None:
+        is_table = is_table_content(cleaned)
+    if is_table:
+        cleaned = clean_table_text(cleaned)
+
+    # Remove markdown headers (# ## ###)
+    cleaned = HEADER_MARKER_PATTERN.sub('', cleaned)
+
+    # Remove bold/italic markers (**text** or *text*)
+    cleaned = EMPHASIS_PATTERN.sub(r'\1', cleaned)
+
+    cleaned = LEADING_MARKER_PATTERN.sub('', cleaned)
+
+    # Remove other markdown formatting
+    cleaned = INLINE_FORMATTING_PATTERN.sub('', cleaned)
+
+    return cleaned.strip()
+
+def clean_span_text(span_text: str) -> str:
+    """Clean span text by removing bullet points and formatting characters"""
+    if not span_text:
+        return ""
+
+    # Remove leading/trailing whitespace
+    cleaned = span_text.strip()
+
+    # Remove bullet points and list markers at the beginning
+    cleaned = SPAN_BULLET_PATTERN.sub('', cleaned)
+
+    return cleaned.strip()
+
+def normalize_for_pattern_detection(line: str) -> str:
+    """Header/footer key of a markdown page line: page numbers folded, whitespace collapsed, lower case"""
+    normalized = line.strip()
+    if len(normalized) < 2: return ""
+    normalized = PAGE_X_OF_Y_PATTERN.sub('page X of Y', normalized)
+    normalized = X_OF_Y_PATTERN.sub('X of Y', normalized)
+    normalized = PAGE_X_PATTERN.sub('page X', normalized)
+    normalized = BARE_NUMBER_PATTERN.sub('X', normalized)
+    normalized = ' '.join(normalized.split()).lower()
+    return normalized
+
+def normalize_md_text(md_text: str) -> Dict:
+    """
+    Every variant of a markdown line the matching stages compare, computed once:
+      'is_table', 'is_hashed': table row / '#' header flags
+      'display':   the cleaned line (md_text_cleaned of the aggregated output)
+      'match_key': display cleaned for comparison, as ratios and confidences use it
+      'table_key': display with table cleaning for table rows, else match_key
+    """
+    is_table = is_table_content(md_text)
+    display = clean_md_line(md_text, is_table)
+    match_key = clean_text(display)
+    return {
+        'is_table': is_table,
+        'is_hashed': is_hashed_header(md_text),
+        'display': display,
+        'match_key': match_key,
+        'table_key': clean_text(display, True) if is_table else match_key,
+    }
+
+def md_line_normalization(md_line_data: Dict) -> Dict:
+    """normalize_md_text of a markdown line record, cached on the record under 'normalized'"""
+    normalized = md_line_data.get('normalized')
+    if normalized is None:
+        normalized = normalize_md_text(md_line_data.get('text', ''))
+        md_line_data['normalized'] = normalized
+    return normalized
@@ -0,0 +1,241 @@
+import csv
+import os
+import re
+import sys
+import pymupdf
+from collections import Counter
+from typing import List, Dict, Optional, Tuple
+
+# "1.2 Results ........ 14", "Introduction · · · · 3", "Appendix A ____ 41"
+LEADER_ENTRY_PATTERN = re.compile(r'^(?P<title>.*?\S)\s*(?:[.·…_\-]\s*){3,}(?P<page>\d{1,4})$')
+# "Introduction        3" (right-aligned page number without leaders)
+SPACED_ENTRY_PATTERN = re.compile(r'^(?P<title>.*?\S)\s{3,}(?P<page>\d{1,4})$')
+CONTENTS_HEADING_PATTERN = re.compile(r'^(table\s+of\s+)?contents$', re.IGNORECASE)
+NUMBERING_PATTERN = re.compile(r'^(\d+(?:\.\d+)*)\.?\s')
+
+# Contents pages are only looked for at the start of a document
+MAX_CONTENTS_START_PAGE = 5
+MIN_TOC_ENTRIES = 3
+# Share of entries whose title must be found on the page they point to
+MIN_VERIFIED_RATIO = 0.8
+# Indentations closer than this (points) belong to the same level
+INDENT_TOLERANCE = 3.0
+
+def toc_key(text: str) -> str:
+    """Comparison key for headings: lowercase, single spaces, no trailing dot"""
+    return ' '.join(str(text).split()).lower().rstrip('.')
+
+def page_text_lines(page) -> List[Dict]:
+    """Text lines of a page with their left edge, largest font size and toc_key"""
+    lines = []
+    for block in page.get_text("dict", flags=pymupdf.TEXTFLAGS_TEXT)["blocks"]:
+        for line in block.get("lines", []):
+            text = ''.join(span["text"] for span in line["spans"]).strip()
+            if text:
+                lines.append({
+                    'text': text,
+                    'key': toc_key(text),
+                    'x0': line["bbox"][0],
+                    'size': round(max(span["size"] for span in line["spans"]), 1),
+                })
+    return lines
+
+def parse_toc_line(text: str) -> Optional[Tuple[str, int]]:
+    match = LEADER_ENTRY_PATTERN.match(text) or SPACED_ENTRY_PATTERN.match(text)
+    if not match:
+        return None
+    title = match.group('title').strip(' .·…_-')
+    if len(title) < 2:
+        return None
+    return title, int(match.group('page'))
+
+def find_contents_entries(doc, max_start_page: int = MAX_CONTENTS_START_PAGE) -> Tuple[List[Dict], List[int]]:
+    """
+    Find the contents page(s) among the first pages and parse their entries.
+    A contents page has a 'Contents' heading or at least MIN_TOC_ENTRIES entry lines;
+    following pages are included while they keep yielding entries.
+    Returns (entries, contents page numbers).
+    """
+    entries = []
+    contents_pages = []
+    for page_index in range(min(doc.page_count, max_start_page + 1)):
+        lines = page_text_lines(doc[page_index])
+        page_entries = []
+        for line in lines:
+            parsed = parse_toc_line(line['text'])
+            if parsed:
+                title, printed_page = parsed
+                page_entries.append({'text': title, 'printed_page': printed_page, 'x0': line['x0']})
+        has_heading = any(CONTENTS_HEADING_PATTERN.match(line['text']) for line in lines)
+        if page_entries and (has_heading or len(page_entries) >= MIN_TOC_ENTRIES or contents_pages):
+            entries.extend(page_entries)
+            contents_pages.append(page_index + 1)
+        elif contents_pages:
+            break
+        elif page_index + 1 >= max_start_page:
+            break
+    return entries, contents_pages
+
+def assign_levels(entries: List[Dict]):
+    """Levels from numbering depth when every entry is numbered, else from indentation rank"""
+    numbered = [NUMBERING_PATTERN.match(entry['text'] + ' ') for entry in entries]
+    if all(numbered):
+        for entry, match in zip(entries, numbered):
+            entry['level'] = match.group(1).count('.') + 1
+        return
+
+    indents = []
+    for x0 in sorted(entry['x0'] for entry in entries):
+        if not indents or x0 - indents[-1] > INDENT_TOLERANCE:
+            indents.append(x0)
+    for entry in entries:
+        entry['level'] = 1 + max(i for i, indent in enumerate(indents) if entry['x0'] >= indent - INDENT_TOLERANCE)
+
+def cover_title(lines: List[Dict]) -> str:
+    """Largest-font line of the first page that is neither the contents heading nor an entry"""
+    candidates = [line for line in lines
+                  if not CONTENTS_HEADING_PATTERN.match(line['text']) and not parse_toc_line(line['text'])]
+    if not candidates:
+        return ""
+    return max(candidates, key=lambda line: line['size'])['text']
+
+def resolve_pages(doc, entries: List[Dict], first_body_page: int) -> Dict[int, List[Dict]]:
+    """
+    Map printed page numbers to physical pages. The offset is the most common
+    difference between where an entry's title is found and its printed number.
+    Each verified entry gets 'page' (1-based) and 'size' (font size of the heading line).
+    Entries are in reading order, so each search resumes from the page where the
+    previous entry was found. Returns the text lines of the pages that were read,
+    keyed by page number.
+    """
+    page_lines = {}
+    page_headings = {}
+    def find_heading(key, page_num):
+        if page_num not in page_headings:
+            page_lines[page_num] = page_text_lines(doc[page_num - 1])
+            headings = {}
+            for line in page_lines[page_num]:
+                headings.setdefault(line['key'], line)
+            page_headings[page_num] = headings
+        return page_headings[page_num].get(key)
+
+    offsets = Counter()
+    search_start = first_body_page
+    for entry in entries:
+        key = toc_key(entry['text'])
+        for page_num in range(search_start, doc.page_count + 1):
+            if find_heading(key, page_num):
+                offsets[page_num - entry['printed_page']] += 1
+                search_start = page_num
+                break
+    offset = offsets.most_common(1)[0][0] if offsets else 0
+
+    for entry in entries:
+        page_num = entry['printed_page'] + offset
+        heading = find_heading(toc_key(entry['text']), page_num) if 1 <= page_num <= doc.page_count else None
+        if heading:
+            entry['page'] = page_num
+            entry['size'] = heading['size']
+    return page_lines
+
+def find_unlisted_headings(doc, entries: List[Dict], page_lines: Dict[int, List[Dict]]) -> List[str]:
+    """
+    Lines set in a TOC heading font that the contents page does not list, on the pages
+    the contents span: from the first verified entry (entries in page order) to the
+    last one plus the longest distance between two entries, for the last section
+    """
+    entry_pages = [entry['page'] for entry in entries]
+    longest_section = max([b - a for a, b in zip(entry_pages, entry_pages[1:])] + [1])
+    first_page, last_page = entry_pages[0], min(doc.page_count, entry_pages[-1] + longest_section)
+    for page_num in range(first_page, last_page + 1):
+        if page_num not in page_lines:
+            page_lines[page_num] = page_text_lines(doc[page_num - 1])
+    body_lines = [line for page_num in range(first_page, last_page + 1) for line in page_lines[page_num]]
+
+    # Sizes shared with body text say nothing about headings
+    size_chars = Counter()
+    for line in body_lines:
+        size_chars[line['size']] += len(line['text'])
+    body_size = size_chars.most_common(1)[0][0] if size_chars else None
+    heading_sizes = {entry['size'] for entry in entries} - {body_size}
+
+    listed = {toc_key(entry['text']) for entry in entries}
+    return [line['text'] for line in body_lines
+            if line['size'] in heading_sizes and len(line['text']) >= 3 and line['key'] not in listed]
+
+def parse_contents_outline(input_pdf_path: str) -> Tuple[Optional[Dict], str]:
+    """
+    Detect a printed contents page and turn it into a candidate outline.
+
+    Returns (outline, reason). outline is None when no usable contents page exists, else
+    {'entries': [{'text', 'level', 'page'}], 'complete': bool, 'contents_pages': [...],
+     'metadata_title': str, 'cover_title': str}.
+    'complete' is False when headings set in the same fonts as the listed ones appear
+    in the body without a contents entry: the outline can then only seed levels.
+    """
+    try:
+        doc = pymupdf.open(input_pdf_path)
+    except Exception as e:
+        return None, f"could not open: {e}"
+
+    try:
+        entries, contents_pages = find_contents_entries(doc)
+        if len(entries) < MIN_TOC_ENTRIES:
+            return None, f"no contents page in the first {MAX_CONTENTS_START_PAGE} pages"
+
+        assign_levels(entries)
+        if entries[0]['level'] != 1:
+            return None, f"contents start at level {entries[0]['level']}"
+
+        first_body_page = contents_pages[-1]
+        page_lines = resolve_pages(doc, entries, first_body_page)
+        verified = [entry for entry in entries if 'page' in entry]
+        if len(verified) < MIN_VERIFIED_RATIO * len(entries):
+            return None, f"only {len(verified)}/{len(entries)} contents entries found on their pages"
+        if any(b['page'] < a['page'] for a, b in zip(verified, verified[1:])):
+            return None, "contents page numbers are not in order"
+
+        unlisted = find_unlisted_headings(doc, verified, page_lines)
+        metadata_title = (doc.metadata or {}).get('title', '') or ''
+        first_page_lines = page_lines[1] if 1 in page_lines else page_text_lines(doc[0])
+    finally:
+        doc.close()
+
+    outline = {
+        'entries': [{'text': entry['text'], 'level': entry['level'], 'page': entry['page']} for entry in verified],
+        'complete': not unlisted,
+        'contents_pages': contents_pages,
+        'metadata_title': metadata_title,
+        'cover_title': cover_title(first_page_lines),
+    }
+    if unlisted:
+        return outline, f"{len(unlisted)} headings missing from contents (e.g. '{unlisted[0]}'), seeding levels only"
+    return outline, f"{len(verified)} entries on contents page(s) {contents_pages}"
+
+def write_toc_seed_csv(outline: Dict, output_csv_path: str):
+    """Write the contents entries used to seed hierarchy levels"""
+    os.makedirs(os.path.dirname(output_csv_path), exist_ok=True)
+    with open(output_csv_path, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=['text', 'level', 'page'])
+        writer.writeheader()
+        for entry in outline['entries']:
+            writer.writerow(entry)
+
+def load_toc_seed(seed_csv_path: str) -> Dict[str, int]:
+    """Map of heading key -> level from a seed CSV written by write_toc_seed_csv"""
+    seed_levels = {}
+    with open(seed_csv_path, 'r', encoding='utf-8') as csvfile:
+        for row in csv.DictReader(csvfile):
+            seed_levels[toc_key(row['text'])] = int(row['level'])
+    return seed_levels
+
+# This block allows you to test this script by itself
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python toc_parser.py <path_to_input.pdf>")
+        sys.exit(1)
+
+    toc_outline, toc_reason = parse_contents_outline(sys.argv[1])
+    print(f"Contents: {toc_reason}")
+    for toc_entry in (toc_outline or {}).get('entries', []):
+        print(f"  {'  ' * (toc_entry['level'] - 1)}H{toc_entry['level']} p{toc_entry['page']}: {toc_entry['text']}")
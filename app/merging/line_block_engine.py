@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import numpy as np
+# The engine runs the extractor's pair features and the textline model in one pass
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'extractor'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'models_code'))
+from csv_generator import iter_document_batches, pair_feature_columns, rounded_column
+from document_model import BlockTable
+from merge_textlines import line_table_block_features, write_block_columns
+from textline_model_tester_batch import load_textline_model, missing_feature_default
+
+def pair_feature_matrix(columns, kept_pairs, span_texts, feature_cols):
+    """
+    Model input of the kept pairs of a batch: its pair feature columns in feature_cols order,
+    line_length_ratio from the span texts (as engineer_features computes it) and the
+    tester's defaults for features the pairs do not have.
+    """
+    matrix = np.empty((len(kept_pairs), len(feature_cols)), dtype=np.float64)
+    for i, feature in enumerate(feature_cols):
+        if feature in columns:
+            matrix[:, i] = np.asarray(columns[feature], dtype=np.float64)[kept_pairs]
+        elif feature == 'line_length_ratio':
+            lengths = np.array([len(text) for text in span_texts], dtype=np.float64)
+            len_b = lengths[1:][kept_pairs]
+            matrix[:, i] = lengths[:-1][kept_pairs] / np.where(len_b == 0, 1.0, len_b)
+        else:
+            matrix[:, i] = missing_feature_default(feature)
+    return matrix
+
+def build_textblocks(aggregated_json_path: str, output_csv_path: str, model, feature_cols, table_override=False):
+    """
+    Textblocks of a document straight from its aggregated JSON Lines file, as step 1's pair
+    CSV, the textline model tester and merge_textlines with its line table would produce them.
+    Per batch of pages: pair features, model predictions (with table_override, pairs with
+    both lines in a table always merge, as textline_model_tester enforces), blocks as runs of
+    merged pairs and the block features from the line columns. Nothing is written in between.
+    """
+    name = os.path.basename(aggregated_json_path)
+    if not os.path.exists(aggregated_json_path):
+        print(f"❌ Error: Input file not found: '{aggregated_json_path}'")
+        return False
+
+    start_time = time.time()
+    line_counts = {'matched': 0, 'hashed': 0}
+    block_columns = {}
+    pair_count = 0
+    merged_count = 0
+    for document in iter_document_batches(aggregated_json_path, name, line_counts):
+        lines = document.lines
+        columns, kept_pairs = pair_feature_columns(document)
+        if len(kept_pairs) == 0:
+            continue
+        labels = model.predict(pair_feature_matrix(columns, kept_pairs, lines.span_text, feature_cols))
+
+        both_in_table = lines.is_in_table[:-1] & lines.is_in_table[1:]
+        merge = np.zeros(len(lines) - 1, dtype=bool)
+        merge[kept_pairs] = labels == 1
+        if table_override:
+            merge[kept_pairs] |= both_in_table[kept_pairs]
+        kept = np.zeros(len(lines) - 1, dtype=bool)
+        kept[kept_pairs] = True
+        blocks = BlockTable.from_pair_links(kept, merge, both_in_table.astype(np.int64))
+
+        # Parts carry the font sizes rounded as the pair CSV and line table store them
+        features = line_table_block_features(lines, blocks, rounded_column(lines.font_size))
+        for key, values in features.items():
+            block_columns.setdefault(key, []).extend(values)
+        pair_count += len(kept_pairs)
+        merged_count += int(merge.sum())
+
+    if pair_count == 0:
+        print(f"⚠️ Warning: No line pairs in {name}.")
+        return False
+
+    os.makedirs(os.path.dirname(output_csv_path), exist_ok=True)
+    write_block_columns(block_columns, output_csv_path)
+    print(f"✅ {name}: {pair_count} line pairs ({merged_count} merged) into {len(block_columns['text'])} text blocks "
+          f"in {time.time() - start_time:.2f}s")
+    return True
+
+def build_all_textblocks(documents, table_override=False):
+    """
+    build_textblocks for (aggregated JSON Lines path, output CSV path) pairs with one
+    loaded textline model. Returns the number of documents with textblocks.
+    """
+    model, feature_cols = load_textline_model()
+    successful = 0
+    for aggregated_json_path, output_csv_path in documents:
+        try:
+            if build_textblocks(aggregated_json_path, output_csv_path, model, feature_cols, table_override):
+                successful += 1
+        except Exception as e:
+            print(f"❌ Error building textblocks of {os.path.basename(aggregated_json_path)}: {e}")
+    return successful
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage: python line_block_engine.py <path_to_agg.jsonl> <path_to_output.csv> [--table-override]")
+        sys.exit(1)
+
+    if not build_all_textblocks([(sys.argv[1], sys.argv[2])], table_override='--table-override' in sys.argv[3:]):
+        sys.exit(1)
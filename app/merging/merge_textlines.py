@@ -1,13 +1,26 @@
 import pandas as pd
+import numpy as np
 import ast
+import csv
 import os
+import sys
 import glob
 from textblob import TextBlob
+from textblob.exceptions import MissingCorpusError
 import re
+# Shared geometry helpers live with the extractor modules
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'extractor'))
+from bbox_geometry import as_boxes, union_boxes, vertical_gaps
+from document_model import LineTable, BlockTable
+
+# Set once TextBlob reports its NLTK corpora missing: every later call would fail the same
+# way, after searching all NLTK data paths again
+textblob_corpus_missing = False
 
 def calculate_verb_ratio(text):
     """Calculates the ratio of verbs to total words in a text string."""
-    if not text:
+    global textblob_corpus_missing
+    if not text or textblob_corpus_missing:
         return 0.0
     try:
         blob = TextBlob(text)
@@ -16,6 +29,9 @@ def calculate_verb_ratio(text):
             return 0.0
         verbs = [word for word, tag in blob.tags if tag.startswith('VB')]
         return len(verbs) / len(words)
+    except MissingCorpusError:
+        textblob_corpus_missing = True
+        return 0.0
     except:
         return 0.0
 
@@ -46,24 +62,54 @@ def get_feature_value(row, feature_name, line_type=None, default_value=0):
     except:
         return default_value
 
-def finalize_block(block_parts):
+def blocks_geometry(blocks):
+    """
+    Union bbox and average vertical gap between consecutive parts for every block,
+    computed over one (N, 4) array of all parts with per-block reductions.
+    """
+    blocks = [block_parts for block_parts in blocks if block_parts]
+    if not blocks:
+        return []
+    boxes = as_boxes([part.get('bbox', [0, 0, 0, 0]) for block_parts in blocks for part in block_parts])
+    sizes = np.array([len(block_parts) for block_parts in blocks], dtype=np.int64)
+    return boxes_geometry(boxes, np.concatenate([[0], np.cumsum(sizes)[:-1]]))
+
+def boxes_geometry(boxes, starts):
+    """blocks_geometry of blocks given as the (N, 4) boxes of all their parts and each block's first row"""
+    if len(starts) == 0:
+        return []
+    sizes = np.diff(np.append(starts, len(boxes)))
+    unions = union_boxes(boxes, starts).tolist()
+    # Gaps that cross a block boundary are masked out before the per-block sums
+    gaps = np.append(vertical_gaps(boxes), 0.0)
+    gaps[starts[1:] - 1] = 0.0
+    gap_sums = np.add.reduceat(gaps, starts).tolist()
+
+    geometry = []
+    for union_bbox, gap_sum, size in zip(unions, gap_sums, sizes.tolist()):
+        geometry.append({
+            'union_bbox': union_bbox,
+            'normalized_vertical_gap': gap_sum / (size - 1) if size > 1 else 0.0,
+        })
+    return geometry
+
+def finalize_block(block_parts, geometry=None):
     """
     Processes a list of block parts to create a single, finalized textblock dictionary.
+    geometry is the block's entry from blocks_geometry; it is computed here when not given.
     """
     if not block_parts:
         return None
+    if geometry is None:
+        geometry = blocks_geometry([block_parts])[0]
 
     full_text = ' '.join(part['text'] for part in block_parts).strip()
-    all_bboxes = [part.get('bbox', [0, 0, 0, 0]) for part in block_parts]
     all_font_sizes = [part.get('font_size', 12.0) for part in block_parts]
 
     avg_font_size = round(sum(all_font_sizes) / len(all_font_sizes), 2) if all_font_sizes else 12.0
     
-    min_x0 = min(b[0] for b in all_bboxes) if all_bboxes else 0
-    min_y0 = min(b[1] for b in all_bboxes) if all_bboxes else 0
-    max_x1 = max(b[2] for b in all_bboxes) if all_bboxes else 0
-    max_y1 = max(b[3] for b in all_bboxes) if all_bboxes else 0
-    union_bbox = [min_x0, min_y0, max_x1, max_y1]
+    union_bbox = geometry['union_bbox']
+    min_x0, min_y0, max_x1, max_y1 = union_bbox
     
     word_count = len(full_text.split())
     is_all_caps = 1 if full_text.isupper() and any(c.isalpha() for c in full_text) else 0
@@ -80,14 +126,8 @@ def finalize_block(block_parts):
     bold_count = sum(1 for part in block_parts if part.get('is_bold', 0))
     is_bold = 1 if bold_count > len(block_parts) / 2 else 0
     
-    # Calculate normalized vertical gap (average gap between parts)
-    normalized_vertical_gap = 0.0
-    if len(block_parts) > 1:
-        gaps = []
-        for i in range(len(block_parts) - 1):
-            gap = block_parts[i+1]['bbox'][1] - block_parts[i]['bbox'][3]  # y_start_next - y_end_current
-            gaps.append(gap)
-        normalized_vertical_gap = sum(gaps) / len(gaps) if gaps else 0.0
+    # Normalized vertical gap (average gap between parts) comes from the batch geometry
+    normalized_vertical_gap = geometry['normalized_vertical_gap']
     
     # Calculate indentation change
     indentation_change = 0.0
@@ -210,43 +250,140 @@ def parse_bbox(bbox_str):
     except:
         return [0, 0, 100, 20]
 
-# REPLACE the old merge_textlines function with this one.
+# Block parts carry no line geometry: pair CSVs never had line boxes, and the textblock
+# model is fed the block features computed from this placeholder
+PART_BBOX = [0.0, 0.0, 100.0, 20.0]
+
+def read_csv_any_encoding(input_csv_path: str, **read_options):
+    """pd.read_csv with the first of the usual encodings that decodes the file"""
+    encodings = ['utf-8', 'utf-8-sig', 'latin-1', 'cp1252', 'iso-8859-1']
+    for encoding in encodings:
+        try:
+            return pd.read_csv(input_csv_path, encoding=encoding, **read_options)
+        except UnicodeDecodeError:
+            continue
+    raise Exception("Could not decode file with any supported encoding")
 
-def merge_textlines(input_csv_path: str, output_csv_path: str):
+def line_table_block_features(lines: LineTable, blocks: BlockTable, font_sizes=None):
     """
-    Merges text lines based on pairwise labels and page numbers from a CSV file.
+    finalize_block features of every block of a block table, as columns (keyed and ordered
+    like finalize_block's dict) computed from the line table columns with per-block
+    reductions. Parts have the PART_BBOX placeholder geometry; font_sizes (default
+    lines.font_size) are the part font sizes. Only the text features loop over blocks.
     """
-    try:
-        # Try different encodings
-        encodings = ['utf-8', 'utf-8-sig', 'latin-1', 'cp1252', 'iso-8859-1']
-        df = None
-        
-        for encoding in encodings:
-            try:
-                df = pd.read_csv(input_csv_path, encoding=encoding)
-                break
-            except UnicodeDecodeError:
-                continue
-        
-        if df is None:
-            raise Exception("Could not decode file with any supported encoding")
-            
-    except Exception as e:
-        print(f"❌ Error loading {input_csv_path}: {e}")
-        return False
+    if len(blocks) == 0:
+        return {}
+    font_sizes = lines.font_size if font_sizes is None else np.asarray(font_sizes, dtype=np.float64)
+    placed = blocks.line
+    starts = blocks.starts
+    sizes = blocks.sizes()
+    ends = starts + sizes - 1
+    seconds = np.minimum(starts + 1, ends)
+    multi_part = sizes > 1
+    boxes = np.tile(PART_BBOX, (len(placed), 1))
+    geometries = boxes_geometry(boxes, starts)
+    unions = np.array([geometry['union_bbox'] for geometry in geometries], dtype=np.float64).reshape(-1, 4)
 
-    if df.empty:
-        print(f"⚠️ Warning: Input CSV is empty.")
-        return False
+    def all_equal(values):
+        return (np.minimum.reduceat(values, starts) == np.maximum.reduceat(values, starts)).astype(np.int64)
+
+    def first(values):
+        return values[starts].astype(np.int64)
+
+    def second(values):
+        return np.where(multi_part, values[seconds], 0).astype(np.int64)
 
-    cols = detect_column_names(df)
-    # Check only required columns
-    required_cols = ['text_a', 'text_b', 'page_number_a', 'page_number_b']
-    for col_name in required_cols:
-        if cols[col_name] is None:
-            print(f"❌ Required column '{col_name}' not found in the CSV.")
-            return False
+    texts = [lines.text[line] for line in placed.tolist()]
+    part_sizes = font_sizes[placed]
+    bold, italic, monospace = (lines.is_bold[placed].astype(np.int64), lines.is_italic[placed].astype(np.int64),
+                               lines.is_monospace[placed].astype(np.int64))
+    in_rectangle, hashed = lines.is_in_table[placed].astype(np.int64), lines.is_hashed[placed].astype(np.int64)
+    in_table = blocks.in_table
 
+    full_texts, avg_font_sizes, word_counts, all_caps, char_densities = [], [], [], [], []
+    ratios_of_verbs, ratios_capitalized, ends_with_colon = [], [], []
+    part_size_list = part_sizes.tolist()
+    for start, size, union_bbox in zip(starts.tolist(), sizes.tolist(), unions.tolist()):
+        full_text = ' '.join(texts[start:start + size]).strip()
+        min_x0, min_y0, max_x1, max_y1 = union_bbox
+        full_texts.append(full_text)
+        avg_font_sizes.append(round(sum(part_size_list[start:start + size]) / size, 2))
+        word_counts.append(len(full_text.split()))
+        all_caps.append(1 if full_text.isupper() and any(c.isalpha() for c in full_text) else 0)
+        char_densities.append(len(full_text.replace(" ", "")) / ((max_x1 - min_x0) * (max_y1 - min_y0))
+                              if (max_x1 > min_x0 and max_y1 > min_y0) else 0.1)
+        ratios_of_verbs.append(calculate_verb_ratio(full_text))
+        ratios_capitalized.append(calculate_capitalized_ratio(full_text))
+        ends_with_colon.append(1 if full_text.strip().endswith(':') else 0)
+
+    first_texts = [texts[start].strip() for start in starts.tolist()]
+    second_texts = [texts[second_part].strip() if several else ''
+                    for second_part, several in zip(seconds.tolist(), multi_part.tolist())]
+    return {
+        'text': full_texts,
+        'bbox': unions.tolist(),
+        'page_number': lines.page_number[placed[starts]].tolist(),
+        'avg_font_size': avg_font_sizes,
+        'word_count': word_counts,
+        'is_all_caps': all_caps,
+        'char_density': char_densities,
+        'ratio_of_verbs': ratios_of_verbs,
+        'ratio_capitalized': ratios_capitalized,
+        'ends_with_colon': ends_with_colon,
+        'is_bold': (np.add.reduceat(bold, starts) > sizes / 2).astype(np.int64).tolist(),
+        'normalized_vertical_gap': [geometry['normalized_vertical_gap'] for geometry in geometries],
+        'indentation_change': np.where(multi_part, np.abs(boxes[ends, 0] - boxes[starts, 0]), 0.0).tolist(),
+        'same_alignment': all_equal(boxes[:, 0]).tolist(),
+        'is_centered_A': ((sizes == 1) & (unions[:, 2] - unions[:, 0] < 200)).astype(np.int64).tolist(),
+        'font_size_diff': np.where(multi_part, np.abs(part_sizes[ends] - part_sizes[starts]), 0.0).tolist(),
+        'same_font': all_equal(part_sizes).tolist(),
+        'is_bold_A': first(bold).tolist(),
+        'is_italic_A': first(italic).tolist(),
+        'is_monospace_A': first(monospace).tolist(),
+        'same_bold': all_equal(bold).tolist(),
+        'same_italic': all_equal(italic).tolist(),
+        'same_monospace': all_equal(monospace).tolist(),
+        'line_a_ends_punctuation': [1 if text and text[-1] in '.!?:;,' else 0 for text in first_texts],
+        'line_b_starts_lowercase': [1 if text and text[0].islower() else 0 for text in second_texts],
+        'is_linea_in_rectangle': first(in_rectangle).tolist(),
+        'is_lineb_in_rectangle': second(in_rectangle).tolist(),
+        'both_in_table': (np.minimum.reduceat(in_table, starts) > 0).astype(np.int64).tolist(),
+        'neither_in_table': (np.maximum.reduceat(in_table, starts) == 0).astype(np.int64).tolist(),
+        'is_linea_hashed': first(hashed).tolist(),
+        'is_lineb_hashed': second(hashed).tolist(),
+        'both_hashed': (np.minimum.reduceat(hashed, starts) > 0).astype(np.int64).tolist(),
+        'neither_hashed': (np.maximum.reduceat(hashed, starts) == 0).astype(np.int64).tolist(),
+        'title_label': [''] * len(starts),
+    }
+
+def write_block_columns(block_columns, output_csv_path: str):
+    """
+    Write block feature columns as DataFrame.to_csv(index=False) writes the blocks: plain
+    Python values, None as an empty field (pd.DataFrame(columns) is slow to build from the
+    per-block lists and bbox lists).
+    """
+    with open(output_csv_path, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile, lineterminator=os.linesep)
+        writer.writerow(block_columns.keys())
+        writer.writerows(zip(*block_columns.values()))
+
+def indexed_pairs(pairs_df, lines: LineTable):
+    """
+    (line_a, line_b, merge, in_table) of every pair row of a CSV with line indices: the pair
+    merges when labelled so and on one page; in_table when both lines are in a table.
+    """
+    line_a = pairs_df['line_a'].to_numpy(dtype=np.int64)
+    line_b = pairs_df['line_b'].to_numpy(dtype=np.int64)
+    merge = (pairs_df['model_labels'].to_numpy() == 1) & (lines.page_number[line_a] == lines.page_number[line_b])
+    in_table = (lines.is_in_table[line_a] & lines.is_in_table[line_b]).astype(np.int64)
+    return list(zip(line_a.tolist(), line_b.tolist(), merge.tolist(), in_table.tolist()))
+
+def pairs_from_rows(df, cols):
+    """
+    Parts and (line_a, line_b, merge, in_table) pairs (as in indexed_pairs, in_table taken
+    from both_in_table) of a pair CSV without line indices, such as hand-labelled files. Its rows carry no line identity, so a row continues the
+    previous one when its line A reads like the previous row's line B.
+    """
     # --- Helper function to create a line part from a row ---
     def create_line_part(row, line_type, cols):
         """Creates a dictionary for a line part directly from a dataframe row."""
@@ -274,18 +411,8 @@ def merge_textlines(input_csv_path: str, output_csv_path: str):
         }
         return part
 
-    # --- New Merging Logic: Iterate through pairs without a global map ---
-    text_blocks = []
-    if df.empty:
-        return True
-
-    # Start the first block with the first line of the first pair
-    first_part = create_line_part(df.iloc[0], 'a', cols)
-    if not first_part:
-        print("❌ Could not process the first line of the CSV.")
-        return False
-    current_block_parts = [first_part]
-
+    parts = []
+    pairs = []
     for _, row in df.iterrows():
         line_a_part = create_line_part(row, 'a', cols)
         line_b_part = create_line_part(row, 'b', cols)
@@ -293,33 +420,102 @@ def merge_textlines(input_csv_path: str, output_csv_path: str):
         if not line_a_part or not line_b_part:
             continue
 
-        # Sequence check: if line 'a' of the current row is not what we expect, finalize the last block.
-        if not current_block_parts or current_block_parts[-1]['text'] != line_a_part['text']:
-            if current_block_parts:
-                text_blocks.append(finalize_block(current_block_parts))
-            current_block_parts = [line_a_part]
-
-        # Determine if line_b should be merged with the current block
+        if pairs and parts[-1]['text'] == line_a_part['text']:
+            line_a = len(parts) - 1
+        else:
+            parts.append(line_a_part)
+            line_a = len(parts) - 1
+        parts.append(line_b_part)
         # NOTE: You will need to change 'model_labels' to 'label' to run on your example file.
-        should_merge = (row['model_labels'] == 1) and (line_a_part['pagenum'] == line_b_part['pagenum'])
+        merge = (row['model_labels'] == 1) and (line_a_part['pagenum'] == line_b_part['pagenum'])
+        pairs.append((line_a, len(parts) - 1, merge, line_a_part['in_table']))
+    return parts, pairs
+
+def merge_line_pairs(pairs):
+    """
+    Group lines into blocks from (line_a, line_b, merge, in_table) pairs in document order,
+    where merge already requires both lines on the same page. A pair whose line A is not
+    the last line of the current block starts a new block (there are no pairs across pages
+    or around dropped lines); line B joins the block when the pair merges. Blocks are lists
+    of (line, in_table), a line taking the in_table flag of the pair it was placed by.
+    """
+    text_blocks = []
+    current_block = []
+    current_line = None
+    for line_a, line_b, merge, in_table in pairs:
+        # Sequence check: if line 'a' of the current pair is not what we expect, finalize the last block.
+        if current_line != line_a:
+            if current_block:
+                text_blocks.append(current_block)
+            current_block = [(line_a, in_table)]
 
-        if should_merge:
-            current_block_parts.append(line_b_part)
+        if merge:
+            current_block.append((line_b, in_table))
         else:
-            text_blocks.append(finalize_block(current_block_parts))
-            current_block_parts = [line_b_part]
+            text_blocks.append(current_block)
+            current_block = [(line_b, in_table)]
+        current_line = line_b
             
     # Add the final block after the loop finishes
-    if current_block_parts:
-        text_blocks.append(finalize_block(current_block_parts))
+    if current_block:
+        text_blocks.append(current_block)
+    return text_blocks
 
-    # --- Create and save the final DataFrame ---
-    output_df = pd.DataFrame([block for block in text_blocks if block])
-    
+def merge_textlines(input_csv_path: str, output_csv_path: str, line_table_path: str = None):
+    """
+    Merges text lines based on pairwise labels and page numbers from a CSV file.
+    With the line table of the CSV (csv_generator), only the line_a/line_b indices and
+    labels of the pairs are read and every line comes from the table; other CSVs are
+    merged from the line texts of their rows.
+    """
+    try:
+        header = read_csv_any_encoding(input_csv_path, nrows=0)
+        indexed = (line_table_path is not None and os.path.exists(line_table_path)
+                   and {'line_a', 'line_b'} <= set(header.columns))
+        if indexed:
+            df = read_csv_any_encoding(input_csv_path, usecols=['line_a', 'line_b', 'model_labels'])
+        else:
+            df = read_csv_any_encoding(input_csv_path)
+    except Exception as e:
+        print(f"❌ Error loading {input_csv_path}: {e}")
+        return False
+
+    if df.empty:
+        print(f"⚠️ Warning: Input CSV is empty.")
+        return False
+
+    if indexed:
+        lines = LineTable.read(line_table_path)
+        pairs = indexed_pairs(df, lines)
+    else:
+        cols = detect_column_names(df)
+        # Check only required columns
+        required_cols = ['text_a', 'text_b', 'page_number_a', 'page_number_b']
+        for col_name in required_cols:
+            if cols[col_name] is None:
+                print(f"❌ Required column '{col_name}' not found in the CSV.")
+                return False
+        parts, pairs = pairs_from_rows(df, cols)
+    if not pairs:
+        print("❌ Could not read any line pair from the CSV.")
+        return False
+    blocks = BlockTable.from_blocks(merge_line_pairs(pairs))
+
+    # Block geometry for the whole document in one batch, then the per-block features:
+    # as columns from the line table, or from each block's parts (with their in_table flag)
     os.makedirs(os.path.dirname(output_csv_path), exist_ok=True)
-    output_df.to_csv(output_csv_path, index=False)
+    if indexed:
+        write_block_columns(line_table_block_features(lines, blocks), output_csv_path)
+    else:
+        boxes = as_boxes([parts[line]['bbox'] for line in blocks.line.tolist()])
+        geometries = boxes_geometry(boxes, blocks.starts)
+        text_blocks = [finalize_block([dict(parts[line], in_table=in_table) for line, in_table in blocks.block(i)],
+                                      geometry)
+                       for i, geometry in enumerate(geometries)]
+        output_df = pd.DataFrame([block for block in text_blocks if block])
+        output_df.to_csv(output_csv_path, index=False)
     
-    print(f"\n✅ Success! Merged into {len(output_df)} text blocks.")
+    print(f"\n✅ Success! Merged into {len(blocks)} text blocks.")
     print(f"📁 Output saved to: '{output_csv_path}'")
     
     return True
@@ -2,12 +2,16 @@ import pandas as pd
 import numpy as np
 import regex as re
 import os
+import sys
 import glob
 from sklearn.preprocessing import StandardScaler
 from sklearn.cluster import DBSCAN
 # Import KMeans for better font clustering
 from sklearn.cluster import KMeans
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'extractor'))
+from toc_parser import toc_key, load_toc_seed
+
 def get_style_clusters(df: pd.DataFrame, feature_columns: list) -> pd.DataFrame:
     """
     Clusters titles based on the available non-semantic features
@@ -78,11 +82,12 @@ def parse_numbering(text: str) -> dict | None:
 
     return None
 
-def build_hierarchy(df: pd.DataFrame, font_size_col: str, page_num_col: str) -> list:
+def build_hierarchy(df: pd.DataFrame, font_size_col: str, page_num_col: str, seed_levels: dict = None) -> list:
     """
     Assigns hierarchy levels. The "Title" is the largest font heading on the 
     first page where headings appear. The remaining body headings are determined 
-    by numbering and KMeans font clustering.
+    by numbering and KMeans font clustering. seed_levels (heading key -> level, from
+    a printed contents page) overrides both for the headings it lists.
     """
     print("\n  Step 3: Building hierarchy with new title logic...")
     if df.empty:
@@ -160,6 +165,12 @@ def build_hierarchy(df: pd.DataFrame, font_size_col: str, page_num_col: str) ->
             lambda info: info.get('depth') if isinstance(info, dict) else np.nan
         )
 
+        # A2. Headings listed on the printed contents page take the contents level
+        if seed_levels:
+            seeded = body_df['text'].map(lambda text: seed_levels.get(toc_key(text)))
+            body_df.loc[seeded.notna(), 'determined_level'] = seeded[seeded.notna()]
+            print(f"  Seeded {int(seeded.notna().sum())} heading levels from the contents page")
+
         # B. For Un-numbered Titles, Cluster by Font Size using KMeans
         unnumbered_mask = body_df['determined_level'].isna()
         if unnumbered_mask.any():
@@ -172,14 +183,20 @@ def build_hierarchy(df: pd.DataFrame, font_size_col: str, page_num_col: str) ->
                 num_clusters = min(max_levels, len(unique_font_sizes))
 
                 if num_clusters > 0:
-                    kmeans = KMeans(n_clusters=num_clusters, random_state=42, n_init='auto').fit(unique_font_sizes.values)
-                    cluster_centers = kmeans.cluster_centers_.flatten()
+                    all_font_sizes = body_df[unnumbered_mask][[font_size_col]].dropna().drop_duplicates()
+                    if num_clusters == len(unique_font_sizes):
+                        # Every distinct size is its own cluster, so the centers are the sizes
+                        # themselves; assign each size to the nearest one without fitting KMeans.
+                        cluster_centers = unique_font_sizes[font_size_col].to_numpy(dtype=float)
+                        labels = np.abs(all_font_sizes.values - cluster_centers[np.newaxis, :]).argmin(axis=1)
+                    else:
+                        kmeans = KMeans(n_clusters=num_clusters, random_state=42, n_init='auto').fit(unique_font_sizes.values)
+                        cluster_centers = kmeans.cluster_centers_.flatten()
+                        labels = kmeans.predict(all_font_sizes.values)
                     level_ranks = np.argsort(cluster_centers)[::-1]
                     cluster_to_level_map = {rank: i + 1 for i, rank in enumerate(level_ranks)}
 
                     font_to_level_map = {}
-                    all_font_sizes = body_df[unnumbered_mask][[font_size_col]].dropna().drop_duplicates()
-                    labels = kmeans.predict(all_font_sizes.values)
                     for i, font_size in enumerate(all_font_sizes[font_size_col]):
                         cluster_label = labels[i]
                         font_to_level_map[font_size] = cluster_to_level_map.get(cluster_label)
@@ -214,7 +231,8 @@ def build_hierarchy(df: pd.DataFrame, font_size_col: str, page_num_col: str) ->
     print("  ✅ Done.")
     return df['hierarchy_level'].tolist()
 
-def process_single_hierarchy_file(input_file: str, output_file: str, style_feature_cols: list, font_size_col: str, page_num_col: str) -> bool:
+def process_single_hierarchy_file(input_file: str, output_file: str, style_feature_cols: list, font_size_col: str, page_num_col: str,
+                                  seed_levels: dict = None) -> bool:
     """Process a single CSV file for hierarchy analysis"""
     try:
         print(f"\n📄 Processing: {os.path.basename(input_file)}")
@@ -250,7 +268,7 @@ def process_single_hierarchy_file(input_file: str, output_file: str, style_featu
         titles_df['numbering_info'] = titles_df['text'].apply(parse_numbering)
         print("  ✅ Done.")
 
-        titles_df['hierarchy_level'] = build_hierarchy(titles_df, font_size_col, page_num_col)
+        titles_df['hierarchy_level'] = build_hierarchy(titles_df, font_size_col, page_num_col, seed_levels)
         
         print("\n  --- Final Document Hierarchy ---")
         
@@ -283,8 +301,11 @@ def process_single_hierarchy_file(input_file: str, output_file: str, style_featu
         print(f"  ❌ Error processing {os.path.basename(input_file)}: {e}")
         return False
 
-def process_all_hierarchy_files(input_folder, output_folder):
-    """Process all files in the input folder for hierarchy analysis"""
+def process_all_hierarchy_files(input_folder, output_folder, seed_folder=None):
+    """
+    Process all files in the input folder for hierarchy analysis.
+    seed_folder may hold toc_seed_{pdf_name}.csv files with contents-page levels.
+    """
     print(f"Processing hierarchy files from: {input_folder}")
     print(f"Output folder: {output_folder}")
     
@@ -349,8 +370,16 @@ def process_all_hierarchy_files(input_folder, output_folder):
         
         output_csv = os.path.join(output_folder, output_filename)
         
+        seed_levels = None
+        if seed_folder:
+            pdf_name = filename.split('truth_')[-1][:-len('.csv')]
+            seed_csv = os.path.join(seed_folder, f"toc_seed_{pdf_name}.csv")
+            if os.path.exists(seed_csv):
+                seed_levels = load_toc_seed(seed_csv)
+
         # Pass the page number column name to the processing function
-        success = process_single_hierarchy_file(input_csv, output_csv, style_feature_cols, font_size_col, page_num_col)
+        success = process_single_hierarchy_file(input_csv, output_csv, style_feature_cols, font_size_col, page_num_col,
+                                                seed_levels)
         
         if success:
             successful_files += 1
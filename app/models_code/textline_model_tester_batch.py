@@ -9,6 +9,18 @@ from sklearn.model_selection import train_test_split
 import warnings
 warnings.filterwarnings('ignore')
 
+# Features of models saved without their feature list
+DEFAULT_FEATURE_COLUMNS = [
+    'normalized_vertical_gap', 'indentation_change', 'same_alignment',
+    'is_centered_A', 'is_centered_B', 'font_size_a', 'font_size_b', 'font_size_diff',
+    'same_font', 'is_bold_A', 'is_bold_B', 'is_italic_A', 'is_italic_B',
+    'is_monospace_A', 'is_monospace_B', 'same_bold', 'same_italic', 'same_monospace',
+    'line_a_ends_punctuation', 'line_b_starts_lowercase', 'is_linea_in_rectangle',
+    'is_lineb_in_rectangle', 'both_in_table', 'neither_in_table',
+    'is_linea_hashed', 'is_lineb_hashed', 'both_hashed', 'neither_hashed',
+    'line_length_ratio'
+]
+
 def create_default_model():
     """Create a default model if none exists"""
     print("No trained model found. Creating a default model...")
@@ -17,16 +29,7 @@ def create_default_model():
     model = RandomForestClassifier(n_estimators=100, random_state=42)
     
     # Create dummy training data to fit the model
-    feature_cols = [
-        'normalized_vertical_gap', 'indentation_change', 'same_alignment',
-        'is_centered_A', 'is_centered_B', 'font_size_a', 'font_size_b', 'font_size_diff',
-        'same_font', 'is_bold_A', 'is_bold_B', 'is_italic_A', 'is_italic_B',
-        'is_monospace_A', 'is_monospace_B', 'same_bold', 'same_italic', 'same_monospace',
-        'line_a_ends_punctuation', 'line_b_starts_lowercase', 'is_linea_in_rectangle',
-        'is_lineb_in_rectangle', 'both_in_table', 'neither_in_table',
-        'is_linea_hashed', 'is_lineb_hashed', 'both_hashed', 'neither_hashed',
-        'line_length_ratio'
-    ]
+    feature_cols = list(DEFAULT_FEATURE_COLUMNS)
     
     # Generate dummy data
     n_samples = 1000
@@ -51,6 +54,35 @@ def create_default_model():
     print(f"✅ Default model created and saved to {model_file}")
     return model, feature_cols
 
+def load_textline_model(model_file='./app/models/textline_models/text_block_merger_model.joblib'):
+    """Textline merge model and its feature columns (model path relative to the pipeline root)"""
+    try:
+        print(f"Loading model from '{model_file}'...")
+        model_data = joblib.load(model_file)
+        
+        if isinstance(model_data, dict):
+            model = model_data['model']
+            feature_cols = model_data.get('feature_columns', [])
+        else:
+            model = model_data
+            feature_cols = list(DEFAULT_FEATURE_COLUMNS)
+        
+        print("✅ Model loaded successfully")
+        print(f"🔧 Using {len(feature_cols)} features")
+        
+    except FileNotFoundError:
+        print(f"Model file not found. Creating default model...")
+        model, feature_cols = create_default_model()
+    return model, feature_cols
+
+def missing_feature_default(feature):
+    """Value of a model feature the pair data does not have"""
+    if 'gap' in feature or 'size' in feature:
+        return 0.0
+    elif 'ratio' in feature:
+        return 1.0
+    return 0
+
 def engineer_features(df, text_col_a, text_col_b):
     """Engineer features for the dataframe"""
     if text_col_a and text_col_b and text_col_a in df.columns and text_col_b in df.columns:
@@ -159,12 +191,7 @@ def process_single_file(test_file, model, feature_cols, output_folder):
         
         # Fill missing features with default values
         for feature in missing_features:
-            if 'gap' in feature or 'size' in feature:
-                df[feature] = 0.0
-            elif 'ratio' in feature:
-                df[feature] = 1.0
-            else:
-                df[feature] = 0
+            df[feature] = missing_feature_default(feature)
             print(f"  🔧 Created missing feature '{feature}' with default values")
         
         # Check if labels exist (for evaluation only)
@@ -229,35 +256,7 @@ def test_all_files(test_folder, output_folder):
     # Create output folder
     os.makedirs(output_folder, exist_ok=True)
     
-    # Load model with relative path from pipeline
-    model_file = './app/models/textline_models/text_block_merger_model.joblib'
-
-    try:
-        print(f"Loading model from '{model_file}'...")
-        model_data = joblib.load(model_file)
-        
-        if isinstance(model_data, dict):
-            model = model_data['model']
-            feature_cols = model_data.get('feature_columns', [])
-        else:
-            model = model_data
-            feature_cols = [
-                'normalized_vertical_gap', 'indentation_change', 'same_alignment',
-                'is_centered_A', 'is_centered_B', 'font_size_a', 'font_size_b', 'font_size_diff',
-                'same_font', 'is_bold_A', 'is_bold_B', 'is_italic_A', 'is_italic_B',
-                'is_monospace_A', 'is_monospace_B', 'same_bold', 'same_italic', 'same_monospace',
-                'line_a_ends_punctuation', 'line_b_starts_lowercase', 'is_linea_in_rectangle',
-                'is_lineb_in_rectangle', 'both_in_table', 'neither_in_table',
-                'is_linea_hashed', 'is_lineb_hashed', 'both_hashed', 'neither_hashed',
-                'line_length_ratio'
-            ]
-        
-        print("✅ Model loaded successfully")
-        print(f"🔧 Using {len(feature_cols)} features")
-        
-    except FileNotFoundError:
-        print(f"Model file not found. Creating default model...")
-        model, feature_cols = create_default_model()
+    model, feature_cols = load_textline_model()
     
     # Find all CSV files
     csv_pattern = os.path.join(test_folder, '*.csv')
@@ -13,17 +13,45 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'app', 'merging'))
 # Your imports for extractor, merging, etc.
 from app.extractor.extractor import extract_all_pdfs
 from app.merging.merge_textlines import merge_textlines
+from app.merging.line_block_engine import build_all_textblocks
+from app.extractor.csv_generator import line_table_path_for
 from app.models_code.textline_model_tester_batch import test_all_files
 from app.models_code.textblock_model_tester_batch import test_all_textblock_files
 from app.models_code.run_hierarchy_batch import process_all_hierarchy_files
+from app.extractor.outline_extractor import process_outline_fast_path
+from app.extractor.preflight import MIN_PREVIEW_PAGES
 
 
 class DocumentProcessingPipeline:
 
-    def __init__(self, input_folder, final_output_folder):
+    def __init__(self, input_folder, final_output_folder, use_outline_fast_path=False, markdown_workers=None,
+                 selective_markdown=False, preview_pages=None, ocr_dpi=None, aligned_matching=False,
+                 aggregation_workers=None, staged_textlines=False):
         """Initialize the pipeline with master input/output paths."""
         self.input_folder = input_folder
         self.final_output_folder = final_output_folder
+        self.use_outline_fast_path = use_outline_fast_path
+        # pymupdf4llm worker processes per PDF (None = automatic, 1 = sequential)
+        self.markdown_workers = markdown_workers
+        # Run pymupdf4llm only on pages with headings, tables or several columns
+        self.selective_markdown = selective_markdown
+        # Preview mode: process only the first N pages with text of each PDF (None = whole documents)
+        self.preview_pages = max(preview_pages, MIN_PREVIEW_PAGES) if preview_pages else None
+        # OCR pages without a text layer at this resolution (None = skip them)
+        self.ocr_dpi = ocr_dpi
+        # Match markdown lines to spans by walking both in reading order
+        self.aligned_matching = aligned_matching
+        # Aggregation worker processes per PDF (None = automatic, 1 = sequential)
+        self.aggregation_workers = aggregation_workers
+        # Turn lines into blocks through the pair CSVs, textline prediction files and merge
+        # (steps 2 and 3) instead of the fused in-memory engine
+        self.staged_textlines = staged_textlines
+        # PDFs extracted by step 1
+        self.extracted_pdfs = []
+        # PDFs longer than preview_pages, whose outline is therefore partial
+        self.truncated_pdfs = set()
+        # pdf_name -> 'embedded_outline', 'printed_toc' or 'ml_pipeline'
+        self.processing_paths = {}
         
         # All intermediate files will live in one temporary directory inside the container.
         self.temp_dir = "/app/data"
@@ -34,6 +62,7 @@ class DocumentProcessingPipeline:
             'textline_predictions': os.path.join(self.temp_dir, 'textline_predictions'),
             'merged_textblocks': os.path.join(self.temp_dir, 'merged_textblocks'),
             'textblock_predictions': os.path.join(self.temp_dir, 'textblock_predictions'),
+            'toc_seeds': os.path.join(self.temp_dir, 'toc_seeds'),
         }
         self.create_directories()
 
@@ -45,20 +74,56 @@ class DocumentProcessingPipeline:
             os.makedirs(path, exist_ok=True)
         os.makedirs(self.final_output_folder, exist_ok=True)
 
+    def step0_outline_fast_path(self):
+        print("\n--- STEP 0: OUTLINE FAST PATH (BOOKMARKS, CONTENTS PAGE) ---")
+        self.processing_paths = process_outline_fast_path(self.input_folder, self.final_output_folder,
+                                                          seed_dir=self.intermediate_paths['toc_seeds'])
+        fast_path_count = len(self.fast_path_pdfs())
+        print(f"✅ Step 0 completed: {fast_path_count}/{len(self.processing_paths)} PDFs answered from bookmarks or contents pages.")
+
+    def fast_path_pdfs(self):
+        return [pdf for pdf, path in self.processing_paths.items() if path != 'ml_pipeline']
+
     def step1_extract_pdfs(self):
         print("\n--- STEP 1: PDF EXTRACTION ---")
-        successful, failed, _, _ = extract_all_pdfs(
+        successful, failed, all_results, _ = extract_all_pdfs(
             self.input_folder,
-            self.intermediate_paths['textlines_csv'],self.temp_dir 
+            self.intermediate_paths['textlines_csv'],self.temp_dir,
+            skip_pdfs=self.fast_path_pdfs(),
+            markdown_workers=self.markdown_workers,
+            selective_markdown=self.selective_markdown,
+            preview_pages=self.preview_pages,
+            ocr_dpi=self.ocr_dpi,
+            aligned_matching=self.aligned_matching,
+            aggregation_workers=self.aggregation_workers,
+            pair_csv=self.staged_textlines
         )
+        self.truncated_pdfs = {pdf for pdf, (_, results) in all_results.items() if results.get('truncated')}
+        if self.truncated_pdfs:
+            print(f"👁️  Preview mode: {len(self.truncated_pdfs)} PDFs limited to their first {self.preview_pages} pages with text.")
         if failed:
             print(f"⚠️  Warning: {len(failed)} PDFs failed extraction: {failed}")
         if not successful:
             print("❌ Step 1 failed: No PDFs were successfully extracted.")
             return None
         print(f"✅ Step 1 completed: {len(successful)} PDFs successfully extracted.")
+        self.extracted_pdfs = successful
         return successful
 
+    def step2_build_textblocks(self):
+        print("\n--- STEPS 2-3: TEXTLINES TO TEXTBLOCKS (FUSED) ---")
+        # Aggregated files as step 1 names them; textblocks under the names merge_textlines gives them
+        documents = [(os.path.join(self.temp_dir, 'aggregator_output', f"aggregated_{pdf_name}.jsonl"),
+                      os.path.join(self.intermediate_paths['merged_textblocks'],
+                                   f"predictions_textlines_ground_truth_{pdf_name}.csv"))
+                     for pdf_name in self.extracted_pdfs]
+        successful = build_all_textblocks(documents)
+        if successful > 0:
+            print(f"✅ Steps 2-3 completed: textblocks of {successful}/{len(documents)} PDFs.")
+            return True
+        print("❌ Steps 2-3 failed: No PDF had any textline pairs.")
+        return False
+
     def step2_textline_model_testing(self):
         print("\n--- STEP 2: TEXTLINE MODEL TESTING ---")
         csv_files = glob.glob(os.path.join(self.intermediate_paths['textlines_csv'], '*.csv'))
@@ -87,7 +152,10 @@ class DocumentProcessingPipeline:
         for pred_file in prediction_files:
             try:
                 output_path = os.path.join(self.intermediate_paths['merged_textblocks'], os.path.basename(pred_file))
-                if merge_textlines(pred_file, output_path):
+                # Lines come from the line table written next to the textline CSV the predictions were made on
+                textline_csv = os.path.join(self.intermediate_paths['textlines_csv'],
+                                            os.path.basename(pred_file)[len('predictions_'):])
+                if merge_textlines(pred_file, output_path, line_table_path_for(textline_csv)):
                     successful_merges += 1
                 else:
                     print(f"⚠️  Warning: Merging failed for {os.path.basename(pred_file)}")
@@ -128,7 +196,8 @@ class DocumentProcessingPipeline:
 
         success = process_all_hierarchy_files(
             input_folder=self.intermediate_paths['textblock_predictions'],
-            output_folder=self.final_output_folder 
+            output_folder=self.final_output_folder,
+            seed_folder=self.intermediate_paths['toc_seeds']
         )
         if success:
             print("✅ Step 5 completed.")
@@ -141,25 +210,22 @@ class DocumentProcessingPipeline:
         start_time = time.time()
         
         try:
-            if not self.step1_extract_pdfs():
-                raise RuntimeError("Step 1 (PDF Extraction) failed, stopping pipeline.")
-            
-            if not self.step2_textline_model_testing():
-                raise RuntimeError("Step 2 (Textline Testing) failed, stopping pipeline.")
-            
-            if not self.step3_merge_textlines():
-                raise RuntimeError("Step 3 (Merge Textlines) failed, stopping pipeline.")
-            
-            if not self.step4_textblock_model_testing():
-                raise RuntimeError("Step 4 (Textblock Testing) failed, stopping pipeline.")
-            
-            if not self.step5_run_hierarchy():
-                raise RuntimeError("Step 5 (Hierarchy Analysis) failed, stopping pipeline.")
+            if self.use_outline_fast_path:
+                self.step0_outline_fast_path()
+
+            if self.processing_paths and len(self.fast_path_pdfs()) == len(self.processing_paths):
+                print("\nAll PDFs were answered from bookmarks or contents pages, skipping the ML pipeline.")
+            else:
+                self.run_ml_steps()
 
             total_time = time.time() - start_time
             print(f"\n{'='*80}")
             print("🎉 PIPELINE COMPLETED SUCCESSFULLY!")
             print(f"⏱️  Total processing time: {total_time:.2f} seconds")
+            if self.processing_paths:
+                print("🛣️  Processing path per PDF:")
+                for pdf_name, path in sorted(self.processing_paths.items()):
+                    print(f"   - {pdf_name}: {path}")
             print(f"📁 Final results available in: {self.final_output_folder}")
             print(f"{'='*80}")
             return True
@@ -168,4 +234,25 @@ class DocumentProcessingPipeline:
             print(f"\n❌ PIPELINE FAILED: {e}")
             import traceback
             traceback.print_exc()
-            return False
\ No newline at end of file
+            return False
+
+    def run_ml_steps(self):
+        """Run the extraction and model steps (1-5), raising on the first failed step."""
+        if not self.step1_extract_pdfs():
+            raise RuntimeError("Step 1 (PDF Extraction) failed, stopping pipeline.")
+        
+        if not self.staged_textlines:
+            if not self.step2_build_textblocks():
+                raise RuntimeError("Steps 2-3 (Textlines to Textblocks) failed, stopping pipeline.")
+        else:
+            if not self.step2_textline_model_testing():
+                raise RuntimeError("Step 2 (Textline Testing) failed, stopping pipeline.")
+            
+            if not self.step3_merge_textlines():
+                raise RuntimeError("Step 3 (Merge Textlines) failed, stopping pipeline.")
+        
+        if not self.step4_textblock_model_testing():
+            raise RuntimeError("Step 4 (Textblock Testing) failed, stopping pipeline.")
+        
+        if not self.step5_run_hierarchy():
+            raise RuntimeError("Step 5 (Hierarchy Analysis) failed, stopping pipeline.")
\ No newline at end of file
@@ -7,9 +7,11 @@ import pandas as pd
 
 # This assumes your main pipeline logic is in complete_pipeline.py
 from complete_pipeline import DocumentProcessingPipeline
+from app.extractor.ocr_stage import OCR_DPI
 
-def convert_csv_to_json(csv_file, output_dir):
-    """Converts the final CSV from the pipeline to the expected JSON format."""
+def convert_csv_to_json(csv_file, output_dir, truncated_pdfs=(), preview_pages=None):
+    """Converts the final CSV from the pipeline to the expected JSON format.
+    Outlines of PDFs in truncated_pdfs only cover the first preview_pages pages and are marked so."""
     try:
         df = pd.read_csv(csv_file)
         # Derive the original PDF name from the complex CSV name
@@ -19,6 +21,9 @@ def convert_csv_to_json(csv_file, output_dir):
 
         # Create the simple JSON structure Round 1B expects
         json_data = {"outline": []}
+        if base_name.split('truth_')[-1][:-len('.csv')] in truncated_pdfs:
+            json_data["truncated"] = True
+            json_data["pages_processed"] = preview_pages
         for _, row in df.iterrows():
             # ✅ Convert 1-indexed page number to 0-indexed
             page_num = row.get('page_number', 1)
@@ -49,6 +54,25 @@ def main():
     print("hello from docker_runner.py")
     input_dir = os.getenv('INPUT_DIR', '/app/input')
     output_dir = os.getenv('OUTPUT_DIR', '/app/output')
+    # Optional: answer PDFs with a trustworthy bookmark tree or contents page straight from it
+    use_outline_fast_path = os.getenv('USE_OUTLINE_FAST_PATH', '0') == '1'
+    # Optional: pymupdf4llm worker processes per PDF (unset = automatic, 1 = sequential)
+    markdown_workers = os.getenv('MARKDOWN_WORKERS')
+    markdown_workers = int(markdown_workers) if markdown_workers else None
+    # Optional: convert only the pages that need markdown, plain text for the rest
+    selective_markdown = os.getenv('SELECTIVE_MARKDOWN', '0') == '1'
+    # Optional: preview mode, only the title and headings of the first N pages with text (N >= 3)
+    preview_pages = os.getenv('PREVIEW_PAGES')
+    preview_pages = int(preview_pages) if preview_pages else None
+    # Optional: OCR pages without a text layer with tesseract, rendered at OCR_DPI (default 300)
+    ocr_dpi = int(os.getenv('OCR_DPI', OCR_DPI)) if os.getenv('OCR_PAGES', '0') == '1' else None
+    # Optional: match markdown lines to spans in a reading-order window, full page search only for outliers
+    aligned_matching = os.getenv('ALIGNED_MATCHING', '0') == '1'
+    # Optional: aggregation worker processes per PDF (unset = automatic, 1 = sequential)
+    aggregation_workers = os.getenv('AGGREGATION_WORKERS')
+    aggregation_workers = int(aggregation_workers) if aggregation_workers else None
+    # Optional: build textblocks through the pair CSVs and textline prediction files instead of in memory
+    staged_textlines = os.getenv('STAGED_TEXTLINES', '0') == '1'
 
     os.makedirs(input_dir, exist_ok=True)
     os.makedirs(output_dir, exist_ok=True)
@@ -66,7 +90,15 @@ def main():
     # Initialize and run the pipeline from your existing script
     pipeline = DocumentProcessingPipeline(
         input_folder=input_dir, 
-        final_output_folder="/app/temp_results"
+        final_output_folder="/app/temp_results",
+        use_outline_fast_path=use_outline_fast_path,
+        markdown_workers=markdown_workers,
+        selective_markdown=selective_markdown,
+        preview_pages=preview_pages,
+        ocr_dpi=ocr_dpi,
+        aligned_matching=aligned_matching,
+        aggregation_workers=aggregation_workers,
+        staged_textlines=staged_textlines
     )
 
     
@@ -81,7 +113,7 @@ def main():
         sys.exit(1)
         
     for csv_file in final_csvs:
-        convert_csv_to_json(csv_file, output_dir)
+        convert_csv_to_json(csv_file, output_dir, pipeline.truncated_pdfs, pipeline.preview_pages)
         
     print("\n🎉 Round 1A completed successfully!")
 